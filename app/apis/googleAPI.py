@@ -1,8 +1,18 @@
 import json
-import requests
-from app import config, logs
-from datetime import timedelta
-from ratelimit import limits, sleep_and_retry
+import urllib.parse
+from app import config, logs, metrics
+from app.apis import httpClient
+from app import isbnNormalization
+from app.database import LMH_response_cache
+
+# Name used for this source's rate limit
+SOURCE_NAME = "Google Books"
+# Only the parts of a volume parse_google_data reads are asked for, which keeps the responses a fraction of their size
+FIELDS = "totalItems,items(volumeInfo/industryIdentifiers)"
+# Numbers ORed together into one search by prefetch, the volumes per page (Google's most) and the pages read for one
+BATCH_SIZE = 20
+PAGE_SIZE = 40
+MAX_PAGES = 3
 
 
 def parse_google_data(entry, number, retrieval_settings, is_oclc, is_isbn):
@@ -47,35 +57,116 @@ def parse_google_data(entry, number, retrieval_settings, is_oclc, is_isbn):
     return entry
 
 
-@sleep_and_retry
-@limits(calls=10, period=timedelta(seconds=10).total_seconds())
 def retrieve_data_from_google(number, looking_for_status, is_oclc, is_isbn):
-    config_file = config.load_config()
-
-    if is_isbn:
-        base_url = "https://www.googleapis.com/books/v1/volumes?q=isbn:"
-        key = "&key="
-        api_key = config_file["google_api_key"]
-        full_url = f"{base_url}{number}{key}{api_key}"
-    if is_oclc:
-        base_url = "https://www.googleapis.com/books/v1/volumes?q=oclc:"
-        key = "&key="
-        api_key = config_file["google_api_key"]
-        full_url = f"{base_url}{number}{key}{api_key}"
+    return httpClient.run(retrieve_data_from_google_async(number, looking_for_status, is_oclc, is_isbn))
+
+
+async def retrieve_data_from_google_async(number, looking_for_status, is_oclc, is_isbn):
+    settings = config.get_settings()
+
+    # parse_google_data only reads the first volume found
+    full_url = _volumes_url(_term(number, is_oclc), 0, 1, settings.google_api_key)
+    cache_key = _term(number, is_oclc)
 
     try:
         if looking_for_status:
-            response = requests.get(full_url, timeout=config_file["search_timeout"])
-            return response.status_code
+            return await httpClient.get_status(full_url, settings.search_timeout, SOURCE_NAME)
 
-        response = requests.get(full_url, timeout=config_file["search_timeout"])
-        response.raise_for_status()  # Raise an HTTPError for bad responses
-        data = response.content.decode('utf-8')  # Decode the byte string
+        data = await httpClient.get_text(full_url, settings.search_timeout, SOURCE_NAME, cache_key,
+                                         found_nothing=lambda body: not json.loads(body).get('totalItems'))
+        if data is None:
+            return None
 
         # Parse the extracted JSON data
-        parsed_data = json.loads(data)
+        with metrics.timed("json_parse", SOURCE_NAME):
+            parsed_data = json.loads(data)
 
         return parsed_data
-    except requests.exceptions.RequestException as e:
+    except httpClient.HTTP_ERRORS as e:
         logs.log_error(f"Error retrieving data from Google Books: {e}")
         return None
+
+
+def _term(number, is_oclc):
+    # Also the cache key, searches by ISBN and by OCLC number are cached apart since the numbers could clash
+    return f"{'oclc' if is_oclc else 'isbn'}:{number}"
+
+
+def _volumes_url(query, start_index, max_results, api_key):
+    return (f"https://www.googleapis.com/books/v1/volumes?q={urllib.parse.quote(query)}&startIndex={start_index}"
+            f"&maxResults={max_results}&fields={urllib.parse.quote(FIELDS)}&key={api_key}")
+
+
+def volume_numbers(volume, is_oclc):
+    """
+    Returns the set of numbers a volume is for, its OCLC numbers for
+    OCLC input and its ISBNs as ISBN-13s otherwise, so it can be
+    matched to the input values of a batched search.
+    """
+    numbers = set()
+    identifiers = volume.get('volumeInfo', {}).get('industryIdentifiers', []) if isinstance(volume, dict) else []
+    for identifier in identifiers:
+        if not isinstance(identifier, dict):
+            continue
+        value = identifier.get('identifier') or ''
+        if is_oclc and value[:4] == "OCLC":
+            numbers.add(isbnNormalization.normalize_oclc(value))
+        elif not is_oclc and identifier.get('type') in ('ISBN_10', 'ISBN_13'):
+            numbers.add(isbnNormalization.isbn13(value))
+    numbers.discard('')
+    return numbers
+
+
+def prefetch(numbers, is_oclc, is_isbn):
+    """
+    Searches Google Books for many numbers with one OR query per
+    BATCH_SIZE of them, reading up to MAX_PAGES pages of volumes, and
+    gives every volume to the input values it is for by its industry
+    identifiers. Each value's volumes are stored in the response cache
+    in the same form a search for just that value gives, which
+    parse_google_data then uses. Values with no volumes are left to
+    parse_google_data to search for on their own.
+    """
+    numbers = [number for number in dict.fromkeys(numbers)
+               if not LMH_response_cache.is_known(SOURCE_NAME, _term(number, is_oclc))]
+    httpClient.run(prefetch_async(numbers, is_oclc, is_isbn))
+
+
+async def prefetch_async(numbers, is_oclc, is_isbn):
+    for start in range(0, len(numbers), BATCH_SIZE):
+        batch = numbers[start:start + BATCH_SIZE]
+        try:
+            volumes = await _search_batch(batch, is_oclc)
+        except (httpClient.HTTP_ERRORS + (ValueError,)) as e:
+            logs.log_error(f"Error retrieving a batch of {len(batch)} values from Google Books: {e}")
+            continue
+
+        by_number = {}
+        for volume in volumes:
+            for key in volume_numbers(volume, is_oclc):
+                by_number.setdefault(key, []).append(volume)
+
+        # A number the batch found nothing for is searched for on its own, since the OR query may not have matched it
+        # or its volumes may be past the last page read
+        for number in batch:
+            key = isbnNormalization.normalize_oclc(number) if is_oclc else isbnNormalization.isbn13(number)
+            found = by_number.get(key)
+            if found is not None:
+                body = json.dumps({'totalItems': len(found), 'items': found})
+                await httpClient.in_thread(LMH_response_cache.prefetch, SOURCE_NAME, _term(number, is_oclc), body)
+
+
+async def _search_batch(batch, is_oclc):
+    # Returns the volumes an OR search for the batch found, from up to MAX_PAGES pages
+    settings = config.get_settings()
+    query = " OR ".join(_term(number, is_oclc) for number in batch)
+    volumes = []
+    for page in range(MAX_PAGES):
+        full_url = _volumes_url(query, page * PAGE_SIZE, PAGE_SIZE, settings.google_api_key)
+        data = await httpClient.get_text(full_url, settings.search_timeout, SOURCE_NAME)
+        with metrics.timed("json_parse", SOURCE_NAME):
+            items = json.loads(data).get('items') or []
+        volumes.extend(items)
+        if len(items) < PAGE_SIZE:
+            break
+    return volumes
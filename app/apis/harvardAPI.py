@@ -1,8 +1,11 @@
 import json
-import requests
-from app import config, logs
+from app import config, logs, metrics
+from app.apis import httpClient
 from app import callNumberValidation
 
+# Name used for this source's rate limit
+SOURCE_NAME = "Harvard"
+
 
 def parse_harvard_data(entry, number, retrieval_settings):
     harvard_data = retrieve_data_from_harvard(number, False)
@@ -61,7 +64,11 @@ def parse_harvard_data(entry, number, retrieval_settings):
 
 
 def retrieve_data_from_harvard(isbn, looking_for_status):
-    config_file = config.load_config()
+    return httpClient.run(retrieve_data_from_harvard_async(isbn, looking_for_status))
+
+
+async def retrieve_data_from_harvard_async(isbn, looking_for_status):
+    settings = config.get_settings()
 
     base_url = "http://webservices.lib.harvard.edu/rest/v3/hollis/mods/isbn/"
     jsonp = "?jsonp=record"
@@ -69,12 +76,11 @@ def retrieve_data_from_harvard(isbn, looking_for_status):
 
     try:
         if looking_for_status:
-            response = requests.get(full_url, timeout=config_file["search_timeout"])
-            return response.status_code
+            return await httpClient.get_status(full_url, settings.search_timeout, SOURCE_NAME)
 
-        response = requests.get(full_url, timeout=config_file["search_timeout"])
-        response.raise_for_status()  # Raise an HTTPError for bad responses
-        data = response.content.decode('utf-8')  # Decode the byte string
+        data = await httpClient.get_text(full_url, settings.search_timeout, SOURCE_NAME, isbn)
+        if data is None:
+            return None
 
         # Extract JSON data from the response (assuming the JSON is inside parentheses)
         json_start = data.find('(') + 1
@@ -82,9 +88,10 @@ def retrieve_data_from_harvard(isbn, looking_for_status):
         json_data = data[json_start:json_end]
 
         # Parse the extracted JSON data
-        parsed_data = json.loads(json_data)
+        with metrics.timed("json_parse", SOURCE_NAME):
+            parsed_data = json.loads(json_data)
 
         return parsed_data
-    except requests.exceptions.RequestException as e:
+    except httpClient.HTTP_ERRORS as e:
         logs.log_error(f"Error retrieving data from Harvard: {e}")
         return None
@@ -0,0 +1,263 @@
+import asyncio
+import atexit
+import contextvars
+import functools
+import threading
+import time
+import aiohttp
+from urllib.parse import urlparse
+from app import config, metrics
+from app.apis import rateLimiter, sourceHealth
+from app.database import LMH_response_cache
+
+# Total number of connections kept open across every source
+CONNECTION_LIMIT = 100
+# Seconds an idle connection is kept alive for reuse
+KEEPALIVE_TIMEOUT = 30
+# Times a request is retried after a 429 Too Many Requests response
+MAX_RETRIES = 3
+
+# Errors that mean the request itself failed, the async counterpart of requests.exceptions.RequestException
+HTTP_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError)
+
+_loop = None
+_session = None
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def get_loop():
+    """
+    Returns the event loop every request runs on, starting it on a
+    background thread the first time it is needed. The shared session
+    belongs to this loop, so async retrievers must be awaited on it,
+    either through run() or submit().
+    """
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="lmh-http", daemon=True).start()
+    return _loop
+
+
+def submit(coroutine):
+    """
+    Schedules a coroutine on the shared loop and returns a
+    concurrent.futures.Future for its result.
+    """
+    return asyncio.run_coroutine_threadsafe(coroutine, get_loop())
+
+
+def run(coroutine):
+    """
+    Runs a coroutine on the shared loop and blocks until it returns.
+    Used by the synchronous retrievers, and safe to call from any
+    thread except the loop's own. What the request records in metrics
+    counts towards the number the thread is searching for. Inside a
+    RequestGroup the request can be cancelled from another thread, in
+    which case concurrent.futures.CancelledError is raised here.
+    """
+    future = submit(metrics.carry(coroutine))
+    group = getattr(_local, "group", None)
+    if group is None:
+        return future.result()
+    group.add(future)
+    try:
+        return future.result()
+    finally:
+        group.discard(future)
+
+
+async def in_thread(function, *args):
+    """
+    Calls a blocking function, like a response cache or SQLite call,
+    on the loop's default executor and returns its result, so the loop
+    keeps serving other requests while it runs.
+    """
+    call = functools.partial(contextvars.copy_context().run, function, *args)
+    return await asyncio.get_running_loop().run_in_executor(None, call)
+
+
+class RequestGroup:
+    """
+    Set of requests that can be cancelled together from another
+    thread. A thread joins the group with "with group:" and every
+    request it makes through run() until it leaves can be cancelled
+    with cancel(), including requests it only makes afterwards.
+    """
+    def __init__(self):
+        self.futures = set()
+        self.cancelled = False
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        _local.group = self
+        return self
+
+    def __exit__(self, *exc_info):
+        _local.group = None
+
+    def add(self, future):
+        with self.lock:
+            self.futures.add(future)
+            if self.cancelled:
+                future.cancel()
+
+    def discard(self, future):
+        with self.lock:
+            self.futures.discard(future)
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            for future in self.futures:
+                future.cancel()
+
+
+async def get_session():
+    """
+    Returns the shared aiohttp session, creating it on first use.
+    Connections are pooled and kept alive between requests.
+    """
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit=CONNECTION_LIMIT, keepalive_timeout=KEEPALIVE_TIMEOUT)
+        _session = aiohttp.ClientSession(connector=connector)
+    return _session
+
+
+def _timeout(search_timeout):
+    # Same meaning as the requests timeout: a limit on connecting and on each read, not on the whole request
+    return aiohttp.ClientTimeout(total=None, sock_connect=search_timeout, sock_read=search_timeout)
+
+
+def _rebase(url):
+    # The api_base_urls setting sends an API's requests to a mirror or a local stand-in server
+    for base_url, replacement in config.get_settings().api_base_urls.items():
+        if url.startswith(base_url):
+            return replacement + url[len(base_url):]
+    return url
+
+
+async def _get(url, search_timeout, source, headers=None):
+    # Sends a GET request once the source's rate limit allows it, backing off and retrying on 429 responses. How the
+    # request went is recorded in the source's health, and how long it took to the headers in metrics
+    url = _rebase(url)
+    label = source or urlparse(url).netloc
+    session = await get_session()
+    attempt = 0
+    while True:
+        if source:
+            with metrics.timed("rate_limit_wait", source):
+                await rateLimiter.acquire_async(source)
+        started = time.monotonic()
+        metrics.count("requests", label)
+        try:
+            response = await session.get(url, timeout=_timeout(search_timeout), headers=headers)
+        except HTTP_ERRORS:
+            metrics.record("http", label, time.monotonic() - started)
+            metrics.count("errors", label)
+            if source:
+                sourceHealth.record(source, False, time.monotonic() - started)
+            raise
+        metrics.record("http", label, time.monotonic() - started)
+        if response.status >= 400:
+            metrics.count("errors", label)
+        if source and (response.status != 429 or attempt >= MAX_RETRIES):
+            sourceHealth.record(source, response.status < 500 and response.status != 429, time.monotonic() - started)
+        if response.status != 429 or not source or attempt >= MAX_RETRIES:
+            return response
+
+        seconds = rateLimiter.retry_after_seconds(response.headers.get("Retry-After"), attempt)
+        response.release()
+        if not await rateLimiter.pause_async(source, seconds):
+            await asyncio.sleep(seconds)
+        attempt += 1
+
+
+async def get_status(url, search_timeout, source=None):
+    """
+    Returns the HTTP status code for a GET request to url. source is
+    the name the request is rate limited under, None for no limit.
+    """
+    async with await _get(url, search_timeout, source) as response:
+        return response.status
+
+
+async def get_text(url, search_timeout, source=None, cache_key=None, found_nothing=None):
+    """
+    Returns the body of a GET request to url decoded as UTF-8. source
+    is the name the request is rate limited under, None for no limit.
+    Raises aiohttp.ClientResponseError for bad responses.
+
+    With a cache_key the answer is kept in the response cache under
+    (source, cache_key) and reused while it is fresh. Once it expires
+    it is revalidated with If-None-Match and If-Modified-Since if the
+    source sent an ETag or Last-Modified header, and a 304 answer
+    reuses the cached body. A 404 is cached as "nothing found" and
+    returned as None instead of being raised. Failed requests are
+    never cached. The cache is read and written off the loop.
+    found_nothing is called with a body to tell whether it is an
+    answer saying nothing was found, like an empty result list, which
+    is cached for the shorter negative ttl like a 404.
+    """
+    stale_body = None
+    headers = None
+    if cache_key is not None:
+        found, body = await in_thread(LMH_response_cache.lookup, source, cache_key)
+        if found:
+            metrics.count("cache_hits", source)
+            return body
+        stale_body, headers = await in_thread(LMH_response_cache.conditional_headers, source, cache_key)
+
+    async with await _get(url, search_timeout, source, headers) as response:
+        if stale_body is not None and response.status == 304:
+            await in_thread(LMH_response_cache.refresh, source, cache_key)
+            return stale_body
+        if cache_key is not None and response.status == 404:
+            await in_thread(LMH_response_cache.store, source, cache_key, None)
+            return None
+        response.raise_for_status()
+        with metrics.timed("http_body", source or urlparse(url).netloc):
+            body = await response.text(encoding='utf-8')
+        validators = (response.headers.get('ETag'), response.headers.get('Last-Modified'))
+
+    if cache_key is not None:
+        await in_thread(_store, source, cache_key, body, validators, found_nothing)
+    return body
+
+
+def _store(source, cache_key, body, validators, found_nothing):
+    # Runs on the loop's executor, found_nothing may have to parse the whole body
+    try:
+        negative = found_nothing is not None and found_nothing(body)
+    except ValueError:
+        # The retriever reports the bad body when it parses it
+        negative = False
+    LMH_response_cache.store(source, cache_key, body, *validators, negative=negative)
+
+
+async def _close_session():
+    if _session is not None and not _session.closed:
+        await _session.close()
+
+
+def close():
+    """
+    Closes the shared session and stops the background loop.
+    """
+    global _loop
+    with _lock:
+        if _loop is None:
+            return
+        loop = _loop
+        _loop = None
+    try:
+        asyncio.run_coroutine_threadsafe(_close_session(), loop).result(timeout=5)
+    except Exception:
+        pass
+    loop.call_soon_threadsafe(loop.stop)
+
+
+atexit.register(close)
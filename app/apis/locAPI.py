@@ -1,9 +1,16 @@
 import json
-import requests
-from app import config, logs
-from app import callNumberValidation
-from datetime import timedelta
-from ratelimit import limits, sleep_and_retry
+import urllib.parse
+from app import config, logs, metrics
+from app.apis import httpClient
+from app import callNumberValidation, isbnNormalization
+from app.database import LMH_response_cache
+
+# Name used for this source's rate limit
+SOURCE_NAME = "LOC"
+# Numbers ORed together into one search by prefetch, the results per page and the pages read for one search
+BATCH_SIZE = 20
+PAGE_SIZE = 100
+MAX_PAGES = 5
 
 
 def parse_loc_data(entry, number, retrieval_settings, is_oclc):
@@ -45,10 +52,12 @@ def parse_loc_data(entry, number, retrieval_settings, is_oclc):
     return entry
 
 
-@sleep_and_retry
-@limits(calls=10, period=timedelta(seconds=10).total_seconds())
 def retrieve_data_from_loc(number, looking_for_status):
-    config_file = config.load_config()
+    return httpClient.run(retrieve_data_from_loc_async(number, looking_for_status))
+
+
+async def retrieve_data_from_loc_async(number, looking_for_status):
+    settings = config.get_settings()
 
     base_url = "https://www.loc.gov/search/"
     jsonq = "?fo=json&q="
@@ -56,17 +65,90 @@ def retrieve_data_from_loc(number, looking_for_status):
 
     try:
         if looking_for_status:
-            response = requests.get(full_url, timeout=config_file["search_timeout"])
-            return response.status_code
+            return await httpClient.get_status(full_url, settings.search_timeout, SOURCE_NAME)
 
-        response = requests.get(full_url, timeout=config_file["search_timeout"])
-        response.raise_for_status()  # Raise an HTTPError for bad responses
-        data = response.content.decode('utf-8')  # Decode the byte string
+        data = await httpClient.get_text(full_url, settings.search_timeout, SOURCE_NAME, number,
+                                         found_nothing=lambda body: not json.loads(body).get('results'))
+        if data is None:
+            return None
 
         # Parse the extracted JSON data
-        parsed_data = json.loads(data)
+        with metrics.timed("json_parse", SOURCE_NAME):
+            parsed_data = json.loads(data)
 
         return parsed_data
-    except requests.exceptions.RequestException as e:
+    except httpClient.HTTP_ERRORS as e:
         logs.log_error(f"Error retrieving data from LOC: {e}")
         return None
+
+
+def result_numbers(result, is_oclc):
+    """
+    Returns the set of numbers a search result is for, its OCLC
+    numbers for OCLC input and its ISBNs as ISBN-13s otherwise, so it
+    can be matched to the input values of a batched search.
+    """
+    numbers = set()
+    if is_oclc:
+        for oclc in result.get('number_oclc') or []:
+            numbers.add(isbnNormalization.normalize_oclc(oclc))
+    else:
+        item = result.get('item') if isinstance(result.get('item'), dict) else {}
+        for isbn in (result.get('isbn') or []) + (result.get('number_isbn') or []) + (item.get('isbn') or []):
+            numbers.add(isbnNormalization.isbn13(isbn))
+    numbers.discard('')
+    return numbers
+
+
+def prefetch(numbers, is_oclc):
+    """
+    Searches LOC for many numbers with one OR query per BATCH_SIZE of
+    them, reading up to MAX_PAGES pages of results, and gives every
+    result to the input values it is for by its number_oclc or isbn
+    fields. Each value's results are stored in the response cache in
+    the same form a search for just that value gives, which
+    parse_loc_data then uses. Values with no results are left to
+    parse_loc_data to search for on their own.
+    """
+    numbers = [number for number in dict.fromkeys(numbers) if not LMH_response_cache.is_known(SOURCE_NAME, number)]
+    httpClient.run(prefetch_async(numbers, is_oclc))
+
+
+async def prefetch_async(numbers, is_oclc):
+    for start in range(0, len(numbers), BATCH_SIZE):
+        batch = numbers[start:start + BATCH_SIZE]
+        try:
+            results = await _search_batch(batch)
+        except (httpClient.HTTP_ERRORS + (ValueError,)) as e:
+            logs.log_error(f"Error retrieving a batch of {len(batch)} values from LOC: {e}")
+            continue
+
+        by_number = {}
+        for result in results:
+            if not isinstance(result, dict):
+                continue
+            for key in result_numbers(result, is_oclc):
+                by_number.setdefault(key, []).append(result)
+
+        for number in batch:
+            key = isbnNormalization.normalize_oclc(number) if is_oclc else isbnNormalization.isbn13(number)
+            found = by_number.get(key)
+            if found is not None:
+                await httpClient.in_thread(LMH_response_cache.prefetch, SOURCE_NAME, number,
+                                           json.dumps({'results': found}))
+
+
+async def _search_batch(batch):
+    # Returns the results of an OR search for the batch, from up to MAX_PAGES pages
+    settings = config.get_settings()
+    query = urllib.parse.quote(" OR ".join(batch))
+    results = []
+    for page in range(1, MAX_PAGES + 1):
+        full_url = f"https://www.loc.gov/search/?fo=json&c={PAGE_SIZE}&sp={page}&q={query}"
+        data = await httpClient.get_text(full_url, settings.search_timeout, SOURCE_NAME)
+        with metrics.timed("json_parse", SOURCE_NAME):
+            parsed_data = json.loads(data)
+        results.extend(parsed_data.get('results') or [])
+        if not (parsed_data.get('pagination') or {}).get('next'):
+            break
+    return results
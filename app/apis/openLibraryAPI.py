@@ -1,7 +1,13 @@
 import json
-import requests
-from app import config, logs
+from app import config, logs, metrics
+from app.apis import httpClient
 from app import callNumberValidation
+from app.database import LMH_response_cache
+
+# Name used for this source's rate limit
+SOURCE_NAME = "Open Library"
+# Bibkeys asked for in one request by prefetch
+BATCH_SIZE = 50
 
 
 def parse_open_library_data(entry, number, retrieval_settings, is_oclc, is_isbn):
@@ -51,7 +57,11 @@ def parse_open_library_data(entry, number, retrieval_settings, is_oclc, is_isbn)
 
 
 def retrieve_data_from_open_library(number, looking_for_status, is_oclc, is_isbn):
-    config_file = config.load_config()
+    return httpClient.run(retrieve_data_from_open_library_async(number, looking_for_status, is_oclc, is_isbn))
+
+
+async def retrieve_data_from_open_library_async(number, looking_for_status, is_oclc, is_isbn):
+    settings = config.get_settings()
 
     if is_isbn:
         base_url = "https://openlibrary.org/api/books?bibkeys=ISBN:"
@@ -62,19 +72,65 @@ def retrieve_data_from_open_library(number, looking_for_status, is_oclc, is_isbn
         json_data = "&format=json&jscmd=data"
         full_url = f"{base_url}{number}{json_data}"
 
+    cache_key = _cache_key(number, is_oclc)
+
     try:
         if looking_for_status:
-            response = requests.get(full_url, timeout=config_file["search_timeout"])
-            return response.status_code
+            return await httpClient.get_status(full_url, settings.search_timeout, SOURCE_NAME)
 
-        response = requests.get(full_url, timeout=config_file["search_timeout"])
-        response.raise_for_status()  # Raise an HTTPError for bad responses
-        data = response.content.decode('utf-8')  # Decode the byte string
+        # Open Library answers {} for a number it knows nothing about
+        data = await httpClient.get_text(full_url, settings.search_timeout, SOURCE_NAME, cache_key,
+                                         found_nothing=lambda body: not json.loads(body))
+        if data is None:
+            return None
 
         # Parse the extracted JSON data
-        parsed_data = json.loads(data)
+        with metrics.timed("json_parse", SOURCE_NAME):
+            parsed_data = json.loads(data)
 
         return parsed_data
-    except requests.exceptions.RequestException as e:
+    except httpClient.HTTP_ERRORS as e:
         logs.log_error(f"Error retrieving data from Open Library: {e}")
         return None
+
+
+def _cache_key(number, is_oclc):
+    # Searches by ISBN and by OCLC number are cached apart since the numbers could clash
+    return f"{'oclc' if is_oclc else 'isbn'}:{number}"
+
+
+def prefetch(numbers, is_oclc, is_isbn):
+    """
+    Asks Open Library about many numbers with one request per
+    BATCH_SIZE of them and splits the answer, which is keyed by bibkey,
+    into the answer a request for each number on its own would have
+    got. parse_open_library_data then finds it in the response cache.
+    """
+    numbers = [number for number in dict.fromkeys(numbers)
+               if not LMH_response_cache.is_known(SOURCE_NAME, _cache_key(number, is_oclc))]
+    httpClient.run(prefetch_async(numbers, is_oclc, is_isbn))
+
+
+async def prefetch_async(numbers, is_oclc, is_isbn):
+    settings = config.get_settings()
+    prefix = "OCLC" if is_oclc else "ISBN:"
+
+    for start in range(0, len(numbers), BATCH_SIZE):
+        batch = numbers[start:start + BATCH_SIZE]
+        bibkeys = ",".join(prefix + number for number in batch)
+        full_url = f"https://openlibrary.org/api/books?bibkeys={bibkeys}&format=json&jscmd=data"
+        try:
+            data = await httpClient.get_text(full_url, settings.search_timeout, SOURCE_NAME)
+            with metrics.timed("json_parse", SOURCE_NAME):
+                parsed_data = json.loads(data)
+        except (httpClient.HTTP_ERRORS + (ValueError,)) as e:
+            logs.log_error(f"Error retrieving a batch of {len(batch)} values from Open Library: {e}")
+            continue
+
+        # Numbers Open Library knows nothing about are missing from the answer, like the {} a single request gets
+        for number in batch:
+            key = prefix + number
+            found = key in parsed_data
+            body = json.dumps({key: parsed_data[key]}) if found else "{}"
+            await httpClient.in_thread(LMH_response_cache.prefetch, SOURCE_NAME, _cache_key(number, is_oclc), body,
+                                       not found)
@@ -0,0 +1,233 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from app import config, logs
+
+# Seconds to back off when a source answers 429 without a Retry-After header, doubled on every retry
+DEFAULT_BACKOFF = 2
+# Longest a source is ever paused for, whatever Retry-After asks for
+MAX_BACKOFF = 300
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+_local = threading.local()
+
+
+class TokenBucket:
+    """
+    Token bucket shared by every thread of this process. Each request
+    takes a token, tokens refill at rate per second up to burst, and
+    a request that finds the bucket empty waits for its token instead
+    of being refused. Tokens can go below zero, which is how many
+    requests are already waiting.
+    """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Takes a token and returns how many seconds the caller has to
+        wait before using it.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens, self.updated, wait = _take(self.tokens, self.updated, now, self.rate, self.burst)
+            return wait
+
+    def pause(self, seconds):
+        """
+        Hands out no tokens for the given number of seconds.
+        """
+        with self.lock:
+            self.tokens, self.updated = _pause(self.tokens, self.updated, time.monotonic(), seconds, self.rate)
+
+
+class SharedTokenBucket:
+    """
+    Token bucket kept in an SQLite file so that every process running
+    a harvest on this machine draws from the same bucket.
+    """
+    def __init__(self, file_name, source, rate, burst):
+        self.file_name = file_name
+        self.source = source
+        self.rate = rate
+        self.burst = burst
+
+    def open_connection(self):
+        # One connection per thread and file, kept open since a request is made for every value
+        connections = getattr(_local, "connections", None)
+        if connections is None:
+            connections = _local.connections = {}
+        connection = connections.get(self.file_name)
+        if connection is None:
+            connection = sqlite3.connect(self.file_name, timeout=30, isolation_level=None)
+            connection.execute('''CREATE TABLE IF NOT EXISTS buckets (
+                                source TEXT PRIMARY KEY,
+                                tokens REAL,
+                                updated REAL)''')
+            connections[self.file_name] = connection
+        return connection
+
+    def update(self, change):
+        # Runs change(tokens, updated, now) inside a write transaction and stores the tokens and time it returns
+        connection = self.open_connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = connection.execute("SELECT tokens, updated FROM buckets WHERE source = ?",
+                                     (self.source,)).fetchone()
+            tokens, updated = row if row else (self.burst, now)
+            tokens, updated, result = change(tokens, updated, now)
+            connection.execute("INSERT OR REPLACE INTO buckets (source, tokens, updated) VALUES (?, ?, ?)",
+                               (self.source, tokens, updated))
+            connection.execute("COMMIT")
+            return result
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def reserve(self):
+        try:
+            return self.update(lambda tokens, updated, now: _take(tokens, updated, now, self.rate, self.burst))
+        except sqlite3.Error as e:
+            logs.log_error(f"Error using shared rate limit for {self.source}: {e}")
+            return 0
+
+    def pause(self, seconds):
+        try:
+            self.update(lambda tokens, updated, now: _pause(tokens, updated, now, seconds, self.rate) + (None,))
+        except sqlite3.Error as e:
+            logs.log_error(f"Error using shared rate limit for {self.source}: {e}")
+
+
+def _take(tokens, updated, now, rate, burst):
+    # A pause moves updated into the future, so the refill below is negative until the pause is over
+    tokens = min(burst, tokens + (now - updated) * rate) - 1
+    wait = -tokens / rate if tokens < 0 else 0
+    return tokens, now, wait
+
+
+def _pause(tokens, updated, now, seconds, rate):
+    # Start refilling from empty once the pause is over, keeping any requests that were already waiting
+    tokens = min(tokens + max(now - updated, 0) * rate, 0)
+    return tokens, max(updated, now + seconds)
+
+
+def get_bucket(source, fallback=None):
+    """
+    Returns the bucket for a source, or None if no rate limit is
+    configured for it. The limit is looked up in the rate_limits
+    setting under the source's name and then under fallback.
+    """
+    settings = config.get_settings()
+    limit = settings.rate_limits.get(source) or (settings.rate_limits.get(fallback) if fallback else None)
+    if not limit:
+        return None
+
+    key = (source, limit["rate"], limit["burst"], settings.rate_limit_file)
+    bucket = _buckets.get(key)
+    if bucket is None:
+        with _buckets_lock:
+            bucket = _buckets.get(key)
+            if bucket is None:
+                if settings.rate_limit_file:
+                    bucket = SharedTokenBucket(settings.rate_limit_file, source, limit["rate"], limit["burst"])
+                else:
+                    bucket = TokenBucket(limit["rate"], limit["burst"])
+                _buckets[key] = bucket
+    return bucket
+
+
+def reserve(source, fallback=None):
+    """
+    Takes a token for source and returns the number of seconds to wait
+    before sending the request.
+    """
+    bucket = get_bucket(source, fallback)
+    if bucket is None:
+        return 0
+    return bucket.reserve()
+
+
+def acquire(source, fallback=None):
+    """
+    Blocks until a request to source is allowed.
+    """
+    wait = reserve(source, fallback)
+    if wait > 0:
+        time.sleep(wait)
+
+
+async def _in_thread(bucket, method, *args):
+    # A shared bucket waits on an SQLite write lock, so it is used from the loop's default executor instead of the
+    # loop itself. The in-process bucket only takes a thread lock held for a few arithmetic operations
+    if isinstance(bucket, SharedTokenBucket):
+        return await asyncio.get_running_loop().run_in_executor(None, method, *args)
+    return method(*args)
+
+
+async def acquire_async(source, fallback=None):
+    """
+    Waits until a request to source is allowed. Neither the wait nor
+    a shared bucket's SQLite transaction blocks the event loop.
+    """
+    bucket = get_bucket(source, fallback)
+    if bucket is None:
+        return
+    wait = await _in_thread(bucket, bucket.reserve)
+    if wait > 0:
+        await asyncio.sleep(wait)
+
+
+def retry_after_seconds(retry_after, attempt):
+    """
+    Returns how long to back off after a 429 response, from its
+    Retry-After header (seconds or an HTTP date) if it has one and
+    otherwise doubling DEFAULT_BACKOFF for every attempt.
+    """
+    seconds = None
+    if retry_after:
+        try:
+            seconds = float(retry_after)
+        except ValueError:
+            try:
+                seconds = parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError):
+                seconds = None
+    if seconds is None:
+        seconds = DEFAULT_BACKOFF * 2 ** attempt
+    return min(max(seconds, 0), MAX_BACKOFF)
+
+
+def pause(source, seconds, fallback=None):
+    """
+    Pauses every request to source for the given number of seconds,
+    used when the source answers 429 Too Many Requests. Returns False
+    if source has no rate limit, in which case the caller has to wait
+    itself.
+    """
+    logs.log_warning(f"{source} is limiting requests, pausing it for {seconds:.0f} seconds")
+    bucket = get_bucket(source, fallback)
+    if bucket is None:
+        return False
+    bucket.pause(seconds)
+    return True
+
+
+async def pause_async(source, seconds, fallback=None):
+    """
+    pause() for callers on the event loop, which a shared bucket's
+    SQLite transaction does not block.
+    """
+    logs.log_warning(f"{source} is limiting requests, pausing it for {seconds:.0f} seconds")
+    bucket = get_bucket(source, fallback)
+    if bucket is None:
+        return False
+    await _in_thread(bucket, bucket.pause, seconds)
+    return True
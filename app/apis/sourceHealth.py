@@ -0,0 +1,159 @@
+import threading
+import time
+from collections import deque
+from app import config, logs
+
+# Calls of a source the error rate and latencies are worked out over
+WINDOW = 20
+# Longest a failing source is skipped for before it is tried again, however often it keeps failing
+MAX_OPEN_SECONDS = 600
+
+# Breaker states: calls go through, calls are skipped, or one trial call is let through to see if the source is back
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half open"
+
+_monitors = {}
+_monitors_lock = threading.Lock()
+
+
+class SourceHealth:
+    """
+    Sliding window of the last WINDOW calls to one source and the
+    circuit breaker they drive. Once at least min_calls calls are in
+    the window and failure_rate of them failed the breaker opens and
+    the source is skipped for open_seconds. After that one call is let
+    through: if it works the breaker closes again, if not it stays open
+    twice as long as before. It is safe to use from several threads.
+    """
+    def __init__(self, name, failure_rate=0.5, min_calls=5, open_seconds=30):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.calls = deque(maxlen=WINDOW)
+        self.state = CLOSED
+        self.open_for = open_seconds
+        self.open_until = 0
+        self.trial_started = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """
+        Returns True if a call to the source should be made now. While
+        the breaker is half open only one caller at a time is let
+        through, and another one if its call never reports back.
+        """
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            now = time.monotonic()
+            if self.state == OPEN:
+                if now < self.open_until:
+                    return False
+                self.state = HALF_OPEN
+            elif self.trial_started is not None and now - self.trial_started < self.open_seconds:
+                return False
+            self.trial_started = now
+            return True
+
+    def record(self, ok, latency):
+        """
+        Records how a call went and how many seconds it took.
+        """
+        with self.lock:
+            self.calls.append((ok, latency))
+            if self.state == HALF_OPEN:
+                if ok:
+                    self.state = CLOSED
+                    self.open_for = self.open_seconds
+                    self.calls.clear()
+                    self.trial_started = None
+                    logs.log_info(f"{self.name} is answering again")
+                else:
+                    self._open(min(self.open_for * 2, MAX_OPEN_SECONDS))
+            elif self.state == CLOSED and self.min_calls and len(self.calls) >= self.min_calls:
+                failures = sum(1 for call_ok, _ in self.calls if not call_ok)
+                if failures >= self.failure_rate * len(self.calls):
+                    self._open(self.open_seconds)
+
+    def _open(self, seconds):
+        # Called with the lock held
+        self.state = OPEN
+        self.open_for = seconds
+        self.open_until = time.monotonic() + seconds
+        self.trial_started = None
+        logs.log_warning(f"{self.name} keeps failing, it is skipped for {seconds:g} seconds")
+
+    def stats(self):
+        """
+        Returns a dictionary with the breaker state and the number of
+        calls, error rate and p50 and p95 latency in the window.
+        """
+        with self.lock:
+            calls = list(self.calls)
+            state = self.state
+        latencies = sorted(latency for _, latency in calls)
+        return {
+            'state': state,
+            'calls': len(calls),
+            'error_rate': sum(1 for ok, _ in calls if not ok) / len(calls) if calls else 0,
+            'p50': _percentile(latencies, 0.5),
+            'p95': _percentile(latencies, 0.95)
+        }
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def get_monitor(name):
+    """
+    Returns the SourceHealth of a source, creating it with the
+    circuit_breaker settings the first time it is asked for.
+    """
+    monitor = _monitors.get(name)
+    if monitor is None:
+        settings = config.get_settings()
+        with _monitors_lock:
+            monitor = _monitors.get(name)
+            if monitor is None:
+                monitor = SourceHealth(name, settings.circuit_breaker_failure_rate,
+                                       settings.circuit_breaker_min_calls, settings.circuit_breaker_open_seconds)
+                _monitors[name] = monitor
+    return monitor
+
+
+def allow(name):
+    """
+    Returns True if a call to source name should be made now.
+    """
+    return get_monitor(name).allow()
+
+
+def record(name, ok, latency):
+    """
+    Records how a call to source name went. Requests log this
+    themselves, so retrievers do not have to.
+    """
+    get_monitor(name).record(ok, latency)
+
+
+def describe(name):
+    # Short status for the start of a search
+    stats = get_monitor(name).stats()
+    if stats['state'] == OPEN:
+        return "Offline, it will be tried again later in the search"
+    if stats['calls']:
+        return f"Online, {stats['error_rate']:.0%} of recent requests failed"
+    return "Ready"
+
+
+def reset():
+    """
+    Forgets every source's calls and closes every breaker.
+    """
+    with _monitors_lock:
+        _monitors.clear()
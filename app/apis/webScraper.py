@@ -1,150 +1,283 @@
 import os
 import requests
+import contextvars
 import re
-from app import config, logs
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from app import config, logs, metrics
 from app import callNumberValidation
-from datetime import timedelta
-from ratelimit import limits, sleep_and_retry
+from urllib.parse import urlparse
+from app.apis import rateLimiter, sourceHealth
+from app.database import LMH_response_cache
 
+# Pages are only written here when the web_scraping_capture setting is on
 download_directory = r'web_pages'
+# Times a page is requested again after a 429 Too Many Requests response
+MAX_RETRIES = 3
+# Document pages downloaded at the same time across every value being searched, the web_scraping_connections setting
+# limits how many of them are from one catalogue
+PAGE_THREADS = 32
+
+# Patterns the pages of a Blacklight or WorldCat catalogue are searched with. A source's entry in the
+# web_scraping_rules setting replaces any of these lists. Every pattern captures one group, except that the two
+# patterns of an lccn_parts pair capture the first and second parts of a call number that are joined in page order
+DEFAULT_RULES = {
+    "document_id": [
+        r'&amp;document_id=(\d+)&amp;',
+        r'href="/catalog/([A-Z0-9]+)"'
+    ],
+    "lccn_parts": [
+        [r'<span class="sub_code">a\|</span>\s*([A-Z0-9]+\.[A-Z0-9]+)\s*<',
+         r'<span class="sub_code">b\|</span>\s*([A-Z0-9]+\s+[0-9]+[a-z]*)\s*<'],
+        [r'<span class=\'sub_code\'>\|a</span>\s*([A-Z0-9]+\.[A-Z0-9]+)\s*',
+         r'<span class=\'sub_code\'>\|b</span>\s*([A-Z0-9]+\s+[0-9]+)\s*']
+    ],
+    "lccn": [
+        r'LCCN:\s*(\d+)'
+    ],
+    "oclc": [
+        r'\(OCoLC\)(?:ocn|ocm)?(\d+)',
+        r'<dt class="blacklight-oclc_number">\s*OCLC Number:\s*</dt>\s*(\d+)'
+    ]
+}
+
+_compiled_rules = {}
+_compiled_rules_lock = threading.Lock()
+_page_executor = None
+_host_slots = {}
+_page_lock = threading.Lock()
 
 
-def extract_highlighted_items(html_content):
-    document_id_pattern = r'&amp;document_id=(\d+)&amp;|href="/catalog/([A-Z0-9]+)"'
-    matches = re.findall(document_id_pattern, html_content)
+class ExtractionRules:
+    """
+    A source's patterns, compiled once and used for every page it
+    scrapes. extract() runs them all over a page held in memory, timed
+    in metrics under the source's name.
+    """
+    def __init__(self, rules=None, source="Web scraping"):
+        rules = {**DEFAULT_RULES, **(rules or {})}
+        self.source = source
+        self.document_id = [re.compile(pattern) for pattern in rules["document_id"]]
+        self.lccn_parts = [(re.compile(first), re.compile(second)) for first, second in rules["lccn_parts"]]
+        self.lccn = [re.compile(pattern) for pattern in rules["lccn"]]
+        self.oclc = [re.compile(pattern) for pattern in rules["oclc"]]
 
-    document_ids = set()
-    for match in matches:
-        # Only add the non-empty part of the tuple
-        document_id = next(item for item in match if item)
-        document_ids.add(document_id)
+    def extract(self, html_content):
+        """
+        Returns a dictionary with the document IDs, LCCNs and OCLC
+        numbers found in a page, each a list in the order they appear
+        without repeats.
+        """
+        with metrics.timed("regex", self.source):
+            return self._extract(html_content)
 
-    return document_ids
+    def _extract(self, html_content):
+        document_ids = [match.group(1) for pattern in self.document_id for match in pattern.finditer(html_content)]
+
+        lccn_numbers = []
+        for first, second in self.lccn_parts:
+            lccn_numbers += [f"{id_no_1} {id_no_2}" for id_no_1, id_no_2 in
+                             zip(first.findall(html_content), second.findall(html_content))]
+        lccn_numbers += [match.group(1) for pattern in self.lccn for match in pattern.finditer(html_content)]
+
+        # Normalize numbers by removing leading zeros
+        oclc_numbers = [match.group(1).lstrip('0') for pattern in self.oclc for match in pattern.finditer(html_content)]
+
+        return {
+            'document_ids': list(dict.fromkeys(document_ids)),
+            'lccn': list(dict.fromkeys(lccn_numbers)),
+            'oclc': list(dict.fromkeys(oclc_numbers))
+        }
+
+
+def get_rules(library):
+    """
+    Returns the compiled ExtractionRules of a source, compiling them
+    the first time they are asked for or after its patterns changed.
+    """
+    rules = config.get_settings().web_scraping_rules.get(library)
+    rules = {key: [list(value) if isinstance(value, (list, tuple)) else value for value in values]
+             for key, values in (rules or {}).items()}
+    key = (library, repr(sorted(rules.items())))
+    compiled = _compiled_rules.get(key)
+    if compiled is None:
+        with _compiled_rules_lock:
+            compiled = _compiled_rules.setdefault(key, ExtractionRules(rules, library))
+    return compiled
+
+
+def capture_page(url, html_content):
+    # Only used with the web_scraping_capture setting on, each page is kept under a name made from its URL
+    if not os.path.exists(download_directory):
+        os.makedirs(download_directory, exist_ok=True)
+    file_name = re.sub(r'[^A-Za-z0-9._-]', '_', url)[-200:] + '.html'
+    with open(os.path.join(download_directory, file_name), 'w', encoding='utf-8') as file:
+        file.write(html_content)
 
 
-def read_html_file(file_path):
-    with open(file_path, 'r', encoding='utf-8') as file:
-        html_content = file.read()
+def download_webpage(url, library):
+    """
+    Returns the HTML of a page, or None if it could not be downloaded.
+    The page is never written to disk unless the web_scraping_capture
+    setting is on. How the request went is recorded under library, the
+    name the harvester checks the catalogue's health under.
+    """
+    # Catalogues are rate limited and cached per host, falling back to the "Web scraping" limit
+    host = urlparse(url).netloc
+    found, html_content = LMH_response_cache.lookup(host, url)
+    if found:
+        metrics.count("cache_hits", host)
+    else:
+        html_content = _request_webpage(url, host, library)
+    if html_content is not None and config.get_settings().web_scraping_capture:
+        capture_page(url, html_content)
     return html_content
 
 
-@sleep_and_retry
-@limits(calls=10, period=timedelta(seconds=10).total_seconds())
-def download_webpage(url, file_path):
+def _request_webpage(url, host, library):
+    # An expired page the catalogue gave validators for is only downloaded again if it changed
+    stale_content, headers = LMH_response_cache.conditional_headers(host, url)
     try:
-        response = requests.get(url)
+        for attempt in range(MAX_RETRIES + 1):
+            rateLimiter.acquire(host, "Web scraping")
+            started = time.monotonic()
+            metrics.count("requests", host)
+            try:
+                response = requests.get(url, headers=headers)
+            except requests.RequestException:
+                metrics.record("http", host, time.monotonic() - started)
+                metrics.count("errors", host)
+                sourceHealth.record(library, False, time.monotonic() - started)
+                raise
+            metrics.record("http", host, time.monotonic() - started)
+            if response.status_code >= 400:
+                metrics.count("errors", host)
+            if response.status_code != 429 or attempt == MAX_RETRIES:
+                sourceHealth.record(library, response.status_code < 500 and response.status_code != 429,
+                                    time.monotonic() - started)
+                break
+            seconds = rateLimiter.retry_after_seconds(response.headers.get("Retry-After"), attempt)
+            if not rateLimiter.pause(host, seconds, "Web scraping"):
+                time.sleep(seconds)
+
+        if response.status_code == 304 and stale_content is not None:
+            LMH_response_cache.refresh(host, url)
+            return stale_content
         if response.status_code == 200:
-            with open(file_path, 'w', encoding='utf-8') as file:
-                file.write(response.text)
-            return True
+            LMH_response_cache.store(host, url, response.text, response.headers.get('ETag'),
+                                     response.headers.get('Last-Modified'))
+            return response.text
         else:
+            if response.status_code == 404:
+                LMH_response_cache.store(host, url, None)
             logs.log_error(f"Failed to download {url}. Status code: {response.status_code}")
-            return False
+            return None
     except Exception as e:
         logs.log_error(f"Exception occurred during website download: {e}")
-        return False
+        return None
 
 
-def extract_lccn_numbers(file_path):
-    with open(file_path, 'r', encoding='utf-8') as file:
-        html_content = file.read()
+def _get_page_executor():
+    global _page_executor
+    with _page_lock:
+        if _page_executor is None:
+            _page_executor = ThreadPoolExecutor(max_workers=PAGE_THREADS, thread_name_prefix="lmh-pages")
+        return _page_executor
 
-    # Patterns for the first and second parts of LCCN numbers
-    id_no_1_patterns = [
-        r'<span class="sub_code">a\|</span>\s*([A-Z0-9]+\.[A-Z0-9]+)\s*<',
-        r'<span class=\'sub_code\'>\|a</span>\s*([A-Z0-9]+\.[A-Z0-9]+)\s*',
-        r'LCCN:\s*(\d+)'  # New pattern to match the third HTML structure
-    ]
-    id_no_2_patterns = [
-        r'<span class="sub_code">b\|</span>\s*([A-Z0-9]+\s+[0-9]+[a-z]*)\s*<',
-        r'<span class=\'sub_code\'>\|b</span>\s*([A-Z0-9]+\s+[0-9]+)\s*'
-    ]
 
-    lccn_numbers = set()
-    for pattern_1, pattern_2 in zip(id_no_1_patterns, id_no_2_patterns):
-        id_no_1_matches = re.findall(pattern_1, html_content)
-        id_no_2_matches = re.findall(pattern_2, html_content)
+def close():
+    """
+    Waits for the document pages still downloading and stops the page
+    threads. They are started again the next time they are needed.
+    """
+    global _page_executor
+    with _page_lock:
+        executor = _page_executor
+        _page_executor = None
+    if executor is not None:
+        executor.shutdown(wait=True)
 
-        for id_no_1, id_no_2 in zip(id_no_1_matches, id_no_2_matches):
-            lccn_numbers.add(f"{id_no_1} {id_no_2}")
 
-    # New addition to handle the third pattern
-    id_no_3_matches = re.findall(id_no_1_patterns[2], html_content)
-    lccn_numbers.update(id_no_3_matches)
+def _host_slot(host, connections):
+    with _page_lock:
+        return _host_slots.setdefault((host, connections), threading.BoundedSemaphore(max(1, connections)))
 
-    return list(lccn_numbers)
 
+def _download_document(url, done, library):
+    # Runs on the page threads, waiting for one of the catalogue's connections first. Pages still waiting once the
+    # search is done are dropped
+    with _host_slot(urlparse(url).netloc, config.get_settings().web_scraping_connections):
+        if done.is_set():
+            return None
+        return download_webpage(url, library)
 
-def extract_oclc_numbers(file_path):
-    with open(file_path, 'r', encoding='utf-8') as file:
-        html_content = file.read()
 
-    # Patterns to match different OCoLC number formats
-    oclc_patterns = [
-        r'\(OCoLC\)(?:ocn|ocm)?(\d+)',
-        r'<dt class="blacklight-oclc_number">\s*OCLC Number:\s*</dt>\s*(\d+)'  # New pattern for the additional format
-    ]
+def document_url(base_url, doc_id):
+    # Adjust the URL based on the format of the document ID
+    if re.match(r'^[A-Z]+\d+$', doc_id):
+        return f"{base_url}/{doc_id}"
+    return f"{base_url}/{doc_id}/librarian_view"
 
-    oclc_numbers = set()
-    for pattern in oclc_patterns:
-        oclc_matches = re.findall(pattern, html_content)
-        # Normalize numbers by removing leading zeros
-        normalized_matches = {match.lstrip('0') for match in oclc_matches}
-        oclc_numbers.update(normalized_matches)
 
-    return list(oclc_numbers)
+def is_filled(entry, retrieval_settings):
+    # Once the entry holds everything we want no further document can change it, the first match always wins
+    return ((entry.get('lccn') or not retrieval_settings['retrieve_lccn']) and
+            (entry.get('oclc') or not retrieval_settings['retrieve_oclc']))
 
 
 def parse_data(entry, number, retrieval_settings, library):
-    config_file = config.load_config()
+    settings = config.get_settings()
 
-    if not os.path.exists(download_directory):
-        os.makedirs(download_directory)
-
-    for key, urls in config_file["web_scraping_sources"].items():
+    for key, urls in settings.web_scraping_sources.items():
         if library == key:
+            rules = get_rules(library)
+
             # Construct and download the main URL
             main_url = urls[0].format(number=number)
-            main_file_path = os.path.join(download_directory, f'{number}.html')
-            if download_webpage(main_url, main_file_path):
+            main_html_content = download_webpage(main_url, library)
+            if main_html_content is not None:
                 # Extract document IDs from the main page
-                main_html_content = read_html_file(main_file_path)
-                extracted_ids = extract_highlighted_items(main_html_content)
-
-                # Delete the main webpage file after extraction
-                os.remove(main_file_path)
-
-                # Process each document ID
-                for doc_id in extracted_ids:
-                    # Adjust the URL based on the format of the document ID
-                    if re.match(r'^[A-Z]+\d+$', doc_id):
-                        doc_url = f"{urls[1]}/{doc_id}"
-                    else:
-                        doc_url = f"{urls[1]}/{doc_id}/librarian_view"
-
-                    doc_file_path = os.path.join(download_directory, f'{doc_id}.html')
-                    if download_webpage(doc_url, doc_file_path):
-                        lccn_values = extract_lccn_numbers(doc_file_path)
-                        oclc_values = extract_oclc_numbers(doc_file_path)
-
-                        if lccn_values:
-                            if (entry.get('lccn') == '' or entry.get('lccn') is None and
-                                    retrieval_settings['retrieve_lccn'] and
-                                    callNumberValidation.validate_lc_call_number(lccn_values[0])):
-                                entry.update({
-                                    'lccn': lccn_values[0],
-                                    'source': library
-                                })
-                        if oclc_values:
-                            if entry.get('oclc') == '' or entry.get('oclc') is None and retrieval_settings['retrieve_oclc']:
-                                entry.update({
-                                    'oclc': oclc_values[0],
-                                })
-
-                        # Delete the document webpage file after extraction
-                        os.remove(doc_file_path)
-                    else:
-                        logs.log_error(f"Failed to download page for document ID: {doc_id}")
+                extracted_ids = rules.extract(main_html_content)['document_ids']
+
+                # The document pages are all downloaded at once but read in the order the search listed them
+                executor = _get_page_executor()
+                done = threading.Event()
+                futures = [executor.submit(contextvars.copy_context().run, _download_document,
+                                           document_url(urls[1], doc_id), done, library)
+                           for doc_id in extracted_ids]
+                try:
+                    for doc_id, future in zip(extracted_ids, futures):
+                        if is_filled(entry, retrieval_settings):
+                            break
+
+                        doc_html_content = future.result()
+                        if doc_html_content is not None:
+                            found = rules.extract(doc_html_content)
+                            lccn_values = found['lccn']
+                            oclc_values = found['oclc']
+
+                            if lccn_values:
+                                if (entry.get('lccn') == '' or entry.get('lccn') is None and
+                                        retrieval_settings['retrieve_lccn'] and
+                                        callNumberValidation.validate_lc_call_number(lccn_values[0])):
+                                    entry.update({
+                                        'lccn': lccn_values[0],
+                                        'source': library
+                                    })
+                            if oclc_values:
+                                if (entry.get('oclc') == '' or entry.get('oclc') is None and
+                                        retrieval_settings['retrieve_oclc']):
+                                    entry.update({
+                                        'oclc': oclc_values[0],
+                                    })
+                        else:
+                            logs.log_error(f"Failed to download page for document ID: {doc_id}")
+                finally:
+                    # Pages not started yet are never downloaded, ones already downloading are left to finish
+                    done.set()
+                    for future in futures:
+                        future.cancel()
             else:
                 logs.log_error(f"Failed to download main page for value: {number}")
     return entry
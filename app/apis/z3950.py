@@ -1,6 +1,15 @@
-import subprocess
+import re
+import time
 from app import config, logs
-from app import callNumberValidation
+from app import callNumberValidation, isbnNormalization
+from app.apis import rateLimiter, sourceHealth, z3950Pool
+from app.database import LMH_response_cache
+
+# ISBNs ORed together into one search of a target
+BATCH_SIZE = 25
+
+_RECORD_START = re.compile(r'^(?:\[[^\]]*\])?Record type:', re.MULTILINE)
+_HITS = re.compile(r'Number of hits: (\d+)')
 
 
 def parse_text_marc(text_marc):
@@ -23,44 +32,104 @@ def parse_text_marc(text_marc):
     return marc_data
 
 
-def run_yaz_client(isbn, target_string):
-    config_file = config.load_config()
-
-    commands = f"""
-    open {target_string}
-    find @attr 1=7 {isbn}
-    show 1
-    quit
-    """
+def run_yaz_client(isbn, target_string, library=None):
+    settings = config.get_settings()
 
+    # The search runs over a yaz-client kept connected to the target between searches
+    started = time.monotonic()
     try:
-        info = subprocess.STARTUPINFO()
-        info.dwFlags = subprocess.STARTF_USESHOWWINDOW
-        info.wShowWindow = 0
-        process = subprocess.run([config_file["yaz_client_path"]], input=commands, text=True, encoding='utf-8',
-                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=config_file["search_timeout"],
-                                 startupinfo=info)
-
-        # Exit if there was an error
-        if process.stderr and "Innovative Interfaces Inc. Z39.50 SERVER version 1.1" not in process.stderr:
-            logs.log_error("Error from Z39.50: " + process.stderr)
-            return {'lccn': '', 'oclc': ''}
-
-        # Process the MARC record text
-        if process.stdout:
-            marc_data = parse_text_marc(process.stdout)
-            return marc_data
-    except Exception as e:
+        output = z3950Pool.search(settings.yaz_client_path, target_string, isbn, settings.search_timeout)
+    except z3950Pool.Z3950Error as e:
+        sourceHealth.record(library or target_string, False, time.monotonic() - started)
         logs.log_error("Error from Z39.50: " + str(e))
         return {'lccn': '', 'oclc': ''}
+    sourceHealth.record(library or target_string, True, time.monotonic() - started)
+
+    # Only cache answers that got as far as a search, not ones that failed to connect
+    if library and "Number of hits:" in output:
+        LMH_response_cache.store(library, isbn, output, negative="Number of hits: 0" in output)
+
+    # Process the MARC record text
+    return parse_text_marc(output)
+
+
+def split_records(output):
+    """
+    Splits the yaz-client's output for a present request into the text
+    of each record, every one of which starts with a "Record type:"
+    line.
+    """
+    starts = [match.start() for match in _RECORD_START.finditer(output)]
+    return [output[start:end] for start, end in zip(starts, starts[1:] + [len(output)])]
+
+
+def record_isbns(record):
+    # Every ISBN in the record's 020 fields as an ISBN-13
+    isbns = set()
+    for line in record.split('\n'):
+        if line[:3] == "020" and '$a' in line:
+            isbns.add(isbnNormalization.isbn13(line.split('$a')[1].split('$')[0]))
+    isbns.discard('')
+    return isbns
+
+
+def prefetch(numbers, library):
+    """
+    Searches a library for many ISBNs with one OR query per BATCH_SIZE
+    of them and maps the records found back to the ISBNs through
+    their 020 fields. Each ISBN's answer is handed to parse_data
+    through the response cache, in the same form a search for just
+    that ISBN gives. ISBNs the library has no record for are only
+    recorded as not found if every record found was fetched.
+    """
+    settings = config.get_settings()
+    target_string = settings.z3950_sources.get(library)
+    if not target_string or not settings.yaz_client_path:
+        return
+
+    numbers = [number for number in numbers if not LMH_response_cache.is_known(library, number)]
+    for start in range(0, len(numbers), BATCH_SIZE):
+        batch = numbers[start:start + BATCH_SIZE]
+        rateLimiter.acquire(library, "Z39.50")
+        started = time.monotonic()
+        try:
+            output = z3950Pool.search_many(settings.yaz_client_path, target_string, batch, settings.search_timeout)
+        except z3950Pool.Z3950Error as e:
+            sourceHealth.record(library, False, time.monotonic() - started)
+            logs.log_error("Error from Z39.50: " + str(e))
+            continue
+        sourceHealth.record(library, True, time.monotonic() - started)
+
+        hits = _HITS.search(output)
+        if hits is None:
+            continue
+        records = split_records(output)
+        by_isbn = {}
+        for record in records:
+            for isbn in record_isbns(record):
+                by_isbn.setdefault(isbn, record)
+        all_fetched = int(hits.group(1)) <= len(records)
+
+        for number in batch:
+            record = by_isbn.get(isbnNormalization.isbn13(number))
+            if record is not None:
+                LMH_response_cache.prefetch(library, number, "Number of hits: 1\n" + record)
+            elif all_fetched:
+                LMH_response_cache.prefetch(library, number, "Number of hits: 0\n", negative=True)
 
 
 def parse_data(entry, number, retrieval_settings, library):
-    config_file = config.load_config()
+    settings = config.get_settings()
 
-    for key, target_string in config_file["z3950_sources"].items():
+    for key, target_string in settings.z3950_sources.items():
         if library == key:
-            library_data = run_yaz_client(number, target_string)
+            found, text_marc = LMH_response_cache.lookup(library, number)
+            if found:
+                library_data = parse_text_marc(text_marc)
+            else:
+                # Only limited if the library or "Z39.50" has an entry in the rate_limits setting
+                rateLimiter.acquire(library, "Z39.50")
+                library_data = run_yaz_client(number, target_string, library)
             if library_data['lccn']:
                 if (entry.get('lccn') == '' or entry.get('lccn') is None and retrieval_settings['retrieve_lccn'] and
                         callNumberValidation.validate_lc_call_number(library_data['lccn'])):
@@ -0,0 +1,295 @@
+import atexit
+import codecs
+import os
+import re
+import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError
+from app import logs, metrics
+
+# yaz-client prints this prompt once it is done with a command and ready for the next one
+PROMPT = "Z> "
+# Output meaning the target dropped the session, in which case it is opened again
+DISCONNECTED = ("Not connected", "Connection closed", "Target closed connection")
+# Seconds a session is given to quit before it is killed
+QUIT_TIMEOUT = 2
+# Records fetched per ISBN by a batched search, catalogues can hold several records for one ISBN
+RECORDS_PER_ISBN = 2
+
+_PROMPT_PATTERN = re.compile(r'(?:^|\n)' + re.escape(PROMPT))
+_HITS_PATTERN = re.compile(r'Number of hits: (\d+)')
+
+_sessions = {}
+_session_locks = {}
+_sessions_lock = threading.Lock()
+
+
+class Z3950Error(Exception):
+    """
+    Raised when a target cannot be connected to or a session fails.
+    """
+
+
+class YazSession:
+    """
+    Long-lived yaz-client connected to one Z39.50 target. Commands are
+    written to its stdin as soon as they are sent, so searches from
+    several threads are pipelined, and its output is split back into
+    one answer per command at every prompt.
+
+    lock guards the waiting answers and the output read so far.
+    write_lock keeps commands in the order their answers are waited
+    for and is held while writing to stdin, which can block until the
+    yaz-client has read what was written before. The reader thread
+    only takes lock, so it keeps draining the yaz-client's output while
+    a write is blocked.
+    """
+    def __init__(self, yaz_client_path, target_string, timeout):
+        self.target_string = target_string
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.waiting = deque()
+        self.buffer = ''
+        self.closed = False
+
+        startupinfo = None
+        if os.name == 'nt':
+            # Keep a console window from opening for the yaz-client on Windows
+            startupinfo = subprocess.STARTUPINFO()
+            startupinfo.dwFlags = subprocess.STARTF_USESHOWWINDOW
+            startupinfo.wShowWindow = 0
+        try:
+            self.process = subprocess.Popen([yaz_client_path, target_string], stdin=subprocess.PIPE,
+                                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=0,
+                                            startupinfo=startupinfo)
+        except OSError as e:
+            raise Z3950Error(f"Could not start the yaz-client: {e}")
+
+        # The first prompt comes once the yaz-client has connected to the target
+        connected = self._expect(1)
+        threading.Thread(target=self._read, name="lmh-yaz", daemon=True).start()
+        try:
+            banner = connected.result(timeout)
+        except TimeoutError:
+            self.close()
+            raise Z3950Error(f"Timed out connecting to {target_string}")
+        if "Connection accepted" not in banner:
+            self.close()
+            raise Z3950Error(f"Could not connect to {target_string}: {banner.strip()}")
+
+    def alive(self):
+        return not self.closed and self.process.poll() is None
+
+    def _expect(self, prompts):
+        # Queues a future that is given the output up to the next prompts prompts
+        future = Future()
+        self.waiting.append([prompts, [], future])
+        return future
+
+    def send(self, commands):
+        """
+        Sends a list of commands and returns a future for their output.
+        """
+        with self.write_lock:
+            return self._write(commands)
+
+    def _write(self, commands):
+        # Called with write_lock held
+        with self.lock:
+            if self.closed:
+                raise Z3950Error(f"Session to {self.target_string} is closed")
+            future = self._expect(len(commands))
+        try:
+            self.process.stdin.write(("\n".join(commands) + "\n").encode('utf-8'))
+            self.process.stdin.flush()
+        except (OSError, ValueError) as e:
+            # ValueError if close() shut stdin while this was waiting to write
+            self._fail(Z3950Error(f"Session to {self.target_string} failed: {e}"))
+            raise Z3950Error(f"Session to {self.target_string} failed: {e}")
+        return future
+
+    def run(self, commands, timeout, follow_up=None):
+        """
+        Sends a list of commands and returns their output once the
+        yaz-client has answered all of them. follow_up, if given, is
+        called with that output and returns the commands to send next,
+        whose output is added to it. No other thread's commands are
+        sent in between, so they work on the same result set.
+        """
+        try:
+            if follow_up is None:
+                return self.send(commands).result(timeout)
+            with self.write_lock:
+                output = self._write(commands).result(timeout)
+                more = follow_up(output)
+                if more:
+                    output += "\n" + self._write(more).result(timeout)
+                return output
+        except TimeoutError:
+            # The output of the commands still to come can no longer be matched up, so start over
+            self.close()
+            raise Z3950Error(f"Timed out searching {self.target_string}")
+
+    def _read(self):
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        while True:
+            try:
+                data = os.read(self.process.stdout.fileno(), 65536)
+            except (OSError, ValueError):
+                break
+            if not data:
+                break
+            self._feed(decoder.decode(data))
+        self.process.stdout.close()
+        self._fail(Z3950Error(f"Session to {self.target_string} ended"))
+
+    def _feed(self, text):
+        with self.lock:
+            self.buffer += text
+            while True:
+                match = _PROMPT_PATTERN.search(self.buffer)
+                if match is None:
+                    break
+                output = self.buffer[:match.start()]
+                self.buffer = self.buffer[match.end():]
+                if not self.waiting:
+                    continue
+                head = self.waiting[0]
+                head[0] -= 1
+                head[1].append(output)
+                if head[0] == 0:
+                    self.waiting.popleft()
+                    head[2].set_result("\n".join(head[1]))
+
+    def _fail(self, error):
+        with self.lock:
+            self.closed = True
+            while self.waiting:
+                future = self.waiting.popleft()[2]
+                if not future.done():
+                    future.set_exception(error)
+
+    def close(self):
+        """
+        Quits the yaz-client, killing it if it does not quit in time.
+        """
+        with self.lock:
+            already_closed = self.closed
+            self.closed = True
+        if self.process.poll() is None:
+            try:
+                # A write that is stuck keeps the quit from being sent, the yaz-client is then killed
+                if not already_closed and self.write_lock.acquire(timeout=QUIT_TIMEOUT):
+                    try:
+                        self.process.stdin.write(b"quit\n")
+                        self.process.stdin.flush()
+                    finally:
+                        self.write_lock.release()
+                self.process.wait(QUIT_TIMEOUT)
+            except (OSError, ValueError, subprocess.TimeoutExpired):
+                self.process.kill()
+                self.process.wait()
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        self._fail(Z3950Error(f"Session to {self.target_string} was closed"))
+
+
+def get_session(yaz_client_path, target_string, timeout):
+    """
+    Returns the open session to a target, connecting to it first if
+    there is none. Raises Z3950Error if the target cannot be reached.
+    """
+    key = (yaz_client_path, target_string)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is not None and session.alive():
+            return session
+        lock = _session_locks.setdefault(key, threading.Lock())
+
+    # Only one thread connects to a target, the others wait for its session
+    with lock:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is not None and session.alive():
+                return session
+        started = time.monotonic()
+        session = YazSession(yaz_client_path, target_string, timeout)
+        metrics.record("yaz_spawn", target_string, time.monotonic() - started)
+        with _sessions_lock:
+            _sessions[key] = session
+        return session
+
+
+def _drop_session(session):
+    with _sessions_lock:
+        for key, value in list(_sessions.items()):
+            if value is session:
+                del _sessions[key]
+    session.close()
+
+
+def _run(yaz_client_path, target_string, commands, timeout, follow_up=None):
+    # Runs commands over the target's pooled session, opening it again and retrying once if the target dropped it
+    for attempt in range(2):
+        session = get_session(yaz_client_path, target_string, timeout)
+        try:
+            output = session.run(commands, timeout, follow_up)
+        except Z3950Error as e:
+            _drop_session(session)
+            if attempt:
+                raise
+            logs.log_warning(f"{e}, reconnecting")
+            continue
+
+        if not any(message in output for message in DISCONNECTED):
+            return output
+        _drop_session(session)
+        logs.log_warning(f"{target_string} closed its Z39.50 session, reconnecting")
+    raise Z3950Error(f"{target_string} keeps closing its Z39.50 session")
+
+
+def search(yaz_client_path, target_string, isbn, timeout):
+    """
+    Searches a target for an ISBN over its pooled session and returns
+    the yaz-client's output for the search and its first record.
+    Raises Z3950Error if the search fails.
+    """
+    return _run(yaz_client_path, target_string, [f"find @attr 1=7 {isbn}", "show 1"], timeout)
+
+
+def search_many(yaz_client_path, target_string, isbns, timeout):
+    """
+    Searches a target for any of several ISBNs with one OR query and
+    fetches the records found with one present request. Returns the
+    yaz-client's output, see z3950.split_records for telling the
+    records apart. Raises Z3950Error if the search fails.
+    """
+    # RPN is prefix notation, so "@or @or A B C" is (A or B) or C
+    query = "@or " * (len(isbns) - 1) + " ".join(f"@attr 1=7 {isbn}" for isbn in isbns)
+
+    def present(output):
+        # Asking for more records than were found is an error, so the present waits for the number of hits
+        match = _HITS_PATTERN.search(output)
+        hits = int(match.group(1)) if match else 0
+        return [f"show 1+{min(hits, len(isbns) * RECORDS_PER_ISBN)}"] if hits else []
+
+    # The present has to follow the find straight away, another thread's find would replace the result set
+    return _run(yaz_client_path, target_string, [f"find {query}"], timeout, present)
+
+
+def close_all():
+    """
+    Closes every pooled session. Called automatically on exit.
+    """
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
+
+
+atexit.register(close_all)
@@ -0,0 +1,258 @@
+import argparse
+import asyncio
+import json
+import random
+import re
+import socket
+import sys
+import time
+import zlib
+from aiohttp import web
+
+# Names the stand-ins are given latencies under
+SOURCES = ("harvard", "openlibrary", "loc", "google", "blacklight", "z3950")
+# Classes the made up call numbers start with
+CLASSES = ("QA", "PR", "HD", "BF", "PS", "Z", "KF", "DA")
+# Results LOC gives per page when a search does not ask for a number
+LOC_PAGE_SIZE = 25
+
+_TERM = re.compile(r'[0-9Xx]+')
+
+
+def book(number, is_oclc):
+    """
+    Returns the made up record of a book as a dictionary with its
+    isbn, oclc and lccn. The same number always gives the same record,
+    so every stand-in agrees on what a book's metadata is.
+    """
+    digest = zlib.crc32(number.encode('utf-8'))
+    if is_oclc:
+        core = f"978{digest % 10 ** 9:09d}"
+        check = (10 - sum(int(digit) * (3 if position % 2 else 1) for position, digit in enumerate(core)) % 10) % 10
+        isbn, oclc = core + str(check), number
+    else:
+        isbn, oclc = number, str(digest % 10 ** 9 + 1)
+    lccn = (f"{CLASSES[digest % len(CLASSES)]}{digest % 900 + 100}.{digest % 97 + 1} "
+            f"B{digest % 89 + 10} {1950 + digest % 70}")
+    return {'isbn': isbn, 'oclc': oclc, 'lccn': lccn}
+
+
+def is_oclc_number(number):
+    # Input values are told apart the way the command line does it, OCNs are shorter than ISBNs
+    return len(number) < 10
+
+
+class MockCatalogue:
+    """
+    Stand-in for every source the LMH searches, answering in each
+    one's format from made up records. A source holds a book with the
+    chance coverage, sleeps for its latency (half to one and a half
+    times it) before answering and fails with a 503 with the chance
+    error_rate.
+    """
+    def __init__(self, latency=0.0, error_rate=0.0, coverage=0.6, seed=0, source_latency=None):
+        self.latency = {source: latency for source in SOURCES}
+        self.latency.update(source_latency or {})
+        self.error_rate = error_rate
+        self.coverage = coverage
+        self.seed = seed
+        self.random = random.Random(seed)
+
+    def holds(self, source, number):
+        return zlib.crc32(f"{self.seed}:{source}:{number}".encode('utf-8')) % 1000 < self.coverage * 1000
+
+    def found(self, source, numbers, is_oclc=None):
+        # The records source holds for numbers, in their order
+        return [book(number, is_oclc_number(number) if is_oclc is None else is_oclc)
+                for number in numbers if self.holds(source, number)]
+
+    async def delay(self, source):
+        """
+        Waits for the source's latency and returns True if the request
+        should fail.
+        """
+        latency = self.latency[source]
+        if latency:
+            await asyncio.sleep(latency * self.random.uniform(0.5, 1.5))
+        return self.random.random() < self.error_rate
+
+    def application(self):
+        app = web.Application()
+        app.router.add_get('/harvard/rest/v3/hollis/mods/isbn/{isbn}', self.harvard)
+        app.router.add_get('/openlibrary/api/books', self.open_library)
+        app.router.add_get('/loc/search/', self.loc)
+        app.router.add_get('/google/books/v1/volumes', self.google)
+        app.router.add_get('/blacklight/catalog', self.blacklight_search)
+        app.router.add_get('/blacklight/catalog/{doc_id}', self.blacklight_document)
+        app.router.add_get('/blacklight/catalog/{doc_id}/librarian_view', self.blacklight_document)
+        return app
+
+    async def harvard(self, request):
+        if await self.delay("harvard"):
+            return web.Response(status=503)
+        isbn = request.match_info['isbn']
+        if not self.holds("harvard", isbn):
+            return web.Response(status=404)
+        record = book(isbn, False)
+        mods = {'mods': {'identifier': [{'type': 'isbn', 'content': isbn}, {'type': 'oclc', 'content': record['oclc']}],
+                         'classification': {'authority': 'lcc', 'content': record['lccn']}}}
+        return web.Response(text=f"{request.query.get('jsonp', 'callback')}({json.dumps(mods)})")
+
+    async def open_library(self, request):
+        if await self.delay("openlibrary"):
+            return web.Response(status=503)
+        answer = {}
+        for key in request.query.get('bibkeys', '').split(','):
+            is_oclc = key.startswith("OCLC")
+            number = key[4:] if is_oclc else key.split(":")[-1]
+            if number and self.holds("openlibrary", number):
+                record = book(number, is_oclc)
+                answer[key] = {'identifiers': {'oclc': [record['oclc']], 'isbn_13': [record['isbn']]},
+                               'classifications': {'lc_classifications': [record['lccn']]}}
+        return web.json_response(answer)
+
+    async def loc(self, request):
+        if await self.delay("loc"):
+            return web.Response(status=503)
+        numbers = _TERM.findall(request.query.get('q', ''))
+        results = [{'item': {'call_number': [record['lccn']]}, 'number_oclc': [record['oclc']],
+                    'isbn': [record['isbn']]} for record in self.found("loc", numbers)]
+        size = int(request.query.get('c', LOC_PAGE_SIZE))
+        page = int(request.query.get('sp', 1))
+        following = None
+        if page * size < len(results):
+            following = str(request.url.update_query(sp=page + 1))
+        return web.json_response({'results': results[(page - 1) * size:page * size],
+                                  'pagination': {'next': following}})
+
+    async def google(self, request):
+        if await self.delay("google"):
+            return web.Response(status=503)
+        records = []
+        for term in request.query.get('q', '').split(" OR "):
+            kind, _, number = term.strip().partition(":")
+            if number and self.holds("google", number):
+                records.append(book(number, kind == "oclc"))
+        start = int(request.query.get('startIndex', 0))
+        volumes = [{'volumeInfo': {'industryIdentifiers': [
+                       {'type': 'ISBN_13', 'identifier': record['isbn']},
+                       {'type': 'other', 'identifier': f"OCLC:{record['oclc']}"}]}}
+                   for record in records[start:start + int(request.query.get('maxResults', 10))]]
+        answer = {'totalItems': len(records)}
+        if volumes:
+            answer['items'] = volumes
+        return web.json_response(answer)
+
+    async def blacklight_search(self, request):
+        if await self.delay("blacklight"):
+            return web.Response(status=503)
+        number = request.query.get('q', '')
+        links = f'<li><a href="/catalog/B{number}">Result</a></li>' if self.holds("blacklight", number) else ''
+        return web.Response(text=f"<html><body><ul>{links}</ul></body></html>", content_type='text/html')
+
+    async def blacklight_document(self, request):
+        if await self.delay("blacklight"):
+            return web.Response(status=503)
+        # Document IDs are the number searched for with a letter in front
+        number = request.match_info['doc_id'][1:]
+        record = book(number, is_oclc_number(number))
+        first, second = record['lccn'].split(" ", 1)
+        page = (f'<html><body><span class="sub_code">a|</span> {first} <br>'
+                f'<span class="sub_code">b|</span> {second} <br>(OCoLC)ocm{record["oclc"]}</body></html>')
+        return web.Response(text=page, content_type='text/html')
+
+    async def serve(self, port=0):
+        """
+        Serves the stand-ins on a local port and prints the port once
+        they are ready, then runs until the process is stopped.
+        """
+        runner = web.AppRunner(self.application(), access_log=None)
+        await runner.setup()
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", port))
+        await web.SockSite(runner, sock).start()
+        print(f"Serving on port {sock.getsockname()[1]}", flush=True)
+        await asyncio.Event().wait()
+
+    def run_yaz_client(self, stdin=sys.stdin, stdout=sys.stdout):
+        """
+        Answers yaz-client commands read from stdin like a yaz-client
+        connected to a Z39.50 target holding the made up records. A
+        failed search answers as if the target dropped the session.
+        """
+        stdout.write("Connecting...OK.\nSent initrequest.\nConnection accepted by v3 target.\nZ> ")
+        stdout.flush()
+        found = []
+        for line in stdin:
+            command = line.split()
+            if not command:
+                continue
+            if command[0] == "quit":
+                break
+            if command[0] == "find":
+                latency = self.latency["z3950"]
+                if latency:
+                    time.sleep(latency * self.random.uniform(0.5, 1.5))
+                if self.random.random() < self.error_rate:
+                    stdout.write("Target closed connection\nZ> ")
+                    stdout.flush()
+                    break
+                found = self.found("z3950", [word for word in command[1:] if _TERM.fullmatch(word)], False)
+                stdout.write(f"Sent searchRequest.\nReceived SearchResponse.\nNumber of hits: {len(found)}, setno 1\n")
+            elif command[0] == "show":
+                count = int(command[1].split("+")[1]) if "+" in command[1] else 1
+                stdout.write(f"Sent presentRequest (1+{count}).\nRecords: {min(count, len(found))}\n")
+                for record in found[:count]:
+                    stdout.write(f"[Default]Record type: USmarc\n020    $a {record['isbn']}\n"
+                                 f"050 00 $a {record['lccn'].replace(' ', ' $b ', 1)}\n"
+                                 f"079    $a (OCoLC){record['oclc']}\n")
+            stdout.write("Z> ")
+            stdout.flush()
+
+
+def parse_source_latency(values):
+    """
+    Turns NAME=SECONDS strings into a dictionary of latencies, raising
+    ValueError for an unknown source name or a bad number.
+    """
+    latencies = {}
+    for value in values or []:
+        name, _, seconds = value.partition("=")
+        if name not in SOURCES:
+            raise ValueError(f"Unknown source: {name}, expected one of {', '.join(SOURCES)}")
+        latencies[name] = float(seconds)
+    return latencies
+
+
+def add_arguments(parser):
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds every source takes to answer.")
+    parser.add_argument("--source-latency", action="append", metavar="NAME=SECONDS",
+                        help=f"Latency of one source, one of {', '.join(SOURCES)}. Can be given more than once.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests that fail.")
+    parser.add_argument("--coverage", type=float, default=0.6, help="Share of the books each source holds.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the holdings, latencies and errors.")
+
+
+def from_arguments(args):
+    return MockCatalogue(args.latency, args.error_rate, args.coverage, args.seed,
+                         parse_source_latency(args.source_latency))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for every source the LMH searches")
+    parser.add_argument("--port", type=int, default=0, help="Port to serve on. Defaults to any free port.")
+    parser.add_argument("--yaz-client", action="store_true",
+                        help="Act as a yaz-client connected to a Z39.50 target instead of serving HTTP.")
+    add_arguments(parser)
+    # A yaz-client is started with the target as its only argument, which is not needed here
+    args, _ = parser.parse_known_args(argv)
+
+    catalogue = from_arguments(args)
+    if args.yaz_client:
+        catalogue.run_yaz_client()
+    else:
+        asyncio.run(catalogue.serve(args.port))
+
+
+if __name__ == "__main__":
+    main()
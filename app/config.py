@@ -1,51 +1,231 @@
+import copy
 import json
+import os
+import threading
+from dataclasses import dataclass, fields
+from types import MappingProxyType
+from typing import Mapping
+
+CONFIG_FILE = "config.json"
+
+DEFAULT_CONFIG = {
+    "google_api_key": "YOUR_GOOGLE_API_KEY",
+    "search_timeout": 10,  # Default search timeout in seconds
+    "max_workers": 8,  # Number of values searched for at the same time
+    "race_sources": 1,  # Sources searched at the same time for one value, 1 searches them one after another
+    "db_batch_size": 100,  # Number of results committed to the database together
+    "db_batch_interval": 5,  # Seconds after which waiting results are committed anyway
+    "retrieve_isbn": True,
+    "retrieve_oclc": True,
+    "retrieve_lccn": True,
+    "appearance_mode": "Dark",
+    "yaz_client_path": "",
+    "z3950_sources": {
+        "Yale": "z3950.library.yale.edu:7090/voyager",
+        "UVa": "virgo.lib.virginia.edu:2200/unicorn",
+        "UAlberta": "ualapp.library.ualberta.ca:2200/unicorn",
+        "Oxford": "library.ox.ac.uk:210/44OXF_INST",
+        "Mich": "141.215.16.4:210/INNOPAC",
+        "UCLA": "z3950.library.ucla.edu:1921/01UCS_LAL",
+        "Cambridge": "newton.lib.cam.ac.uk:7790/voyager",
+        "NLA": "catalogue.nla.gov.au:7090/voyager",
+        "NCSU": "sirsi.lib.ncsu.edu:2200/UNICORN",
+        "Toronto": "utoronto.alma.exlibrisgroup.com:1921/01UTORONTO_INST",
+        "NLAus": "catalogue.nla.gov.au:7090/voyager",
+        "UBC": "ils.library.ubc.ca:7090/Voyager",
+        "DUKE": "catalog.library.duke.edu:9991/DUK01",
+        "IUCAT": "libprd.uits.indiana.edu:2200/UNICORN",
+        "QUEENS": "ocul-qu.alma.exlibrisgroup.com:210/01OCUL_QU",
+        "UCB": "berkeley.alma.exlibrisgroup.com:1921/01UCS_BER/UCB",
+        "NYU": "aleph.library.nyu.edu:9991/NYU01PUB",
+        "UPenn": "na03.alma.exlibrisgroup.com:1921/01UPENN_INST",
+        "NYPL": "nyst.sirsi.net:8419/unicorn"
+    },
+    "web_scraping_sources": {},
+    # Patterns a web scraping source's pages are searched with, by source name, replacing the defaults in webScraper
+    "web_scraping_rules": {},
+    "web_scraping_capture": False,  # Keep every page scraped in web_pages/ to debug a source's patterns
+    "web_scraping_connections": 4,  # Pages downloaded from one catalogue at the same time
+    "ordered_sources": [],
+    # Put the sources that have filled in values fastest first, learning as searches run. Sources listed in
+    # pinned_sources keep their place in ordered_sources
+    "adaptive_source_order": False,
+    "pinned_sources": [],
+    # Requests per second and largest burst allowed for each source. Web scraping limits are looked up by host name
+    # first, and Z39.50 limits by library name first, falling back to the "Web scraping" and "Z39.50" entries
+    "rate_limits": {
+        "Harvard": {"rate": 5, "burst": 10},
+        "Open Library": {"rate": 3, "burst": 10},
+        "LOC": {"rate": 1, "burst": 10},
+        "Google Books": {"rate": 1, "burst": 10},
+        "Web scraping": {"rate": 1, "burst": 10}
+    },
+    # Replaces the start of an API's URLs, for example {"https://www.loc.gov": "http://localhost:8080/loc"}, to search a
+    # mirror or the benchmark's stand-in server instead
+    "api_base_urls": {},
+    # SQLite file holding the rate limits so that several harvests on one machine share them, "" keeps them in memory
+    "rate_limit_file": "",
+    # A source is skipped once this share of its last 20 requests failed, as long as at least circuit_breaker_min_calls
+    # were made (0 never skips a source), and tried again after circuit_breaker_open_seconds
+    "circuit_breaker_failure_rate": 0.5,
+    "circuit_breaker_min_calls": 5,
+    "circuit_breaker_open_seconds": 30,
+    # Time every stage of a harvest per source and log a summary when it ends. The times can also be written as a
+    # Prometheus text file and as one JSON line per value searched for
+    "metrics": True,
+    "metrics_prometheus_file": "",
+    "metrics_jsonl_file": "",
+    # Messages below log_level are not written to lmh_log.log. Once the log reaches log_max_bytes a new one is started,
+    # keeping log_backup_count old ones as lmh_log.log.1 and so on. A log_max_bytes of 0 keeps one file growing
+    "log_level": "INFO",
+    "log_max_bytes": 10485760,
+    "log_backup_count": 3,
+    # SQLite file next to LMH_database.db caching what each source answered, so repeated values skip the network
+    "response_cache_file": "LMH_response_cache.db",
+    "response_cache_ttl": 2592000,  # Seconds a response is cached for, 0 turns the cache off
+    "response_cache_negative_ttl": 604800,  # Seconds a "nothing found" answer is cached for
+    "response_cache_max_size": 200  # Megabytes the cache is kept under, oldest responses are evicted first
+}
+
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    Read-only snapshot of config.json. Harvests read their settings
+    from one of these instead of opening the config file for every
+    value. Settings missing from an older config file fall back to
+    their defaults.
+    """
+    google_api_key: str
+    search_timeout: int
+    max_workers: int
+    race_sources: int
+    db_batch_size: int
+    db_batch_interval: float
+    retrieve_isbn: bool
+    retrieve_oclc: bool
+    retrieve_lccn: bool
+    appearance_mode: str
+    yaz_client_path: str
+    z3950_sources: Mapping[str, str]
+    web_scraping_sources: Mapping[str, tuple]
+    web_scraping_rules: Mapping[str, Mapping[str, list]]
+    web_scraping_capture: bool
+    web_scraping_connections: int
+    ordered_sources: tuple
+    adaptive_source_order: bool
+    pinned_sources: tuple
+    rate_limits: Mapping[str, Mapping[str, float]]
+    rate_limit_file: str
+    api_base_urls: Mapping[str, str]
+    circuit_breaker_failure_rate: float
+    circuit_breaker_min_calls: int
+    circuit_breaker_open_seconds: float
+    metrics: bool
+    metrics_prometheus_file: str
+    metrics_jsonl_file: str
+    log_level: str
+    log_max_bytes: int
+    log_backup_count: int
+    response_cache_file: str
+    response_cache_ttl: float
+    response_cache_negative_ttl: float
+    response_cache_max_size: float
+
+    @classmethod
+    def from_dict(cls, config):
+        values = {}
+        for setting in fields(cls):
+            value = copy.deepcopy(config.get(setting.name, DEFAULT_CONFIG[setting.name]))
+            if setting.name == "rate_limits":
+                # Sources left out of an older config file keep their default limit
+                value = {**DEFAULT_CONFIG["rate_limits"], **value}
+            if isinstance(value, dict):
+                value = MappingProxyType({key: _freeze(item) for key, item in value.items()})
+            elif isinstance(value, list):
+                value = tuple(value)
+            values[setting.name] = value
+        return cls(**values)
+
+
+def _freeze(value):
+    if isinstance(value, list):
+        return tuple(value)
+    if isinstance(value, dict):
+        return MappingProxyType(dict(value))
+    return value
+
+
+_settings = None
+_settings_mtime = None
+_settings_lock = threading.Lock()
 
 
 def load_config():
     try:
-        with open("config.json", 'r') as f:
+        with open(CONFIG_FILE, 'r') as f:
             return json.load(f)
     except FileNotFoundError:
         # If config file doesn't exist, create a new one with default values
-        default_config = {
-            "google_api_key": "YOUR_GOOGLE_API_KEY",
-            "search_timeout": 10,  # Default search timeout in seconds
-            "retrieve_isbn": True,
-            "retrieve_oclc": True,
-            "retrieve_lccn": True,
-            "appearance_mode": "Dark",
-            "yaz_client_path": "",
-            "z3950_sources": {
-                "Yale": "z3950.library.yale.edu:7090/voyager",
-                "UVa": "virgo.lib.virginia.edu:2200/unicorn",
-                "UAlberta": "ualapp.library.ualberta.ca:2200/unicorn",
-                "Oxford": "library.ox.ac.uk:210/44OXF_INST",
-                "Mich": "141.215.16.4:210/INNOPAC",
-                "UCLA": "z3950.library.ucla.edu:1921/01UCS_LAL",
-                "Cambridge": "newton.lib.cam.ac.uk:7790/voyager",
-                "NLA": "catalogue.nla.gov.au:7090/voyager",
-                "NCSU": "sirsi.lib.ncsu.edu:2200/UNICORN",
-                "Toronto": "utoronto.alma.exlibrisgroup.com:1921/01UTORONTO_INST",
-                "NLAus": "catalogue.nla.gov.au:7090/voyager",
-                "UBC": "ils.library.ubc.ca:7090/Voyager",
-                "DUKE": "catalog.library.duke.edu:9991/DUK01",
-                "IUCAT": "libprd.uits.indiana.edu:2200/UNICORN",
-                "QUEENS": "ocul-qu.alma.exlibrisgroup.com:210/01OCUL_QU",
-                "UCB": "berkeley.alma.exlibrisgroup.com:1921/01UCS_BER/UCB",
-                "NYU": "aleph.library.nyu.edu:9991/NYU01PUB",
-                "UPenn": "na03.alma.exlibrisgroup.com:1921/01UPENN_INST",
-                "NYPL": "nyst.sirsi.net:8419/unicorn"
-            },
-            "web_scraping_sources": {},
-            "ordered_sources": []
-        }
+        default_config = copy.deepcopy(DEFAULT_CONFIG)
         save_config(default_config)
         return default_config
 
 
 def save_config(new_config):
-    with open("config.json", 'w') as f:
-        json.dump(new_config, f, indent=4)
+    global _settings, _settings_mtime
+    with _settings_lock:
+        with open(CONFIG_FILE, 'w') as f:
+            json.dump(new_config, f, indent=4)
+        # Keep the snapshot in step with what was just written
+        _settings = Settings.from_dict(new_config)
+        _settings_mtime = _config_mtime()
+
+
+def get_settings(reload=False):
+    """
+    Returns the current Settings snapshot without touching the disk.
+    The snapshot is loaded on first use and replaced whenever
+    save_config writes. With reload=True the config file is checked
+    and re-read if it was changed by something else, which harvests
+    do once before they start.
+    """
+    global _settings, _settings_mtime
+    settings = _settings
+    if settings is not None and not reload:
+        return settings
+
+    with _settings_lock:
+        if _settings is not None and _config_mtime() == _settings_mtime:
+            return _settings
+
+    config = load_config()
+    with _settings_lock:
+        _settings = Settings.from_dict(config)
+        _settings_mtime = _config_mtime()
+        return _settings
+
+
+def use_settings(settings):
+    """
+    Makes settings the current snapshot without writing config.json,
+    so a harvest can run with settings of its own, like the
+    benchmark's. Returns the snapshot it replaced, None if none had
+    been loaded, to be handed back to use_settings afterwards.
+    """
+    global _settings, _settings_mtime
+    with _settings_lock:
+        previous = _settings
+        _settings = settings
+        _settings_mtime = _config_mtime()
+        return previous
+
+
+def _config_mtime():
+    try:
+        return os.stat(CONFIG_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return None
 
 
 def set_search_timeout(config, search_timeout):
@@ -53,6 +233,11 @@ def set_search_timeout(config, search_timeout):
     save_config(config)
 
 
+def set_max_workers(config, max_workers):
+    config["max_workers"] = max_workers
+    save_config(config)
+
+
 def set_google_key(config, google_key):
     config["google_api_key"] = google_key
     save_config(config)
@@ -1,10 +1,35 @@
+import json
 import sqlite3
+import time
 from sqlite3 import Error
 from app import logs
 
+# Numbers looked up per query by get_many, kept below SQLite's limit of 999 parameters
+LOOKUP_CHUNK_SIZE = 500
+
+# Stored in PRAGMA user_version. 0 is the original table without keys or indexes, 1 has no source_stats table and
+# 2 has unique OCNs
+SCHEMA_VERSION = 3
+
+_FILL_LCCN = """lccn = CASE WHEN IFNULL(lccn, '') = '' THEN excluded.lccn ELSE lccn END,
+                lccn_source = CASE WHEN IFNULL(lccn, '') = '' THEN excluded.lccn_source ELSE lccn_source END"""
+
+# ISBNs are unique, so a row is found by its ISBN. Several ISBNs (an ISBN-10 and its ISBN-13, or editions) can share
+# one OCN, so OCNs are not
+INSERT_BY_ISBN = f"""INSERT INTO metadata (isbn, ocn, lccn, lccn_source) VALUES (?, ?, ?, ?)
+                     ON CONFLICT (isbn) WHERE isbn != '' DO UPDATE SET
+                     ocn = CASE WHEN IFNULL(ocn, '') = '' THEN excluded.ocn ELSE ocn END, {_FILL_LCCN}"""
+# An OCN is matched to the oldest row that has it. An empty ISBN is only filled in if no other row has that ISBN
+UPDATE_BY_OCN = """UPDATE metadata SET
+                   isbn = CASE WHEN IFNULL(isbn, '') = '' AND NOT EXISTS (SELECT 1 FROM metadata WHERE isbn = :isbn)
+                          THEN :isbn ELSE isbn END,
+                   lccn_source = CASE WHEN IFNULL(lccn, '') = '' THEN :lccn_source ELSE lccn_source END,
+                   lccn = CASE WHEN IFNULL(lccn, '') = '' THEN :lccn ELSE lccn END
+                   WHERE id = (SELECT id FROM metadata WHERE ocn = :ocn AND ocn != '' ORDER BY id LIMIT 1)"""
+
 
 class Database:
-    def __init__(self, database_name='database.db'):
+    def __init__(self, database_name='database.db', persistent=False, batch_size=1, batch_interval=0):
         """
         The initialization of a Database object. Creates the
         appropriate table inside the database
@@ -12,54 +37,138 @@ class Database:
         Parameters:
         - database_name: Name of the database file to be used. String
 
+        - persistent: True to keep a single connection open until
+                      close() is called instead of opening one per call.
+
+        - batch_size: Number of inserts buffered before they are
+                      committed together. 1 commits every insert. Integer
+
+        - batch_interval: Seconds after which buffered inserts are
+                          committed even if batch_size has not been
+                          reached. 0 disables the limit. It is only
+                          checked on the next insert or lookup, so
+                          inserts wait longer if none comes until
+                          flush() or close() is called. Number
+
         """
         self.database_name = database_name
         self.connection = None
+        self.persistent = persistent
+        self.batch_size = max(1, int(batch_size))
+        self.batch_interval = batch_interval
+        self.pending_inserts = []
+        self.pending_numbers = set()
+        self.pending_since = None
         self.create_table()
 
     def open_connection(self):
         """
-        Function that opens the connection to the database
+        Function that opens the connection to the database. A
+        persistent database reuses its connection if it is open.
         """
+        if self.persistent and self.connection:
+            return
         self.connection = sqlite3.connect(self.database_name)
 
     def close_connection(self):
         """
-        Function that closes the connection to the database
+        Function that closes the connection to the database. A
+        persistent database keeps its connection open, use close()
+        to close it.
+        """
+        if self.connection and not self.persistent:
+            self.connection.close()
+
+    def close(self):
+        """
+        Function that commits any buffered inserts and closes the
+        connection, including a persistent one.
         """
+        self.flush()
         if self.connection:
             self.connection.close()
+            self.connection = None
 
     def create_table(self):
         """
         Function that creates the appropriate table inside the
         database. Table is called 'metadata' and only contains
-        text. 
+        text. ISBNs and OCNs are indexed, and ISBNs are unique when
+        not empty.
+        Databases made by older versions of the LMH are migrated to
+        the current schema, merging rows that share an ISBN or OCN.
+        The 'source_stats' table keeps what the adaptive source order
+        has learned about each source, see save_source_stats.
         """
         try:
             self.open_connection()
             cursor = self.connection.cursor()
 
-            # Create the 'metadata' table if it doesn't exist
-            cursor.execute('''CREATE TABLE IF NOT EXISTS metadata (
-                            isbn TEXT,
-                            ocn TEXT,
-                            lccn TEXT,
-                            lccn_source TEXT)''')
+            version = cursor.execute("PRAGMA user_version").fetchone()[0]
+            if version >= SCHEMA_VERSION:
+                return
+
+            cursor.execute("BEGIN")
+            if version < 1:
+                self.create_metadata_table(cursor)
+            elif version < 3:
+                # OCNs used to be unique, which lost the ISBNs of books sharing an OCN with one already stored
+                cursor.execute("DROP INDEX IF EXISTS metadata_ocn")
+                cursor.execute("CREATE INDEX metadata_ocn ON metadata (ocn) WHERE ocn != ''")
+
+            cursor.execute('''CREATE TABLE IF NOT EXISTS source_stats (
+                            source TEXT,
+                            id_type TEXT,
+                            searches INTEGER,
+                            isbn_tries INTEGER,
+                            isbn_hits INTEGER,
+                            oclc_tries INTEGER,
+                            oclc_hits INTEGER,
+                            lccn_tries INTEGER,
+                            lccn_hits INTEGER,
+                            latencies TEXT,
+                            PRIMARY KEY (source, id_type))''')
+
+            cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
             self.connection.commit()
 
         except sqlite3.Error as e:
             logs.log_error(f"{e}")
+            self.connection.rollback()
 
         finally:
             self.close_connection()
 
-
-    
+    def create_metadata_table(self, cursor):
+        # Creates the metadata table, moving the rows of a table made by an older version of the LMH into it
+        legacy_table = cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'metadata'").fetchone()
+        if legacy_table:
+            cursor.execute("ALTER TABLE metadata RENAME TO metadata_legacy")
+
+        cursor.execute('''CREATE TABLE metadata (
+                        isbn TEXT,
+                        ocn TEXT,
+                        lccn TEXT,
+                        lccn_source TEXT,
+                        id INTEGER PRIMARY KEY)''')
+        cursor.execute("CREATE UNIQUE INDEX metadata_isbn ON metadata (isbn) WHERE isbn != ''")
+        cursor.execute("CREATE INDEX metadata_ocn ON metadata (ocn) WHERE ocn != ''")
+
+        if legacy_table:
+            rows = cursor.execute(
+                "SELECT isbn, ocn, lccn, lccn_source FROM metadata_legacy ORDER BY rowid").fetchall()
+            for isbn, ocn, lccn, lccn_source in rows:
+                self.write_row(cursor, isbn or '', ocn or '', lccn or '', lccn_source or '', bool(isbn))
+            cursor.execute("DROP TABLE metadata_legacy")
+            logs.log_info(f"Migrated {len(rows)} rows in {self.database_name} to schema version {SCHEMA_VERSION}")
 
     def insert(self, isbn, ocn, lccn, lccn_source, is_isbn):
         """
         Function that inserts an ISBN OCN and LCCN into the database.
+        If a row for the ISBN (or OCN) already exists only its empty
+        fields are filled in. When batch_size is above 1 the insert is
+        buffered and committed with the rest of its batch.
 
         Parameters:
         - isbn: String that represents the ISBN that will be inserted.
@@ -73,58 +182,107 @@ class Database:
         -is_isbn: True or False
 
         """
+        if self.batch_size > 1:
+            self.pending_inserts.append((isbn, ocn, lccn, lccn_source, is_isbn))
+            self.pending_numbers.update((isbn, ocn))
+            if self.pending_since is None:
+                self.pending_since = time.monotonic()
+            if len(self.pending_inserts) >= self.batch_size:
+                self.flush()
+            else:
+                self.flush_if_due()
+            return
+
         try:
             self.open_connection()
             cursor = self.connection.cursor()
-            
-             
-            if (is_isbn):
-                x = cursor.execute("SELECT * FROM metadata WHERE isbn = ?", (isbn,)).fetchall()
+            self.write_row(cursor, isbn, ocn, lccn, lccn_source, is_isbn)
+            self.connection.commit()
 
-                
-                if (len(x)==0):
-                    cursor.execute("INSERT INTO metadata (isbn, ocn, lccn, lccn_source) VALUES (?, ?, ?, ?)", (isbn, ocn, lccn, lccn_source))
-                    
+        except sqlite3.Error as e:
+            logs.log_error(f"{e}")
+            self.connection.rollback()
 
-                else:
-                    cursor.execute("SELECT ocn, lccn FROM metadata WHERE isbn=?", (isbn,))
-                    result = cursor.fetchone()
-                    if (result[0]==""):
-                        cursor.execute("UPDATE metadata SET ocn = ? WHERE isbn = ?", (ocn, isbn))
-                        
-                    if (result[1]==""):
-                        cursor.execute("UPDATE metadata SET lccn = ?, lccn_source = ? WHERE isbn = ?", (lccn, lccn_source, isbn))
-                        
+        finally:
+            self.close_connection()
 
-            else:
-                x = cursor.execute("SELECT * FROM metadata WHERE ocn = ?", (ocn,)).fetchall()
+    def write_row(self, cursor, isbn, ocn, lccn, lccn_source, is_isbn):
+        """
+        Function that writes a single insert using the given cursor
+        without committing it. The row is matched on its ISBN when
+        is_isbn is True. Otherwise it is matched on its OCN first, and
+        on its ISBN if no row has the OCN. An empty ISBN is only filled
+        in if no other row already uses it.
 
-                if (len(x)==0):
-                    cursor.execute(
-                    "INSERT INTO metadata (isbn, ocn, lccn, lccn_source) VALUES (?, ?, ?, ?)",
-                    (isbn, ocn, lccn, lccn_source))
-                    
+        Parameters:
+        - cursor: Cursor of the open connection.
 
-                else:
-                    cursor.execute("SELECT isbn, lccn FROM metadata WHERE ocn=?", (ocn,))
-                    result = cursor.fetchone()
-                    if (result[0]==""):
-                        cursor.execute("UPDATE metadata SET isbn = ? WHERE ocn = ?", (isbn, ocn))
-                        
-                    if (result[1]==""):
-                        cursor.execute("UPDATE metadata SET lccn = ?, lccn_source = ? WHERE ocn = ?", (lccn, lccn_source, ocn))
-                        
+        The other parameters are the same as for insert().
+        """
+        if not is_isbn and ocn:
+            cursor.execute(UPDATE_BY_OCN, {'isbn': isbn, 'ocn': ocn, 'lccn': lccn, 'lccn_source': lccn_source})
+            if cursor.rowcount:
+                return
+        cursor.execute(INSERT_BY_ISBN, (isbn, ocn, lccn, lccn_source))
 
+    def flush(self):
+        """
+        Function that commits all buffered inserts in a single
+        transaction, in the order they were made. If the transaction
+        fails each insert is committed on its own instead, so only the
+        ones that fail again are lost.
+        """
+        if not self.pending_inserts:
+            return
+
+        try:
+            self.open_connection()
+            cursor = self.connection.cursor()
+            for row in self.pending_inserts:
+                self.write_row(cursor, *row)
             self.connection.commit()
 
         except sqlite3.Error as e:
             logs.log_error(f"{e}")
             self.connection.rollback()
+            self.write_one_by_one()
 
         finally:
-           
+            self.pending_inserts = []
+            self.pending_numbers = set()
+            self.pending_since = None
             self.close_connection()
 
+    def write_one_by_one(self):
+        """
+        Function that commits each buffered insert in its own
+        transaction, logging and dropping the ones that fail. Called
+        with the connection open.
+        """
+        for row in self.pending_inserts:
+            try:
+                self.write_row(self.connection.cursor(), *row)
+                self.connection.commit()
+            except sqlite3.Error as e:
+                logs.log_error(f"Insert of {row[0] or row[1]} was dropped: {e}")
+                self.connection.rollback()
+
+    def flush_if_due(self, number=None):
+        """
+        Function that commits the buffered inserts if batch_interval
+        has passed since the oldest one, or if number is waiting in
+        the buffer so that reads always see earlier inserts.
+
+        Parameters:
+        - number: String of an ISBN or OCN about to be looked up.
+        """
+        if not self.pending_inserts:
+            return
+        if number is not None and number in self.pending_numbers:
+            self.flush()
+        elif self.batch_interval and time.monotonic() - self.pending_since >= self.batch_interval:
+            self.flush()
+
     def is_in_database(self, number, isbn_or_ocn):
         """
         Function that determines if an ISBN or OCN number is
@@ -141,13 +299,14 @@ class Database:
         -True if the number is in the database.
         -False if the number is not in the database.
         """
+        self.flush_if_due(number)
         try:
             self.open_connection()
             cursor = self.connection.cursor()
 
             # If number is an ISBN, look for that ISBN in the database
             if isbn_or_ocn == 'ISBN':
-                cursor.execute("SELECT isbn FROM metadata WHERE isbn=?", (number,))
+                cursor.execute("SELECT isbn FROM metadata WHERE isbn=? AND isbn != ''", (number,))
 
                 # If ISBN is in the database return True, else return False
                 if len(cursor.fetchall()) > 0:
@@ -157,7 +316,7 @@ class Database:
 
             # If number is an OCN, look for it in the database
             if isbn_or_ocn == 'OCN':
-                cursor.execute("SELECT ocn FROM metadata WHERE ocn=?", (number,))
+                cursor.execute("SELECT ocn FROM metadata WHERE ocn=? AND ocn != ''", (number,))
 
                 # If OCN is in the database return True, else return False
                 if len(cursor.fetchall()) > 0:
@@ -194,20 +353,22 @@ class Database:
         Note: If no values are found for ISBN or OCN, "null" will be used.
 
         """
+        self.flush_if_due(number)
         try:
             self.open_connection()
             cursor = self.connection.cursor()
 
             # if number is an ISBN
             if type == 0:
-                ocn = cursor.execute("SELECT ocn FROM metadata WHERE isbn=?", (number,)).fetchone()
+                ocn = cursor.execute("SELECT ocn FROM metadata WHERE isbn=? AND isbn != ''", (number,)).fetchone()
                 
                 if ocn is None:
                     ocn = ""
                 else:
                     ocn = ocn[0]
 
-                llist = cursor.execute("SELECT lccn, lccn_source FROM metadata WHERE isbn=?", (number,)).fetchall()
+                llist = cursor.execute("SELECT lccn, lccn_source FROM metadata WHERE isbn=? AND isbn != ''",
+                                       (number,)).fetchall()
                 if llist == []:
                     lccn_list = ["", ""]
                 else:
@@ -216,13 +377,15 @@ class Database:
                 return [number, ocn, lccn_list]
 
             if type == 1:
-                isbn = cursor.execute("SELECT isbn FROM metadata WHERE ocn=?", (number,)).fetchone()
+                isbn = cursor.execute("SELECT isbn FROM metadata WHERE ocn=? AND ocn != '' ORDER BY id",
+                                      (number,)).fetchone()
                 if isbn is None:
                     isbn = ""
                 else:
                     isbn = isbn[0]
 
-                llist = cursor.execute("SELECT lccn, lccn_source FROM metadata WHERE ocn=?", (number,)).fetchall()
+                llist = cursor.execute("SELECT lccn, lccn_source FROM metadata WHERE ocn=? AND ocn != ''",
+                                       (number,)).fetchall()
                 if llist ==[]:
                     lccn_list = ["", ""]
                 else:
@@ -239,12 +402,120 @@ class Database:
         finally:
             self.close_connection()
 
+    def get_many(self, numbers, type):
+        """
+        Function that returns the metadata for many ISBNs or OCNs at
+        once, using a few chunked queries instead of one per number.
+
+        Parameters:
+        -numbers: Iterable of number strings (ISBN or OCN).
+
+        -type: Indicates what type the numbers are. 0:ISBN, 1:OCN
+
+
+        Returns:
+        A dictionary mapping every number found in the database to
+        its metadata, in the same [isbn, ocn, [lccns]] format as
+        get_metadata. Numbers not in the database are left out.
+        """
+        if type == 0:
+            column = "isbn"
+        elif type == 1:
+            column = "ocn"
+        else:
+            return {}
+
+        self.flush()
+        results = {}
+        numbers = list(dict.fromkeys(number for number in numbers if number))
+        try:
+            self.open_connection()
+            cursor = self.connection.cursor()
+
+            for start in range(0, len(numbers), LOOKUP_CHUNK_SIZE):
+                chunk = numbers[start:start + LOOKUP_CHUNK_SIZE]
+                placeholders = ", ".join("?" * len(chunk))
+                rows = cursor.execute(f"SELECT isbn, ocn, lccn, lccn_source FROM metadata "
+                                      f"WHERE {column} IN ({placeholders}) AND {column} != '' ORDER BY id",
+                                      chunk).fetchall()
+                # Several ISBNs can share an OCN, the oldest row is the one get_metadata and OCN updates use
+                for isbn, ocn, lccn, lccn_source in rows:
+                    results.setdefault(isbn if type == 0 else ocn, [isbn, ocn, [(lccn, lccn_source)]])
+
+            return results
+
+        except sqlite3.Error as e:
+            logs.log_error(f"{e}")
+            return results
+
+        finally:
+            self.close_connection()
+
+    def get_source_stats(self):
+        """
+        Function that returns the source statistics saved by
+        save_source_stats, as a list of (source, id_type, searches,
+        tries, hits, latencies) tuples.
+        """
+        try:
+            self.open_connection()
+            cursor = self.connection.cursor()
+            rows = cursor.execute("""SELECT source, id_type, searches, isbn_tries, isbn_hits, oclc_tries, oclc_hits,
+                                     lccn_tries, lccn_hits, latencies FROM source_stats""").fetchall()
+            return [(source, id_type, searches,
+                     {'isbn': isbn_tries, 'oclc': oclc_tries, 'lccn': lccn_tries},
+                     {'isbn': isbn_hits, 'oclc': oclc_hits, 'lccn': lccn_hits},
+                     json.loads(latencies or '[]'))
+                    for source, id_type, searches, isbn_tries, isbn_hits, oclc_tries, oclc_hits, lccn_tries,
+                    lccn_hits, latencies in rows]
+
+        except (sqlite3.Error, ValueError) as e:
+            logs.log_error(f"{e}")
+            return []
+
+        finally:
+            self.close_connection()
+
+    def save_source_stats(self, rows):
+        """
+        Function that saves what has been learned about each source
+        so the next search can order the sources by it.
+
+        Parameters:
+        - rows: List of (source, id_type, searches, tries, hits,
+                latencies) tuples. id_type is 'isbn' or 'ocn', tries
+                and hits are dictionaries of the number of times each
+                of 'isbn', 'oclc' and 'lccn' was asked for and filled
+                in, latencies a list of seconds.
+        """
+        try:
+            self.open_connection()
+            cursor = self.connection.cursor()
+            cursor.executemany("""INSERT OR REPLACE INTO source_stats (source, id_type, searches, isbn_tries,
+                                  isbn_hits, oclc_tries, oclc_hits, lccn_tries, lccn_hits, latencies)
+                                  VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                               [(source, id_type, searches, tries['isbn'], hits['isbn'], tries['oclc'], hits['oclc'],
+                                 tries['lccn'], hits['lccn'], json.dumps(latencies))
+                                for source, id_type, searches, tries, hits, latencies in rows])
+            self.connection.commit()
+
+        except sqlite3.Error as e:
+            logs.log_error(f"{e}")
+            self.connection.rollback()
+
+        finally:
+            self.close_connection()
+
     def clear_db(self):
         """
         Function that deletes all of the data inside the database.
-        The table in the database will be left.
+        The table in the database will be left. Buffered inserts
+        are discarded.
 
         """
+        self.pending_inserts = []
+        self.pending_numbers = set()
+        self.pending_since = None
         try:
             self.open_connection()
             cursor = self.connection.cursor()
@@ -262,6 +533,7 @@ class Database:
         Function for viewing the contents of the database.
         Will print all of the data to the console.
         """
+        self.flush()
         try:
             self.open_connection()
             cursor = self.connection.cursor()
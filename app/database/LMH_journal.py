@@ -0,0 +1,192 @@
+import json
+import sqlite3
+import threading
+import time
+from app import logs
+
+PENDING = "pending"
+IN_FLIGHT = "in-flight"
+DONE = "done"
+FAILED = "failed"
+
+# Number of journal rows read ahead of the value being resumed
+READ_AHEAD = 5000
+
+
+class HarvestJournal:
+    def __init__(self, database_name='LMH_journal.db', batch_size=100, batch_interval=2):
+        """
+        The initialization of a HarvestJournal object. The journal
+        records how far a harvest got with every value so that an
+        interrupted harvest can carry on where it stopped. Values the
+        journal has no row for are pending. Updates are buffered and
+        committed together, so a crash loses at most the last
+        batch_interval seconds of progress, which is simply redone.
+
+        Parameters:
+        - database_name: Name of the database file to be used. String
+
+        - batch_size: Number of updates committed together. Integer
+
+        - batch_interval: Seconds after which buffered updates are
+                          committed anyway. Number
+
+        """
+        self.database_name = database_name
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.job = None
+        self.pending = {}
+        self.last_flush = time.monotonic()
+        self.read_ahead = {}
+        self.read_ahead_range = (0, 0)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(database_name, timeout=30, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.create_tables()
+
+    def create_tables(self):
+        """
+        Function that creates the 'jobs' table, one row per unfinished
+        harvest, and the 'items' table holding the state of each value
+        of a harvest by its position in the input.
+        """
+        try:
+            with self.lock:
+                self.connection.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                                        id INTEGER PRIMARY KEY,
+                                        key TEXT UNIQUE,
+                                        started REAL)''')
+                self.connection.execute('''CREATE TABLE IF NOT EXISTS items (
+                                        job INTEGER,
+                                        idx INTEGER,
+                                        number TEXT,
+                                        state TEXT,
+                                        tried TEXT,
+                                        entry TEXT,
+                                        PRIMARY KEY (job, idx)) WITHOUT ROWID''')
+                self.connection.commit()
+
+        except sqlite3.Error as e:
+            logs.log_error(f"{e}")
+
+    def start(self, key):
+        """
+        Function that starts journaling a harvest, resuming the
+        unfinished harvest with the same key if there is one.
+
+        Parameters:
+        - key: String identifying the harvest, see harvester.journal_key
+
+        Returns:
+        The number of values the resumed harvest had already finished,
+        0 for a new harvest.
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT id FROM jobs WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                cursor = self.connection.execute("INSERT INTO jobs (key, started) VALUES (?, ?)", (key, time.time()))
+                self.connection.commit()
+                self.job = cursor.lastrowid
+                return 0
+            self.job = row[0]
+            return self.connection.execute("SELECT COUNT(*) FROM items WHERE job = ? AND state = ?",
+                                           (self.job, DONE)).fetchone()[0]
+
+    def get(self, index, number):
+        """
+        Function that returns what the journal holds for a value.
+
+        Parameters:
+        - index: Position of the value in the input. Integer
+
+        - number: The value itself, a row for a different value at the
+                  same position (the input file changed) is ignored.
+
+        Returns:
+        A tuple (state, entry, tried) where tried is the list of
+        sources already searched, or (PENDING, None, []) if the value
+        was never started.
+        """
+        low, high = self.read_ahead_range
+        if not low <= index < high:
+            # Values are resumed in input order, so one range query serves the next READ_AHEAD of them
+            with self.lock:
+                rows = self.connection.execute("SELECT idx, number, state, tried, entry FROM items WHERE job = ? AND "
+                                               "idx >= ? AND idx < ?",
+                                               (self.job, index, index + READ_AHEAD)).fetchall()
+            self.read_ahead = {row[0]: row[1:] for row in rows}
+            self.read_ahead_range = (index, index + READ_AHEAD)
+
+        row = self.read_ahead.get(index)
+        if row is None or row[0] != number:
+            return PENDING, None, []
+        return row[1], json.loads(row[3]), json.loads(row[2])
+
+    def update(self, index, number, state, entry, tried):
+        """
+        Function that records the state of a value. Safe to call from
+        the threads searching the sources.
+
+        Parameters:
+        - index: Position of the value in the input. Integer
+
+        - number: The value itself. String
+
+        - state: One of IN_FLIGHT, DONE or FAILED
+
+        - entry: The metadata found for the value so far. Dictionary
+
+        - tried: Sources that have already been searched. List
+        """
+        row = (self.job, index, number, state, json.dumps(list(tried)), json.dumps(entry))
+        with self.lock:
+            # Only the latest state of a value has to be written
+            self.pending[index] = row
+            if (len(self.pending) >= self.batch_size or
+                    time.monotonic() - self.last_flush >= self.batch_interval):
+                self._write_pending()
+
+    def flush(self):
+        """
+        Function that commits every buffered update.
+        """
+        with self.lock:
+            self._write_pending()
+
+    def _write_pending(self):
+        # Called with the lock held
+        if self.pending:
+            try:
+                self.connection.executemany("INSERT OR REPLACE INTO items (job, idx, number, state, tried, entry) "
+                                            "VALUES (?, ?, ?, ?, ?, ?)", list(self.pending.values()))
+                self.connection.commit()
+            except sqlite3.Error as e:
+                logs.log_error(f"{e}")
+        self.pending = {}
+        self.last_flush = time.monotonic()
+
+    def finish(self):
+        """
+        Function that forgets the current harvest once every value has
+        been harvested, so the next harvest with the same key starts
+        over.
+        """
+        with self.lock:
+            self.pending = {}
+            try:
+                self.connection.execute("DELETE FROM items WHERE job = ?", (self.job,))
+                self.connection.execute("DELETE FROM jobs WHERE id = ?", (self.job,))
+                self.connection.commit()
+            except sqlite3.Error as e:
+                logs.log_error(f"{e}")
+
+    def close(self):
+        """
+        Function that commits every buffered update and closes the
+        journal.
+        """
+        self.flush()
+        with self.lock:
+            self.connection.close()
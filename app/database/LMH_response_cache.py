@@ -0,0 +1,362 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from app import config, logs
+
+# Stores made between checks of the cache's total size
+SIZE_CHECK_INTERVAL = 100
+# Answers held in memory for values about to be searched, the oldest are dropped past this
+PREFETCH_LIMIT = 20000
+
+_caches = {}
+_caches_lock = threading.Lock()
+_prefetched = OrderedDict()
+_prefetched_lock = threading.Lock()
+
+
+class ResponseCache:
+    def __init__(self, database_name='LMH_response_cache.db', ttl=2592000, negative_ttl=604800, max_size=200):
+        """
+        The initialization of a ResponseCache object. The cache keeps
+        the raw response each source gave for an identifier, including
+        "nothing found" answers, so repeated searches do not have to go
+        back to the network. Responses that came with an ETag or
+        Last-Modified header are kept past their ttl so they can be
+        revalidated with a conditional request instead of downloaded
+        again. It is safe to use from several threads.
+
+        Parameters:
+        - database_name: Name of the database file to be used. String
+
+        - ttl: Seconds a response is kept for. Number
+
+        - negative_ttl: Seconds a "nothing found" answer is kept for.
+                        Number
+
+        - max_size: Size in megabytes the cache is kept under, the
+                    oldest responses are evicted first. Number
+
+        """
+        self.database_name = database_name
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size * 1024 * 1024
+        self.stores_since_check = 0
+        self.lock = threading.Lock()
+        self.connection = None
+        self.create_table()
+
+    def open_connection(self):
+        """
+        Function that opens the connection to the cache if it is not
+        open already. The connection is shared by every thread.
+        """
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.database_name, timeout=30, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+
+    def close_connection(self):
+        """
+        Function that closes the connection to the cache
+        """
+        with self.lock:
+            if self.connection:
+                self.connection.close()
+                self.connection = None
+
+    def create_table(self):
+        """
+        Function that creates the 'responses' table. A row with a
+        NULL body is a "nothing found" answer.
+        """
+        try:
+            with self.lock:
+                self.open_connection()
+                self.connection.execute('''CREATE TABLE IF NOT EXISTS responses (
+                                        source TEXT,
+                                        identifier TEXT,
+                                        body TEXT,
+                                        stored REAL,
+                                        expires REAL,
+                                        size INTEGER,
+                                        etag TEXT,
+                                        last_modified TEXT,
+                                        PRIMARY KEY (source, identifier))''')
+                # Caches made before responses were revalidated lack the validator columns
+                columns = [row[1] for row in self.connection.execute("PRAGMA table_info(responses)")]
+                for column in ("etag", "last_modified"):
+                    if column not in columns:
+                        self.connection.execute(f"ALTER TABLE responses ADD COLUMN {column} TEXT")
+                self.connection.execute("CREATE INDEX IF NOT EXISTS responses_stored ON responses (stored)")
+                self.connection.commit()
+
+        except sqlite3.Error as e:
+            logs.log_error(f"{e}")
+
+    def get(self, source, identifier):
+        """
+        Function that looks up a cached response.
+
+        Parameters:
+        - source: String naming the source the response came from.
+
+        - identifier: String the source was asked about.
+
+        Returns:
+        A tuple (found, body). found is False if nothing usable is
+        cached. body is the raw response, or None for a cached
+        "nothing found" answer.
+        """
+        try:
+            with self.lock:
+                self.open_connection()
+                row = self.connection.execute("SELECT body, expires FROM responses WHERE source = ? AND identifier = ?",
+                                              (source, identifier)).fetchone()
+            if row is None or row[1] < time.time():
+                return False, None
+            return True, row[0]
+
+        except sqlite3.Error as e:
+            logs.log_error(f"{e}")
+            return False, None
+
+    def get_stale(self, source, identifier):
+        """
+        Function that looks up a response that can be revalidated,
+        whether or not it has expired.
+
+        Parameters:
+        - source: String naming the source the response came from.
+
+        - identifier: String the source was asked about.
+
+        Returns:
+        A tuple (body, etag, last_modified), or None if no response
+        with an ETag or Last-Modified header is cached.
+        """
+        try:
+            with self.lock:
+                self.open_connection()
+                row = self.connection.execute("SELECT body, etag, last_modified FROM responses WHERE source = ? AND "
+                                              "identifier = ? AND body IS NOT NULL AND (etag IS NOT NULL OR "
+                                              "last_modified IS NOT NULL)", (source, identifier)).fetchone()
+            return row
+
+        except sqlite3.Error as e:
+            logs.log_error(f"{e}")
+            return None
+
+    def refresh(self, source, identifier):
+        """
+        Function that makes a response fresh again for another ttl,
+        after the source answered 304 Not Modified for it.
+        """
+        now = time.time()
+        try:
+            with self.lock:
+                self.open_connection()
+                self.connection.execute("UPDATE responses SET stored = ?, expires = ? WHERE source = ? AND "
+                                        "identifier = ?", (now, now + self.ttl, source, identifier))
+                self.connection.commit()
+
+        except sqlite3.Error as e:
+            logs.log_error(f"{e}")
+
+    def put(self, source, identifier, body, etag=None, last_modified=None, negative=False):
+        """
+        Function that stores a response, replacing any older one.
+
+        Parameters:
+        - source: String naming the source the response came from.
+
+        - identifier: String the source was asked about.
+
+        - body: String of the raw response, or None to store a
+                "nothing found" answer.
+
+        - etag, last_modified: The response's ETag and Last-Modified
+                               headers, None if it had none.
+
+        - negative: True if body is an answer saying nothing was found,
+                    like an empty result list. It is kept for
+                    negative_ttl like a None body.
+        """
+        now = time.time()
+        expires = now + (self.ttl if body is not None and not negative else self.negative_ttl)
+        size = len(body.encode('utf-8')) if body is not None else 0
+        try:
+            with self.lock:
+                self.open_connection()
+                self.connection.execute("INSERT OR REPLACE INTO responses (source, identifier, body, stored, expires, "
+                                        "size, etag, last_modified) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                        (source, identifier, body, now, expires, size, etag, last_modified))
+                self.connection.commit()
+                self.stores_since_check += 1
+                if self.stores_since_check >= SIZE_CHECK_INTERVAL:
+                    self.stores_since_check = 0
+                    self.evict()
+
+        except sqlite3.Error as e:
+            logs.log_error(f"{e}")
+
+    def evict(self):
+        """
+        Function that deletes expired responses and, if the cache is
+        still larger than max_size, the oldest responses until it is
+        back under 90% of it. Expired responses that can be revalidated
+        are only deleted to make room. Called with the lock held.
+        """
+        cursor = self.connection.cursor()
+        cursor.execute("DELETE FROM responses WHERE expires < ? AND etag IS NULL AND last_modified IS NULL",
+                       (time.time(),))
+        # Count a little for every row so "nothing found" answers take up room too
+        total = cursor.execute("SELECT IFNULL(SUM(size + 64), 0) FROM responses").fetchone()[0]
+        if total > self.max_size:
+            excess = total - self.max_size * 0.9
+            freed = 0
+            oldest = []
+            for source, identifier, size in cursor.execute(
+                    "SELECT source, identifier, size + 64 FROM responses ORDER BY stored"):
+                oldest.append((source, identifier))
+                freed += size
+                if freed >= excess:
+                    break
+            cursor.executemany("DELETE FROM responses WHERE source = ? AND identifier = ?", oldest)
+        self.connection.commit()
+
+    def clear(self):
+        """
+        Function that deletes every cached response.
+        """
+        try:
+            with self.lock:
+                self.open_connection()
+                self.connection.execute("DELETE FROM responses")
+                self.connection.commit()
+
+        except sqlite3.Error as e:
+            logs.log_error(f"{e}")
+
+
+def get_cache():
+    """
+    Returns the ResponseCache shared by every source, or None if the
+    response_cache_ttl setting turns the cache off.
+    """
+    settings = config.get_settings()
+    if not settings.response_cache_ttl or not settings.response_cache_file:
+        return None
+
+    key = (settings.response_cache_file, settings.response_cache_ttl, settings.response_cache_negative_ttl,
+           settings.response_cache_max_size)
+    cache = _caches.get(key)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(key)
+            if cache is None:
+                cache = ResponseCache(settings.response_cache_file, settings.response_cache_ttl,
+                                      settings.response_cache_negative_ttl, settings.response_cache_max_size)
+                _caches[key] = cache
+    return cache
+
+
+def lookup(source, identifier):
+    """
+    Looks up what source answered for identifier, first among the
+    answers prefetched by a batched request and then in the cache.
+    Returns (found, body) like ResponseCache.get, and (False, None) if
+    nothing is known.
+    """
+    with _prefetched_lock:
+        body = _prefetched.pop((source, str(identifier)), _prefetched)
+    if body is not _prefetched:
+        return True, body
+
+    cache = get_cache()
+    if cache is None:
+        return False, None
+    return cache.get(source, str(identifier))
+
+
+def is_known(source, identifier):
+    """
+    Returns True if lookup would find an answer, without using up a
+    prefetched one. Batched requests use this to leave out values that
+    are already answered, calling it before they go onto the shared
+    HTTP loop since it blocks on SQLite.
+    """
+    with _prefetched_lock:
+        if (source, str(identifier)) in _prefetched:
+            return True
+    cache = get_cache()
+    return cache is not None and cache.get(source, str(identifier))[0]
+
+
+def store(source, identifier, body, etag=None, last_modified=None, negative=False):
+    """
+    Stores what source answered for identifier, None meaning nothing
+    was found, with the response's validators if it had any. A body
+    saying nothing was found is stored with negative=True, so it is
+    kept for the shorter negative ttl. Does nothing if the cache is
+    off.
+    """
+    cache = get_cache()
+    if cache is not None:
+        cache.put(source, str(identifier), body, etag, last_modified, negative)
+
+
+def conditional_headers(source, identifier):
+    """
+    Returns (body, headers) for a response to identifier that has
+    expired but can be revalidated: the body to use if the source
+    answers 304 Not Modified, and the If-None-Match and
+    If-Modified-Since headers to send. Returns (None, {}) otherwise.
+    """
+    cache = get_cache()
+    row = cache.get_stale(source, str(identifier)) if cache is not None else None
+    if row is None:
+        return None, {}
+    body, etag, last_modified = row
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    return body, headers
+
+
+def refresh(source, identifier):
+    """
+    Keeps a revalidated response for another ttl.
+    """
+    cache = get_cache()
+    if cache is not None:
+        cache.refresh(source, str(identifier))
+
+
+def clear_prefetched():
+    """
+    Forgets every prefetched answer. Called when a harvest starts and
+    ends, so answers are never used by a later harvest.
+    """
+    with _prefetched_lock:
+        _prefetched.clear()
+
+
+def prefetch(source, identifier, body, negative=False):
+    """
+    Stores an answer a batched request got for identifier ahead of its
+    search. It is kept in memory until the search looks it up, so
+    batching works with the cache turned off too, and is stored in the
+    cache as well, for the negative ttl with negative=True. A batch
+    that fails prefetches nothing, so each of its values is searched
+    for on its own instead.
+    """
+    with _prefetched_lock:
+        _prefetched[(source, str(identifier))] = body
+        # Values whose search never reaches this source would otherwise be held forever
+        while len(_prefetched) > PREFETCH_LIMIT:
+            _prefetched.popitem(last=False)
+    store(source, identifier, body, negative=negative)
@@ -0,0 +1,585 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from app.apis import harvardAPI, openLibraryAPI, locAPI, googleAPI, z3950, webScraper, httpClient, sourceHealth
+from app.database.LMH_database import Database
+from app.database import LMH_journal, LMH_response_cache
+from app.database.LMH_journal import HarvestJournal
+from app import logs, metrics, sourceScheduler
+import contextvars
+import json
+import threading
+import time
+
+DATABASE_NAME = 'LMH_database.db'
+JOURNAL_NAME = 'LMH_journal.db'
+# Numbers looked up in the database together before their searches start
+CACHE_LOOKUP_SIZE = 5000
+# Numbers handed to a source's batched search together, and how many batches it runs ahead of the searches
+PREFETCH_BATCH_SIZE = 50
+PREFETCH_AHEAD = 2
+_race_executor = None
+_race_threads = 0
+_race_executor_lock = threading.Lock()
+
+
+def open_database(settings):
+    # Keep one connection open for the whole search and commit the results in batches, call close() when done
+    return Database(DATABASE_NAME, persistent=True, batch_size=settings.db_batch_size,
+                    batch_interval=settings.db_batch_interval)
+
+
+def open_journal():
+    # Journal of how far each harvest got, call close() when done
+    return HarvestJournal(JOURNAL_NAME)
+
+
+def journal_key(input_name, ordered_sources, retrieval_settings, is_isbn):
+    # A harvest is only resumed if it reads the same input for the same metadata from the same sources
+    return json.dumps([input_name, list(ordered_sources), retrieval_settings, is_isbn], sort_keys=True)
+
+
+def new_dont_use_api():
+    return {"dont_continue_search": False, "dont_use_harvard": False, "dont_use_openlibrary": False,
+            "dont_use_loc": False, "dont_use_google": False, "dont_use_z3950": False}
+
+
+def is_complete(entry, retrieval_settings):
+    # An entry is complete once it holds every type of metadata we said we wanted
+    return (((entry.get('isbn') and entry.get('isbn') != '') or not retrieval_settings['retrieve_isbn']) and
+            ((entry.get('oclc') and entry.get('oclc') != '') or not retrieval_settings['retrieve_oclc']) and
+            ((entry.get('lccn') and entry.get('lccn') != '') or not retrieval_settings['retrieve_lccn']))
+
+
+def entry_from_database(number, database_entry, retrieval_settings, is_isbn, is_oclc):
+    # database_entry is what get_metadata or get_many returned for the number, None if it is not in the database
+    if is_isbn:
+        entry = {'isbn': number}
+        if database_entry:
+            if retrieval_settings['retrieve_oclc']:
+                entry.update({
+                    'oclc': database_entry[1]
+                })
+            if retrieval_settings['retrieve_lccn']:
+                entry.update({
+                    'lccn': database_entry[2][0][0],
+                    'source': database_entry[2][0][1]
+                })
+
+    if is_oclc:
+        entry = {'oclc': number}
+        if database_entry:
+            if retrieval_settings['retrieve_isbn']:
+                entry.update({
+                    'isbn': database_entry[0]
+                })
+            if retrieval_settings['retrieve_lccn']:
+                entry.update({
+                    'lccn': database_entry[2][0][0],
+                    'source': database_entry[2][0][1]
+                })
+
+    return entry
+
+
+def entries_from_database(input_data, db_manager, retrieval_settings, is_isbn, is_oclc):
+    """
+    Generator yielding (index, number, entry) for every number in
+    input_data with whatever the database already holds for it. The
+    numbers are looked up CACHE_LOOKUP_SIZE at a time with get_many,
+    so the database is never queried once per number.
+    """
+    block = []
+    for index, number in enumerate(input_data):
+        block.append((index, number))
+        if len(block) >= CACHE_LOOKUP_SIZE:
+            yield from _entries_for_block(block, db_manager, retrieval_settings, is_isbn, is_oclc)
+            block = []
+    yield from _entries_for_block(block, db_manager, retrieval_settings, is_isbn, is_oclc)
+
+
+def _entries_for_block(block, db_manager, retrieval_settings, is_isbn, is_oclc):
+    if not block:
+        return
+    with metrics.timed("db_lookup", "database"):
+        database_entries = db_manager.get_many([number for _, number in block], 0 if is_isbn else 1)
+    for index, number in block:
+        yield index, number, entry_from_database(number, database_entries.get(number), retrieval_settings, is_isbn,
+                                                 is_oclc)
+
+
+def source_search(source, dont_use_api, settings):
+    """
+    Returns the function searching source, called as
+    search(entry, number, retrieval_settings, is_isbn, is_oclc), or
+    None if the source is switched off or unknown.
+    """
+    name = source.split("(")[0].strip()
+
+    # Check if Harvard is the source
+    if source == 'Harvard (API)' and not dont_use_api["dont_use_harvard"]:
+        return lambda entry, number, retrieval_settings, is_isbn, is_oclc: harvardAPI.parse_harvard_data(
+            entry, number, retrieval_settings)
+
+    # Check if OpenLibrary is the source
+    elif source == 'Open Library (API)' and not dont_use_api["dont_use_openlibrary"]:
+        return lambda entry, number, retrieval_settings, is_isbn, is_oclc: openLibraryAPI.parse_open_library_data(
+            entry, number, retrieval_settings, is_oclc, is_isbn)
+
+    # Check if LOC is the source
+    elif source == 'LOC (API)' and not dont_use_api["dont_use_loc"]:
+        return lambda entry, number, retrieval_settings, is_isbn, is_oclc: locAPI.parse_loc_data(
+            entry, number, retrieval_settings, is_oclc)
+
+    # Check if Google Books is the source
+    elif source == 'Google Books (API)' and not dont_use_api["dont_use_google"]:
+        return lambda entry, number, retrieval_settings, is_isbn, is_oclc: googleAPI.parse_google_data(
+            entry, number, retrieval_settings, is_oclc, is_isbn)
+
+    # Check if a Z39.50 is the source
+    elif name in settings.z3950_sources and not dont_use_api["dont_use_z3950"]:
+        return lambda entry, number, retrieval_settings, is_isbn, is_oclc: z3950.parse_data(
+            entry, number, retrieval_settings, name)
+
+    # Check if a Web Scraping is the source
+    elif name in settings.web_scraping_sources:
+        return lambda entry, number, retrieval_settings, is_isbn, is_oclc: webScraper.parse_data(
+            entry, number, retrieval_settings, name)
+
+    return None
+
+
+def source_prefetch(source, dont_use_api, settings, is_isbn, is_oclc):
+    """
+    Returns the function searching source for many numbers at once,
+    called as prefetch(numbers), or None if the source has no batched
+    search for this input. What it finds is looked up by the source's
+    own search from the response cache instead of being searched again.
+    """
+    name = source.split("(")[0].strip()
+
+    # Open Library answers for a list of bibkeys in one request
+    if source == 'Open Library (API)' and not dont_use_api["dont_use_openlibrary"]:
+        return lambda numbers: openLibraryAPI.prefetch(numbers, is_oclc, is_isbn)
+
+    # LOC is searched with one OR query for a batch of numbers
+    if source == 'LOC (API)' and not dont_use_api["dont_use_loc"]:
+        return lambda numbers: locAPI.prefetch(numbers, is_oclc)
+
+    # Google Books is searched with one OR query for a batch of numbers
+    if source == 'Google Books (API)' and not dont_use_api["dont_use_google"]:
+        return lambda numbers: googleAPI.prefetch(numbers, is_oclc, is_isbn)
+
+    # Z39.50 targets are searched with one OR query for a batch of ISBNs
+    if is_isbn and name in settings.z3950_sources and not dont_use_api["dont_use_z3950"]:
+        return lambda numbers: z3950.prefetch(numbers, name)
+
+    return None
+
+
+def health_key(source, settings):
+    """
+    Returns the name a source's requests are tracked under by
+    sourceHealth: the API's SOURCE_NAME, or the Z39.50 library's or
+    web scraping catalogue's name. None for an unknown source.
+    """
+    name = source.split("(")[0].strip()
+    api_names = {'Harvard (API)': harvardAPI.SOURCE_NAME, 'Open Library (API)': openLibraryAPI.SOURCE_NAME,
+                 'LOC (API)': locAPI.SOURCE_NAME, 'Google Books (API)': googleAPI.SOURCE_NAME}
+    if source in api_names:
+        return api_names[source]
+    if name in settings.z3950_sources or name in settings.web_scraping_sources:
+        return name
+    return None
+
+
+def is_healthy(source, settings):
+    # Sources whose circuit breaker is open are skipped until it lets a trial request through
+    key = health_key(source, settings)
+    return key is None or sourceHealth.allow(key)
+
+
+def search_sources(entry, number, ordered_sources, retrieval_settings, dont_use_api, settings, is_isbn, is_oclc,
+                   tried_sources=(), source_done=None, prefetched=None):
+    # Sources switched off for this search, or already searched by an interrupted harvest, are skipped. prefetched is
+    # the PrefetchBatch of the number, whose batched search of a source is waited for right before that source
+    sources = []
+    for source in ordered_sources:
+        search = source_search(source, dont_use_api, settings)
+        if search is not None and source not in tried_sources:
+            sources.append((source, search))
+
+    if settings.adaptive_source_order:
+        sources = _adaptive_order(sources, entry, retrieval_settings, settings, is_isbn)
+
+    if settings.race_sources > 1:
+        return _race_sources(entry, number, sources, retrieval_settings, settings, is_isbn, is_oclc, source_done,
+                             prefetched)
+
+    # Check sources in the specified priority order
+    for source, search in sources:
+        # A source that keeps failing is skipped without being marked as tried, so a resumed harvest tries it again
+        if not is_healthy(source, settings):
+            continue
+        if prefetched is not None:
+            prefetched.wait(source)
+        with metrics.timed("search", source):
+            entry = search(entry, number, retrieval_settings, is_isbn, is_oclc)
+
+        if source_done is not None:
+            source_done(source, entry)
+
+        # Break out of the loop if data has been retrieved for the current source excluding stuff we said we
+        # didn't want
+        if is_complete(entry, retrieval_settings):
+            break
+
+    return entry
+
+
+def wanted_fields(entry, retrieval_settings):
+    # The metadata an entry still needs, named as in the entry
+    return [field for field in sourceScheduler.FIELDS if retrieval_settings[f'retrieve_{field}'] and
+            (entry.get(field) is None or entry.get(field) == '')]
+
+
+def _adaptive_order(sources, entry, retrieval_settings, settings, is_isbn):
+    # Sources that have filled in what this entry needs fastest go first, except pinned ones. Every search is timed
+    # so the order keeps following how the sources answer
+    scheduler = sourceScheduler.get_scheduler()
+    id_type = 'isbn' if is_isbn else 'ocn'
+    ordered = scheduler.order(sources, id_type, wanted_fields(entry, retrieval_settings), settings.pinned_sources)
+    return [(source, _timed_search(scheduler, source, search, id_type)) for source, search in ordered]
+
+
+def _timed_search(scheduler, source, search, id_type):
+    def timed_search(entry, number, retrieval_settings, is_isbn, is_oclc):
+        wanted = wanted_fields(entry, retrieval_settings)
+        start = time.monotonic()
+        result = search(entry, number, retrieval_settings, is_isbn, is_oclc)
+        scheduler.record(source, id_type, time.monotonic() - start, wanted,
+                         [field for field in wanted if result.get(field)])
+        return result
+    return timed_search
+
+
+def _race_sources(entry, number, sources, retrieval_settings, settings, is_isbn, is_oclc, source_done, prefetched):
+    # Searches race_size sources at once, each on its own copy of the entry, and merges their answers in priority
+    # order. A source's answer is used as soon as every source above it has answered or failed, and once the entry
+    # is complete the requests still running for the sources below it are cancelled
+    race_size = settings.race_sources
+    executor = _get_race_executor(settings.max_workers * race_size)
+    for start in range(0, len(sources), race_size):
+        window = [(source, search) for source, search in sources[start:start + race_size]
+                  if is_healthy(source, settings)]
+        base = dict(entry)
+        group = httpClient.RequestGroup()
+        # Every search runs in a copy of this thread's context, so its times are added to the number's
+        futures = [executor.submit(contextvars.copy_context().run, _search_in_group, group, prefetched, source, search,
+                                   dict(base), number, retrieval_settings, is_isbn, is_oclc)
+                   for source, search in window]
+        try:
+            for (source, _), future in zip(window, futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logs.log_error(f"Error while searching {source} for {number}: {e}")
+                    continue
+
+                _merge_answer(entry, base, result)
+                if source_done is not None:
+                    source_done(source, entry)
+                if is_complete(entry, retrieval_settings):
+                    return entry
+        finally:
+            group.cancel()
+            for future in futures:
+                future.cancel()
+    return entry
+
+
+def _search_in_group(group, prefetched, source, search, entry, number, retrieval_settings, is_isbn, is_oclc):
+    if prefetched is not None:
+        prefetched.wait(source)
+    with group, metrics.timed("search", source):
+        return search(entry, number, retrieval_settings, is_isbn, is_oclc)
+
+
+def _merge_answer(entry, base, result):
+    # A source only fills in what was empty when it started, so apply what it changed wherever a higher priority
+    # source has not already filled it in, the same as searching the sources one after another would
+    for key in ('isbn', 'oclc', 'lccn'):
+        if result.get(key) != base.get(key) and (entry.get(key) == '' or entry.get(key) is None):
+            entry[key] = result.get(key)
+            if key == 'lccn':
+                entry['source'] = result.get('source')
+
+
+def _get_race_executor(threads):
+    # Shared by every value being searched, and replaced by a bigger one if a harvest needs more threads. The old one
+    # is not shut down, since a search may still be submitting to it. Its threads exit once it is no longer referenced
+    global _race_executor, _race_threads
+    with _race_executor_lock:
+        if _race_executor is None or _race_threads < threads:
+            _race_executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="lmh-race")
+            _race_threads = threads
+        return _race_executor
+
+
+class PrefetchBatch:
+    """
+    Batched searches of up to PREFETCH_BATCH_SIZE numbers. A source is
+    only searched for the batch once the first of its numbers is about
+    to search that source, and then only for the numbers of the batch
+    whose search has not finished yet, so lower priority sources are
+    not asked about numbers a source above them already filled in. With
+    eager the first source is searched for the batch straight away.
+    """
+    def __init__(self, numbers, prefetchers, settings, executor, eager=False):
+        self.numbers = numbers
+        self.finished = set()
+        self.prefetchers = dict(prefetchers)
+        self.settings = settings
+        self.executor = executor
+        self.futures = {}
+        self.lock = threading.Lock()
+        if eager and prefetchers:
+            self.start(prefetchers[0][0])
+
+    def start(self, source):
+        """
+        Starts the batched search of source if it has one and it has not
+        been started yet. Returns its future, None if there is none.
+        """
+        with self.lock:
+            if source in self.futures or source not in self.prefetchers:
+                return self.futures.get(source)
+            numbers = [number for number in self.numbers if number not in self.finished]
+            future = None
+            if numbers:
+                try:
+                    future = self.executor.submit(_run_prefetch, source, self.prefetchers[source], numbers,
+                                                  self.settings)
+                except RuntimeError:
+                    # The harvest is stopping and no longer starts batches
+                    pass
+            self.futures[source] = future
+            return future
+
+    def wait(self, source):
+        # Called by a number's search before it searches source, the batch's answers are then in the response cache
+        future = self.start(source)
+        if future is not None:
+            # A batch cancelled by a stop is waited for like a failed one, the number is then searched on its own
+            with metrics.timed("prefetch_wait", source):
+                wait([future])
+
+    def finish(self, number):
+        with self.lock:
+            self.finished.add(number)
+
+
+def _with_prefetch(entries, prefetchers, retrieval_settings, settings, executor, eager):
+    # Passes on the (index, number, entry) tuples of entries with the PrefetchBatch of their batch, made
+    # PREFETCH_AHEAD batches ahead of the numbers being handed on so an eager first source is searched in time
+    if not prefetchers:
+        for index, number, entry in entries:
+            yield index, number, entry, None
+        return
+
+    batches = deque()
+    batch = []
+    for item in entries:
+        batch.append(item)
+        if len(batch) >= PREFETCH_BATCH_SIZE:
+            batches.append(_start_prefetch(batch, prefetchers, retrieval_settings, settings, executor, eager))
+            batch = []
+            if len(batches) > PREFETCH_AHEAD:
+                yield from batches.popleft()
+    if batch:
+        batches.append(_start_prefetch(batch, prefetchers, retrieval_settings, settings, executor, eager))
+    while batches:
+        yield from batches.popleft()
+
+
+def _start_prefetch(batch, prefetchers, retrieval_settings, settings, executor, eager):
+    numbers = [number for _, number, entry in batch if not is_complete(entry, retrieval_settings)]
+    prefetched = PrefetchBatch(numbers, prefetchers, settings, executor, eager)
+    return [(index, number, entry, prefetched) for index, number, entry in batch]
+
+
+def _run_prefetch(source, prefetch, numbers, settings):
+    # A failed batch only costs time, its numbers are then searched for one at a time
+    if not is_healthy(source, settings):
+        return
+    try:
+        with metrics.timed("prefetch", source):
+            prefetch(numbers)
+    except Exception as e:
+        logs.log_error(f"Error while searching a batch of {len(numbers)} values: {e}")
+
+
+def _search_in_batch(prefetched, index, entry, number, *args, **kwargs):
+    with metrics.trace(index):
+        try:
+            return search_sources(entry, number, *args, prefetched=prefetched, **kwargs)
+        finally:
+            if prefetched is not None:
+                prefetched.finish(number)
+
+
+def harvest(input_data, ordered_sources, retrieval_settings, dont_use_api, settings, db_manager, is_isbn,
+            is_oclc, max_workers=None, stop_requested=None, journal=None):
+    """
+    Generator that looks up every number in input_data and yields
+    (index, number, entry) tuples in input order. settings is the
+    config.Settings snapshot the whole harvest runs with.
+
+    Every number is first looked up in the database in bulk. Numbers
+    that are not fully answered by the database are searched for on a
+    pool of max_workers threads, each walking ordered_sources in
+    priority order exactly like a serial search would. The database is
+    only ever touched from the thread consuming this generator.
+
+    Once stop_requested() returns True no new numbers are started, and
+    only the numbers before the first one that never ran are yielded.
+
+    journal is an optional started HarvestJournal. Numbers it has as
+    done are handed back without searching, numbers that were being
+    searched carry on from the sources they had not tried yet, and the
+    journal is finished once every number has been yielded.
+
+    Sources with a batched search (see source_prefetch) are searched
+    for PREFETCH_BATCH_SIZE numbers at a time (see PrefetchBatch). A
+    number's search only waits for the batch of the source it is about
+    to search. If the first source has a batched search it is searched
+    a few batches ahead.
+
+    How long every stage takes is recorded per source (see metrics)
+    and summarized once the last number has been yielded.
+
+    With the adaptive_source_order setting the sources are reordered
+    for every number by how quickly they have filled in what it still
+    needs (see sourceScheduler). What is learned is loaded from and
+    saved to the database, so it carries over to the next harvest.
+    """
+    if max_workers is None:
+        max_workers = settings.max_workers
+    max_workers = max(1, int(max_workers))
+    if stop_requested is None:
+        stop_requested = lambda: False
+
+    # Keep a couple of numbers queued per worker so no worker sits idle while we wait on the oldest one
+    window = max_workers * 2
+    pending = deque()
+    input_finished = False
+
+    prefetchers = [(source, prefetch) for source, prefetch in
+                   ((source, source_prefetch(source, dont_use_api, settings, is_isbn, is_oclc))
+                    for source in ordered_sources) if prefetch is not None]
+    prefetch_executor = ThreadPoolExecutor(max_workers=max(1, len(prefetchers)), thread_name_prefix="lmh-prefetch")
+    first_source = next((source for source in ordered_sources
+                         if source_search(source, dont_use_api, settings) is not None), None)
+    eager = bool(prefetchers) and prefetchers[0][0] == first_source
+    # Answers batched by an earlier harvest are not used, they may be for other settings or out of date
+    LMH_response_cache.clear_prefetched()
+    if settings.adaptive_source_order:
+        sourceScheduler.get_scheduler().load(db_manager.get_source_stats())
+    metrics.start_run(settings)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        entries = entries_from_database(input_data, db_manager, retrieval_settings, is_isbn, is_oclc)
+        for index, number, entry, prefetched in _with_prefetch(entries, prefetchers, retrieval_settings, settings,
+                                                               prefetch_executor, eager):
+            if stop_requested():
+                break
+
+            tried = []
+            resumed = False
+            if journal is not None:
+                state, saved_entry, tried = journal.get(index, number)
+                if saved_entry is not None:
+                    # Keep what the interrupted harvest found, topped up with anything the database has since
+                    entry = {**saved_entry, **{key: value for key, value in entry.items() if value}}
+                    resumed = True
+                if state == LMH_journal.DONE:
+                    tried = list(ordered_sources)
+
+            # Skip the sources if all the data has been retrieved from the database or if we said we didn't want it,
+            # or if the interrupted harvest already searched every one of them. Entries answered by the database are
+            # not written back to it
+            if is_complete(entry, retrieval_settings) or (tried and set(ordered_sources) <= set(tried)):
+                pending.append((index, number, entry, None, tried, resumed))
+            else:
+                extra = {}
+                if journal is not None:
+                    journal.update(index, number, LMH_journal.IN_FLIGHT, entry, tried)
+                    extra = {'tried_sources': set(tried),
+                             'source_done': _journal_source_done(journal, index, number, tried)}
+                future = executor.submit(_search_in_batch, prefetched, index, entry, number, ordered_sources,
+                                         retrieval_settings, dont_use_api, settings, is_isbn, is_oclc, **extra)
+                pending.append((index, number, entry, future, tried, True))
+
+            while pending and (len(pending) >= window or pending[0][3] is None or pending[0][3].done()):
+                yield _finish(pending.popleft(), db_manager, is_isbn, journal)
+        else:
+            input_finished = True
+
+        while pending:
+            if stop_requested():
+                prefetch_executor.shutdown(wait=False, cancel_futures=True)
+                for item in pending:
+                    if item[3] is not None:
+                        item[3].cancel()
+            if pending[0][3] is not None and pending[0][3].cancelled():
+                break
+            yield _finish(pending.popleft(), db_manager, is_isbn, journal)
+
+    # Batches read ahead of a stop are not searched, and what they found is not kept for the next harvest
+    prefetch_executor.shutdown(wait=False, cancel_futures=True)
+    LMH_response_cache.clear_prefetched()
+    if settings.adaptive_source_order:
+        db_manager.save_source_stats(sourceScheduler.get_scheduler().rows())
+    metrics.finish_run(settings)
+
+    if journal is not None:
+        if input_finished and not pending:
+            # Make sure the results are stored before the journal forgets them
+            db_manager.flush()
+            journal.finish()
+        else:
+            journal.flush()
+
+
+def _journal_source_done(journal, index, number, tried):
+    # Called from the worker thread after every source it searches
+    def source_done(source, entry):
+        tried.append(source)
+        journal.update(index, number, LMH_journal.IN_FLIGHT, entry, tried)
+    return source_done
+
+
+def _finish(item, db_manager, is_isbn, journal=None):
+    index, number, entry, future, tried, store = item
+
+    if not store:
+        metrics.count("answered", "database")
+        metrics.write_trace(index, number)
+        return index, number, entry
+
+    state = LMH_journal.DONE
+    if future is not None:
+        try:
+            entry = future.result()
+        except Exception as e:
+            logs.log_error(f"Error while searching sources for {number}: {e}")
+            state = LMH_journal.FAILED
+    metrics.write_trace(index, number)
+
+    # Numbers finished before an interruption are stored again in case their batch never reached the database
+    with metrics.timed("db_write", "database"):
+        db_manager.insert(entry.get('isbn', ''), entry.get('oclc', ''), entry.get('lccn', ''),
+                          entry.get('source', ''), is_isbn)
+    if journal is not None:
+        journal.update(index, number, state, entry, tried)
+
+    return index, number, entry
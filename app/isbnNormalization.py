@@ -0,0 +1,56 @@
+import re
+
+
+def normalize_isbn(isbn):
+    # Keeps only the digits and check character, so "0-19-284384-5" and "019284384X (pbk.)" compare as numbers
+    match = re.search(r'[0-9][0-9\-\s]{8,16}[0-9Xx]', isbn or '')
+    if match is None:
+        return ''
+    return re.sub(r'[^0-9X]', '', match.group(0).upper())
+
+
+def isbn_forms(isbn):
+    """
+    Returns the set of ways an ISBN can be written, its ISBN-10 and
+    ISBN-13 forms without hyphens, so records giving either one can be
+    matched to an input value.
+    """
+    isbn = normalize_isbn(isbn)
+    forms = {isbn} if isbn else set()
+    if len(isbn) == 10:
+        core = "978" + isbn[:9]
+        check = (10 - sum(int(digit) * (3 if position % 2 else 1) for position, digit in enumerate(core)) % 10) % 10
+        forms.add(core + str(check))
+    elif len(isbn) == 13 and isbn.startswith("978"):
+        core = isbn[3:12]
+        check = (11 - sum(int(digit) * (10 - position) for position, digit in enumerate(core)) % 11) % 11
+        forms.add(core + ("X" if check == 10 else str(check)))
+    return forms
+
+
+def isbn13(isbn):
+    # One form to compare ISBNs by, ISBN-10s are turned into ISBN-13s and anything else is only normalized
+    isbn = normalize_isbn(isbn)
+    if len(isbn) == 10:
+        return next(form for form in isbn_forms(isbn) if len(form) == 13)
+    return isbn
+
+
+def is_valid_isbn(isbn):
+    """
+    Returns True if isbn, once normalized, is an ISBN-10 or ISBN-13
+    whose check character is right.
+    """
+    isbn = normalize_isbn(isbn)
+    if len(isbn) == 10 and isbn[:9].isdigit():
+        total = sum(int(digit) * (10 - position) for position, digit in enumerate(isbn[:9]))
+        return (total + (10 if isbn[9] == "X" else int(isbn[9]))) % 11 == 0
+    if len(isbn) == 13 and isbn.isdigit():
+        return sum(int(digit) * (3 if position % 2 else 1) for position, digit in enumerate(isbn)) % 10 == 0
+    return False
+
+
+def normalize_oclc(oclc):
+    # "(OCoLC)ocm00012345" and "12345" are the same OCLC number
+    match = re.search(r'\d+', oclc or '')
+    return match.group(0).lstrip('0') if match else ''
@@ -1,19 +1,215 @@
+import atexit
 import logging
+import os
+import queue
+import threading
+import time
 
-# Set up logging configuration
-logging.basicConfig(filename='lmh_log.log',
-                    filemode='a',  # Append to the log file
-                    format='%(asctime)s - %(levelname)s - %(message)s',
-                    level=logging.INFO)
+LOG_FILE = 'lmh_log.log'
+# Records waiting to be written, any more are dropped and counted instead of blocking the caller
+QUEUE_SIZE = 10000
+# Most records written to the file at once
+BATCH_SIZE = 500
+# Seconds the writer waits for more records before checking its repeated errors again
+FLUSH_INTERVAL = 0.5
+# Seconds an error or warning is not written again for, after which the number of repeats is written instead
+COALESCE_SECONDS = 60
+
+LEVELS = {'DEBUG': logging.DEBUG, 'INFO': logging.INFO, 'WARNING': logging.WARNING, 'ERROR': logging.ERROR}
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+class LogWriter:
+    """
+    Log file written on a background thread. put() only adds a record
+    to a queue, so logging never waits on the file. The thread writes
+    the records it finds in batches, starts a new file once the log
+    reaches max_bytes (keeping backup_count old ones as lmh_log.log.1
+    and so on) and writes an error or warning that keeps repeating only
+    once per COALESCE_SECONDS, followed by how often it repeated.
+    """
+    def __init__(self, file_name=LOG_FILE, level=logging.INFO, max_bytes=0, backup_count=0,
+                 coalesce_seconds=COALESCE_SECONDS):
+        self.file_name = file_name
+        self.level = level
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.coalesce_seconds = coalesce_seconds
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.dropped = 0
+        self.repeats = {}
+        self.file = None
+        self.size = 0
+        self.thread = threading.Thread(target=self._run, name="lmh-log", daemon=True)
+        self.thread.start()
+
+    def put(self, level, message):
+        """
+        Queues a message to be written, unless its level is below the
+        writer's. Never blocks, a message is dropped if the queue is full.
+        """
+        if level < self.level:
+            return
+        try:
+            self.queue.put_nowait((time.time(), level, message))
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout=5):
+        """
+        Waits until every message queued so far has been written. Repeated
+        errors still being counted are written as well.
+        """
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait(timeout)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join(5)
+
+    def _run(self):
+        while True:
+            try:
+                batch = [self.queue.get(timeout=FLUSH_INTERVAL)]
+            except queue.Empty:
+                batch = []
+            while batch and len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            lines = []
+            closing = False
+            flushed = []
+            for record in batch:
+                if record is None:
+                    closing = True
+                elif isinstance(record, threading.Event):
+                    flushed.append(record)
+                else:
+                    lines += self._coalesce(*record)
+            lines += self._expired(time.time(), force=closing or bool(flushed))
+            if self.dropped:
+                dropped, self.dropped = self.dropped, 0
+                lines.append(format_line(time.time(), logging.WARNING,
+                                         f"{dropped} log messages were dropped because logging fell behind"))
+            if lines:
+                self._write("".join(lines))
+            for event in flushed:
+                event.set()
+            if closing:
+                if self.file is not None:
+                    self.file.close()
+                    self.file = None
+                return
+
+    def _coalesce(self, created, level, message):
+        # Returns the lines to write for a record, none if it repeats an error written less than coalesce_seconds ago
+        if level < logging.WARNING or not self.coalesce_seconds:
+            return [format_line(created, level, message)]
+        repeat = self.repeats.get((level, message))
+        if repeat is None:
+            self.repeats[(level, message)] = [created, 0]
+            return [format_line(created, level, message)]
+        repeat[1] += 1
+        return []
+
+    def _expired(self, now, force=False):
+        lines = []
+        for (level, message), (first, count) in list(self.repeats.items()):
+            if force or now - first >= self.coalesce_seconds:
+                del self.repeats[(level, message)]
+                if count:
+                    lines.append(format_line(now, level, f"{message} (repeated {count} more times in the last "
+                                                         f"{now - first:.0f} seconds)"))
+        return lines
+
+    def _write(self, text):
+        data = text.encode('utf-8')
+        try:
+            if self.file is None:
+                self.file = open(self.file_name, 'ab')
+                self.size = self.file.tell()
+            if self.max_bytes and self.size and self.size + len(data) > self.max_bytes:
+                self._rotate()
+            self.file.write(data)
+            self.file.flush()
+            self.size += len(data)
+        except OSError:
+            # Nowhere left to report it, the batch is lost but logging carries on
+            self.file = None
+
+    def _rotate(self):
+        self.file.close()
+        if self.backup_count:
+            for number in range(self.backup_count - 1, 0, -1):
+                if os.path.exists(f"{self.file_name}.{number}"):
+                    os.replace(f"{self.file_name}.{number}", f"{self.file_name}.{number + 1}")
+            os.replace(self.file_name, f"{self.file_name}.1")
+        self.file = open(self.file_name, 'wb')
+        self.size = 0
+
+
+class _QueueHandler(logging.Handler):
+    # Sends records logged through the logging module, e.g. by libraries, to the same writer
+    def emit(self, record):
+        try:
+            get_writer().put(record.levelno, self.format(record))
+        except Exception:
+            self.handleError(record)
+
+
+def format_line(created, level, message):
+    # Same format the log had when it was written through logging.basicConfig
+    return (f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created))},{int(created % 1 * 1000):03d} - "
+            f"{logging.getLevelName(level)} - {message}\n")
+
+
+def get_writer():
+    """
+    Returns the writer of the log file, starting it with the default
+    settings the first time something is logged.
+    """
+    global _writer
+    writer = _writer
+    if writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = LogWriter()
+                root = logging.getLogger()
+                root.addHandler(_QueueHandler())
+                root.setLevel(_writer.level)
+                atexit.register(_writer.close)
+            writer = _writer
+    return writer
+
+
+def configure(settings):
+    """
+    Applies the log_level, log_max_bytes and log_backup_count settings.
+    """
+    writer = get_writer()
+    writer.level = LEVELS.get(str(settings.log_level).upper(), logging.INFO)
+    writer.max_bytes = settings.log_max_bytes
+    writer.backup_count = settings.log_backup_count
+    logging.getLogger().setLevel(writer.level)
+
+
+def flush():
+    get_writer().flush()
 
 
 def log_info(message):
-    logging.info(message)
+    get_writer().put(logging.INFO, message)
 
 
 def log_warning(message):
-    logging.warning(message)
+    get_writer().put(logging.WARNING, message)
 
 
 def log_error(message):
-    logging.error(message)
+    get_writer().put(logging.ERROR, message)
@@ -0,0 +1,272 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from app import config, logs
+
+# Upper bounds in seconds of the histogram buckets every stage's times are counted into
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Times of the value being searched for, per "stage:source", while it is being searched for. Each worker thread has
+# its own, and httpClient.run hands it on to the requests the worker makes
+_trace = ContextVar('lmh_trace', default=None)
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+class StageTimer:
+    """
+    Number of times a stage ran for a source, the seconds it took in
+    total and at most, and how many times fell into each of BUCKETS.
+    """
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.buckets[bisect_left(BUCKETS, seconds)] += 1
+
+
+class Metrics:
+    """
+    Timers and counters of one harvest, per stage (or event) and
+    source. Recording one takes a lock and a few additions, so it is
+    cheap enough to leave on. It is safe to use from several threads.
+    """
+    def __init__(self, jsonl_file=None):
+        self.timers = {}
+        self.counters = {}
+        self.traces = {}
+        self.started = time.time()
+        self.jsonl_file = jsonl_file
+        self.lock = threading.Lock()
+
+    def record(self, stage, source, seconds, trace=None):
+        with self.lock:
+            timer = self.timers.get((stage, source))
+            if timer is None:
+                timer = self.timers[(stage, source)] = StageTimer()
+            timer.add(seconds)
+            if trace is not None:
+                key = f"{stage}:{source}"
+                trace[key] = trace.get(key, 0) + seconds
+
+    def count(self, event, source, amount=1):
+        with self.lock:
+            self.counters[(event, source)] = self.counters.get((event, source), 0) + amount
+
+    def snapshot(self):
+        """
+        Returns the timers and counters as a dictionary that can be
+        written out as JSON.
+        """
+        with self.lock:
+            return {
+                'seconds': time.time() - self.started,
+                'stages': [{'stage': stage, 'source': source, 'count': timer.count, 'total': timer.total,
+                            'max': timer.max} for (stage, source), timer in sorted(self.timers.items())],
+                'counters': [{'event': event, 'source': source, 'count': count}
+                             for (event, source), count in sorted(self.counters.items())]
+            }
+
+    def summary(self):
+        """
+        Returns a table of where the harvest's time went, the stages
+        that took longest in total first, followed by the counters.
+        """
+        snapshot = self.snapshot()
+        lines = [f"Harvest metrics after {snapshot['seconds']:.1f} seconds",
+                 f"{'stage':<16}{'source':<28}{'count':>8}{'total s':>10}{'mean ms':>10}{'max ms':>10}"]
+        for stage in sorted(snapshot['stages'], key=lambda stage: -stage['total']):
+            lines.append(f"{stage['stage']:<16}{stage['source']:<28}{stage['count']:>8}{stage['total']:>10.2f}"
+                         f"{stage['total'] / stage['count'] * 1000:>10.1f}{stage['max'] * 1000:>10.1f}")
+        for counter in snapshot['counters']:
+            lines.append(f"{counter['event']:<16}{counter['source']:<28}{counter['count']:>8}")
+        return "\n".join(lines)
+
+    def prometheus(self):
+        """
+        Returns the timers as a histogram and the counters as a counter
+        in the Prometheus text exposition format.
+        """
+        with self.lock:
+            timers = sorted((key, timer.buckets[:], timer.total, timer.count) for key, timer in self.timers.items())
+            counters = sorted(self.counters.items())
+
+        lines = ["# HELP lmh_stage_seconds Seconds spent in each stage of a harvest, per source.",
+                 "# TYPE lmh_stage_seconds histogram"]
+        for (stage, source), buckets, total, count in timers:
+            labels = f'stage="{_escape(stage)}",source="{_escape(source)}"'
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS + ("+Inf",), buckets):
+                cumulative += bucket
+                lines.append(f'lmh_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"lmh_stage_seconds_sum{{{labels}}} {total}")
+            lines.append(f"lmh_stage_seconds_count{{{labels}}} {count}")
+        lines += ["# HELP lmh_events_total Events counted during a harvest, per source.",
+                  "# TYPE lmh_events_total counter"]
+        for (event, source), count in counters:
+            lines.append(f'lmh_events_total{{event="{_escape(event)}",source="{_escape(source)}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def get_metrics():
+    """
+    Returns the Metrics of the current harvest, an empty one if no
+    harvest has started.
+    """
+    global _metrics
+    metrics = _metrics
+    if metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                _metrics = Metrics()
+            metrics = _metrics
+    return metrics
+
+
+def enabled():
+    return config.get_settings().metrics
+
+
+def record(stage, source, seconds):
+    """
+    Records that stage took seconds for source, also in the times of
+    the value being searched for if there is one.
+    """
+    if enabled():
+        get_metrics().record(stage, source, seconds, _trace.get())
+
+
+def count(event, source, amount=1):
+    """
+    Counts amount events for source.
+    """
+    if enabled():
+        get_metrics().count(event, source, amount)
+
+
+@contextmanager
+def timed(stage, source):
+    """
+    Context manager recording how long its block takes as stage.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, source, time.perf_counter() - started)
+
+
+@contextmanager
+def trace(index):
+    """
+    Context manager collecting the times of everything recorded in its
+    block, and in the requests it makes through httpClient, for the
+    value at index. They are only kept when they are written out as
+    JSON lines, see write_trace.
+    """
+    metrics = get_metrics()
+    if metrics.jsonl_file is None or not enabled():
+        yield
+        return
+    times = {}
+    token = _trace.set(times)
+    try:
+        yield
+    finally:
+        _trace.reset(token)
+        with metrics.lock:
+            metrics.traces[index] = times
+
+
+def carry(coroutine):
+    """
+    Returns coroutine wrapped so that it records into the times of the
+    value the calling thread is searching for, when it runs on the
+    shared event loop.
+    """
+    times = _trace.get()
+    if times is None:
+        return coroutine
+    return _carried(coroutine, times)
+
+
+async def _carried(coroutine, times):
+    # Every task runs in a copy of the context, so this does not leak into other requests
+    _trace.set(times)
+    return await coroutine
+
+
+def start_run(settings):
+    """
+    Starts the metrics of a new harvest, opening the metrics_jsonl_file
+    setting's file if there is one.
+    """
+    global _metrics
+    jsonl_file = None
+    if settings.metrics and settings.metrics_jsonl_file:
+        try:
+            jsonl_file = open(settings.metrics_jsonl_file, 'a', encoding='utf-8')
+        except OSError as e:
+            logs.log_error(f"Could not open {settings.metrics_jsonl_file}: {e}")
+    with _metrics_lock:
+        _metrics = Metrics(jsonl_file)
+    return _metrics
+
+
+def write_trace(index, number):
+    """
+    Writes the times of the value at index as a JSON line, if the run
+    has a JSON lines file. Values answered by the database have none.
+    """
+    metrics = get_metrics()
+    if metrics.jsonl_file is None:
+        return
+    with metrics.lock:
+        times = metrics.traces.pop(index, {})
+    metrics.jsonl_file.write(json.dumps({'index': index, 'number': number, 'seconds': times}) + "\n")
+
+
+def finish_run(settings):
+    """
+    Logs the summary of the harvest, adds it to the JSON lines file as
+    its last line and writes the metrics_prometheus_file setting's
+    file. Returns the summary.
+    """
+    metrics = get_metrics()
+    if not settings.metrics:
+        return ""
+    summary = metrics.summary()
+    logs.log_info(summary)
+    if metrics.jsonl_file is not None:
+        metrics.jsonl_file.write(json.dumps({'summary': metrics.snapshot()}) + "\n")
+        metrics.jsonl_file.close()
+        metrics.jsonl_file = None
+    if settings.metrics_prometheus_file:
+        write_prometheus(settings.metrics_prometheus_file, metrics)
+    return summary
+
+
+def write_prometheus(file_name, metrics=None):
+    # Written next to the file and moved over it, so a collector never reads half a file
+    metrics = metrics or get_metrics()
+    try:
+        with open(file_name + ".tmp", 'w', encoding='utf-8') as file:
+            file.write(metrics.prometheus())
+        os.replace(file_name + ".tmp", file_name)
+    except OSError as e:
+        logs.log_error(f"Could not write {file_name}: {e}")
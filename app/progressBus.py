@@ -0,0 +1,113 @@
+import collections
+import time
+from concurrent.futures import Future
+
+# Times a second the GUI drains the bus and redraws the progress window
+FRAMES_PER_SECOND = 10
+# Seconds of progress the throughput, and so the ETA, is measured over
+RATE_WINDOW = 10
+# Name the values no source filled in are counted under
+NOT_FOUND = "Not found"
+
+
+class ProgressBus:
+    """
+    Progress of a search, published from the search thread and shown
+    by the Tk loop. Publishing only appends an event to a deque, which
+    needs no lock, so it never slows the search down. drain() is called
+    by the Tk loop FRAMES_PER_SECOND times a second, applies every
+    event published since the last call to the counters and returns
+    the ones the GUI has to act on, in the order they were published.
+    """
+    def __init__(self):
+        self.events = collections.deque()
+        self.total = 0
+        self.done = 0
+        self.hits = {}
+        self.started = None
+        self.samples = collections.deque()
+
+    # Called from the search thread
+    def start(self, total):
+        self.events.append(("start", total))
+
+    def advance(self, source):
+        # One value is done, source is the one that filled it in, empty if none did
+        self.events.append(("done", source))
+
+    def log(self, text):
+        self.events.append(("log", text))
+
+    def notify(self, **message):
+        # Shown as a CTkMessagebox with these arguments
+        self.events.append(("notify", message))
+
+    def ask(self, **message):
+        """
+        Shows a CTkMessagebox with these arguments from the Tk loop and
+        returns the option the user picked. Blocks until they did.
+        """
+        answer = Future()
+        self.events.append(("ask", message, answer))
+        return answer.result()
+
+    def finish(self):
+        self.events.append(("finish",))
+
+    # Called from the Tk loop
+    def drain(self, now=None):
+        """
+        Applies every event published so far and returns the ones that
+        are not counters ("start", "log", "notify", "ask", "finish").
+        """
+        now = time.monotonic() if now is None else now
+        actions = []
+        while True:
+            try:
+                event = self.events.popleft()
+            except IndexError:
+                break
+            if event[0] == "done":
+                self.done += 1
+                source = event[1] or NOT_FOUND
+                self.hits[source] = self.hits.get(source, 0) + 1
+                continue
+            if event[0] == "start":
+                self.total, self.done, self.hits, self.started = event[1], 0, {}, now
+                self.samples.clear()
+            actions.append(event)
+
+        if self.started is not None:
+            self.samples.append((now, self.done))
+            while len(self.samples) > 1 and now - self.samples[0][0] > RATE_WINDOW:
+                self.samples.popleft()
+        return actions
+
+    def rate(self):
+        # Values done per second over the last RATE_WINDOW seconds
+        if len(self.samples) < 2:
+            return 0.0
+        (first_time, first_done), (last_time, last_done) = self.samples[0], self.samples[-1]
+        return (last_done - first_done) / (last_time - first_time) if last_time > first_time else 0.0
+
+    def eta(self):
+        """
+        Returns the seconds left at the current rate, None while there is
+        no rate to go by.
+        """
+        rate = self.rate()
+        if not rate:
+            return None
+        return max(0, self.total - self.done) / rate
+
+    def describe(self):
+        """
+        Returns the lines the progress window shows: the values done with
+        the rate and ETA, and how many values each source filled in.
+        """
+        eta = self.eta()
+        eta_text = f"{int(eta) // 60}:{int(eta) % 60:02d}" if eta is not None else "-"
+        status = f"{self.done} of {self.total} values, {self.rate():.1f} per second, ETA {eta_text}"
+        hits = ", ".join(f"{source}: {count}" for source, count in
+                         sorted(self.hits.items(), key=lambda item: (item[0] == NOT_FOUND, -item[1])))
+        return status, hits
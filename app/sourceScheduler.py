@@ -0,0 +1,146 @@
+import threading
+from collections import deque
+
+# Searches of a source for one type of input needed before it is moved, until then it keeps its place in the list
+MIN_SEARCHES = 20
+# Latencies a source's p50 and p95 are worked out over
+LATENCY_SAMPLES = 200
+# Once a source has been searched this often its counts are halved, so the hit rate follows a source that changes
+MAX_SEARCHES = 1000
+# Metadata a source can fill in, as named in an entry
+FIELDS = ('isbn', 'oclc', 'lccn')
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+class SourceStats:
+    """
+    How often one source filled in each field it was asked for and how
+    long its searches took, for one type of input.
+    """
+    def __init__(self, searches=0, tries=None, hits=None, latencies=()):
+        self.searches = searches
+        self.tries = {field: 0 for field in FIELDS}
+        self.hits = {field: 0 for field in FIELDS}
+        self.tries.update(tries or {})
+        self.hits.update(hits or {})
+        self.latencies = deque(latencies, maxlen=LATENCY_SAMPLES)
+
+    def record(self, latency, wanted, filled):
+        self.searches += 1
+        self.latencies.append(latency)
+        for field in wanted:
+            self.tries[field] += 1
+            if field in filled:
+                self.hits[field] += 1
+        if self.searches > MAX_SEARCHES:
+            self.searches //= 2
+            for field in FIELDS:
+                self.tries[field] //= 2
+                self.hits[field] //= 2
+
+    def hit_rate(self, field):
+        return self.hits[field] / self.tries[field] if self.tries[field] else 0
+
+    def percentile(self, fraction):
+        latencies = sorted(self.latencies)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+
+class SourceScheduler:
+    """
+    Live hit rates and latencies of every source for ISBN and OCN
+    input, used to put the sources most likely to fill in an entry
+    quickly first. It is safe to use from several threads.
+    """
+    def __init__(self):
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def record(self, source, id_type, latency, wanted, filled):
+        """
+        Records one search of source: the seconds it took, the fields
+        it was asked for and the ones it filled in.
+        """
+        with self.lock:
+            stats = self.stats.get((source, id_type))
+            if stats is None:
+                stats = self.stats[(source, id_type)] = SourceStats()
+            stats.record(latency, wanted, filled)
+
+    def expected_cost(self, source, id_type, wanted):
+        """
+        Returns (p50 / chance of filling in a wanted field, p95) for a
+        source, or None while it has too few searches to go by.
+        Searching sources by increasing p50 over hit rate gives the
+        shortest expected time until one of them answers.
+        """
+        with self.lock:
+            stats = self.stats.get((source, id_type))
+            if stats is None or stats.searches < MIN_SEARCHES:
+                return None
+            hit_rate = max((stats.hit_rate(field) for field in wanted), default=0)
+            p50 = stats.percentile(0.5)
+            p95 = stats.percentile(0.95)
+        if not hit_rate:
+            return float('inf'), p95
+        return p50 / hit_rate, p95
+
+    def order(self, sources, id_type, wanted, pinned=()):
+        """
+        Returns sources, a list of (source, search) pairs, with the
+        sources that have enough searches behind them sorted by
+        expected cost among the places they hold. Pinned sources and
+        sources still being learned about keep their place.
+        """
+        places = []
+        costs = []
+        for place, (source, _) in enumerate(sources):
+            if source in pinned:
+                continue
+            cost = self.expected_cost(source, id_type, wanted)
+            if cost is not None:
+                places.append(place)
+                costs.append((cost, place))
+        ordered = list(sources)
+        for place, (_, old_place) in zip(places, sorted(costs)):
+            ordered[place] = sources[old_place]
+        return ordered
+
+    def load(self, rows):
+        """
+        Replaces the statistics with rows as returned by rows().
+        """
+        with self.lock:
+            self.stats = {(source, id_type): SourceStats(searches, tries, hits, latencies)
+                          for source, id_type, searches, tries, hits, latencies in rows}
+
+    def rows(self):
+        """
+        Returns the statistics as (source, id_type, searches, tries,
+        hits, latencies) tuples, see Database.save_source_stats.
+        """
+        with self.lock:
+            return [(source, id_type, stats.searches, dict(stats.tries), dict(stats.hits), list(stats.latencies))
+                    for (source, id_type), stats in self.stats.items()]
+
+
+def get_scheduler():
+    # One scheduler is shared by every harvest so it keeps learning from one to the next
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = SourceScheduler()
+        return _scheduler
+
+
+def reset():
+    """
+    Forgets every source's statistics.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = None
@@ -98,7 +98,7 @@ class TestDatabase(unittest.TestCase):
         self.db_manager.open_connection()
         cursor = self.db_manager.connection.cursor()
         cursor.execute("INSERT INTO metadata (isbn, ocn, lccn, lccn_source) VALUES (?, ?, ?, ?)", (isbn, ocn, lccn, source))
-        cursor.execute("INSERT INTO metadata (isbn, ocn, lccn, lccn_source) VALUES (?, ?, ?, ?)", (isbn, ocn2, lccn2, source2))
+        cursor.execute("INSERT INTO metadata (isbn, ocn, lccn, lccn_source) VALUES (?, ?, ?, ?)", ("1234522891", ocn2, lccn2, source2))
         self.db_manager.connection.commit()
         self.db_manager.close_connection()
         
@@ -111,7 +111,7 @@ class TestDatabase(unittest.TestCase):
         
         self.assertIsInstance(result, list)
         self.assertEqual(len(result), 3)  
-        self.assertEqual(result, [isbn, ocn, [(lccn,source), (lccn2, source2)]])
+        self.assertEqual(result, [isbn, ocn, [(lccn,source)]])
         
 
     
@@ -130,7 +130,7 @@ class TestDatabase(unittest.TestCase):
         self.db_manager.open_connection()
         cursor = self.db_manager.connection.cursor()
         cursor.execute("INSERT INTO metadata (isbn, ocn, lccn, lccn_source) VALUES (?, ?, ?, ?)", (isbn, ocn, lccn, source))
-        cursor.execute("INSERT INTO metadata (isbn, ocn, lccn, lccn_source) VALUES (?, ?, ?, ?)", (isbn, ocn, lccn2, source2))
+        cursor.execute("INSERT INTO metadata (isbn, ocn, lccn, lccn_source) VALUES (?, ?, ?, ?)", ("1234522891", ocn2, lccn2, source2))
         self.db_manager.connection.commit()
         self.db_manager.close_connection()
         
@@ -143,7 +143,7 @@ class TestDatabase(unittest.TestCase):
         
         self.assertIsInstance(result, list)
         self.assertEqual(len(result), 3)  
-        self.assertEqual(result, [isbn, ocn, [(lccn,source), (lccn2,source2)]])
+        self.assertEqual(result, [isbn, ocn, [(lccn,source)]])
 
 
 
@@ -159,6 +159,165 @@ class TestDatabase(unittest.TestCase):
         self.assertEqual(len(result), 0)
 
 
+    def test_batched_insert(self):
+        batched_db = Database(self.test_db_name, persistent=True, batch_size=3)
+        batched_db.insert("111", "", "", "", True)
+        batched_db.insert("222", "73824832", "QA76 .B2", "Harvard", True)
+
+        # Nothing is committed until the batch is full
+        self.db_manager.open_connection()
+        cursor = self.db_manager.connection.cursor()
+        self.assertEqual(cursor.execute("SELECT COUNT(*) FROM metadata").fetchone()[0], 0)
+        self.db_manager.close_connection()
+
+        # Looking up a buffered number commits the buffer first
+        self.assertTrue(batched_db.is_in_database("222", "ISBN"))
+
+        # Only empty fields get filled in, like an unbuffered insert
+        batched_db.insert("111", "18395", "PS3545 .I345", "LOC", True)
+        batched_db.insert("111", "99999", "ZZ 1", "Other", True)
+        batched_db.close()
+
+        self.assertEqual(self.db_manager.get_metadata("111", 0), ["111", "18395", [("PS3545 .I345", "LOC")]])
+
+    def test_failed_batch_keeps_other_inserts(self):
+        batched_db = Database(self.test_db_name, persistent=True, batch_size=3)
+        write_row = batched_db.write_row
+
+        def failing_write_row(cursor, isbn, *row):
+            if isbn == "222":
+                raise sqlite3.IntegrityError("bad row")
+            write_row(cursor, isbn, *row)
+
+        batched_db.write_row = failing_write_row
+        batched_db.insert("111", "18395", "PS3545 .I345", "LOC", True)
+        batched_db.insert("222", "73824832", "QA76 .B2", "Harvard", True)
+        batched_db.insert("333", "", "", "", True)
+        batched_db.close()
+
+        # Only the row that failed is lost with the batch
+        self.assertEqual(self.db_manager.get_metadata("111", 0), ["111", "18395", [("PS3545 .I345", "LOC")]])
+        self.assertTrue(self.db_manager.is_in_database("333", "ISBN"))
+        self.assertFalse(self.db_manager.is_in_database("222", "ISBN"))
+
+    def test_insert_fills_only_empty_fields(self):
+        self.db_manager.insert("1234567890", "", "", "", True)
+        self.db_manager.insert("1234567890", "18395", "", "", True)
+        self.db_manager.insert("1234567890", "99999", "QA76 .B2", "Harvard", True)
+        self.db_manager.insert("1234567890", "11111", "ZZ 1", "LOC", True)
+
+        # A row found by its OCN gets its missing ISBN filled in
+        self.db_manager.insert("", "555", "", "", False)
+        self.db_manager.insert("0987654321", "555", "PS3545 .I345", "LOC", False)
+
+        self.assertEqual(self.db_manager.get_metadata("1234567890", 0),
+                         ["1234567890", "18395", [("QA76 .B2", "Harvard")]])
+        self.assertEqual(self.db_manager.get_metadata("555", 1), ["0987654321", "555", [("PS3545 .I345", "LOC")]])
+
+        self.db_manager.open_connection()
+        cursor = self.db_manager.connection.cursor()
+        self.assertEqual(cursor.execute("SELECT COUNT(*) FROM metadata").fetchone()[0], 2)
+        self.db_manager.close_connection()
+
+    def test_isbns_sharing_an_ocn(self):
+        # An ISBN-10 and its ISBN-13 have the same OCN, both are stored
+        self.db_manager.insert("0306406152", "12345", "QA76 .B2", "LOC", True)
+        self.db_manager.insert("9780306406157", "12345", "", "", True)
+
+        self.assertTrue(self.db_manager.is_in_database("0306406152", "ISBN"))
+        self.assertTrue(self.db_manager.is_in_database("9780306406157", "ISBN"))
+        self.assertEqual(self.db_manager.get_metadata("9780306406157", 0), ["9780306406157", "12345", [("", "")]])
+        self.assertEqual(self.db_manager.get_metadata("0306406152", 0),
+                         ["0306406152", "12345", [("QA76 .B2", "LOC")]])
+
+        # An OCN search adds to the first row with the OCN instead of a new row
+        self.db_manager.insert("9780306406157", "12345", "QA76 .B3", "Harvard", False)
+        self.db_manager.open_connection()
+        cursor = self.db_manager.connection.cursor()
+        self.assertEqual(cursor.execute("SELECT COUNT(*) FROM metadata").fetchone()[0], 2)
+        self.db_manager.close_connection()
+
+    def test_migrate_unique_ocn_index(self):
+        # Databases made while OCNs were unique get a plain index instead
+        connection = sqlite3.connect(self.test_db_name)
+        connection.execute("DROP INDEX metadata_ocn")
+        connection.execute("CREATE UNIQUE INDEX metadata_ocn ON metadata (ocn) WHERE ocn != ''")
+        connection.execute("PRAGMA user_version = 2")
+        connection.commit()
+        connection.close()
+
+        migrated = Database(self.test_db_name)
+        migrated.insert("0306406152", "12345", "", "", True)
+        migrated.insert("9780306406157", "12345", "", "", True)
+
+        self.assertTrue(migrated.is_in_database("9780306406157", "ISBN"))
+        connection = sqlite3.connect(self.test_db_name)
+        self.assertEqual(connection.execute("PRAGMA user_version").fetchone()[0], 3)
+        connection.close()
+
+    def test_migrate_legacy_database(self):
+        legacy_db_name = 'test_legacy_database.db'
+        connection = sqlite3.connect(legacy_db_name)
+        connection.execute("CREATE TABLE metadata (isbn TEXT, ocn TEXT, lccn TEXT, lccn_source TEXT)")
+        connection.executemany("INSERT INTO metadata (isbn, ocn, lccn, lccn_source) VALUES (?, ?, ?, ?)",
+                               [("1234522890", "", "", ""),
+                                ("1234522890", "82940283", "lccn-831", "test_source4"),
+                                ("", "14715783", "lccn-184", "test_source5"),
+                                ("", "14715783", "lccn-999", "test_source6")])
+        connection.commit()
+        connection.close()
+
+        try:
+            legacy_db = Database(legacy_db_name)
+
+            self.assertEqual(legacy_db.get_metadata("1234522890", 0),
+                             ["1234522890", "82940283", [("lccn-831", "test_source4")]])
+            self.assertEqual(legacy_db.get_metadata("14715783", 1), ["", "14715783", [("lccn-184", "test_source5")]])
+
+            connection = sqlite3.connect(legacy_db_name)
+            self.assertEqual(connection.execute("PRAGMA user_version").fetchone()[0], 3)
+            indexes = {row[0] for row in connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'metadata'")}
+            self.assertTrue({"metadata_isbn", "metadata_ocn"} <= indexes)
+            with self.assertRaises(sqlite3.IntegrityError):
+                connection.execute("INSERT INTO metadata (isbn, ocn, lccn, lccn_source) VALUES (?, ?, ?, ?)",
+                                   ("1234522890", "", "", ""))
+            connection.close()
+        finally:
+            os.remove(legacy_db_name)
+
+    def test_source_stats(self):
+        rows = [("LOC (API)", "isbn", 25, {'isbn': 0, 'oclc': 25, 'lccn': 25}, {'isbn': 0, 'oclc': 3, 'lccn': 20},
+                 [0.5, 1.25]),
+                ("LOC (API)", "ocn", 1, {'isbn': 1, 'oclc': 0, 'lccn': 1}, {'isbn': 1, 'oclc': 0, 'lccn': 0}, [2.0])]
+        self.db_manager.save_source_stats(rows)
+        rows[0] = ("LOC (API)", "isbn", 26, {'isbn': 0, 'oclc': 26, 'lccn': 26}, {'isbn': 0, 'oclc': 3, 'lccn': 21},
+                   [0.5, 1.25, 0.75])
+        self.db_manager.save_source_stats(rows[:1])
+
+        self.assertEqual(sorted(self.db_manager.get_source_stats()), rows)
+
+    def test_get_many(self):
+        isbns = [str(9780000000000 + number) for number in range(1200)]
+        for isbn in isbns[:1100]:
+            self.db_manager.insert(isbn, "ocn" + isbn, "", "", True)
+
+        result = self.db_manager.get_many(isbns, 0)
+
+        self.assertEqual(len(result), 1100)
+        self.assertEqual(result[isbns[1050]], [isbns[1050], "ocn" + isbns[1050], [("", "")]])
+        self.assertNotIn(isbns[1150], result)
+        self.assertEqual(self.db_manager.get_many(["ocn" + isbns[3]], 1)["ocn" + isbns[3]][0], isbns[3])
+
+    def test_get_many_ocn_shared_by_isbns(self):
+        # The older row has the call number, get_many answers with it like get_metadata does
+        self.db_manager.insert("0306406152", "12345", "QA76 .B2", "LOC", True)
+        self.db_manager.insert("9780306406157", "12345", "", "", True)
+
+        self.assertEqual(self.db_manager.get_metadata("12345", 1)[0], "0306406152")
+        self.assertEqual(self.db_manager.get_many(["12345"], 1),
+                         {"12345": ["0306406152", "12345", [("QA76 .B2", "LOC")]]})
+
     def test_isbn_not_in_db(self):
         result = self.db_manager.get_metadata("1748129424", 0)
         self.assertIsInstance(result, list)
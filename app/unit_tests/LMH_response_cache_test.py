@@ -0,0 +1,75 @@
+import unittest
+import sys
+import os
+from unittest import mock
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from app.database import LMH_response_cache
+from app.database.LMH_response_cache import ResponseCache
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.test_db_name = 'test_response_cache.db'
+        self.cache = ResponseCache(self.test_db_name, ttl=100, negative_ttl=10, max_size=1)
+
+    def tearDown(self):
+        self.cache.close_connection()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.test_db_name + suffix):
+                os.remove(self.test_db_name + suffix)
+
+    def test_get_and_put(self):
+        self.assertEqual(self.cache.get("LOC", "123"), (False, None))
+
+        self.cache.put("LOC", "123", '{"results": []}')
+        self.cache.put("Harvard", "456", None)
+
+        self.assertEqual(self.cache.get("LOC", "123"), (True, '{"results": []}'))
+        # A cached "nothing found" answer is found, unlike a value that was never asked about
+        self.assertEqual(self.cache.get("Harvard", "456"), (True, None))
+        self.assertEqual(self.cache.get("Harvard", "123"), (False, None))
+
+    def test_expiry(self):
+        self.cache.put("LOC", "123", "body")
+        self.cache.put("LOC", "456", None)
+        self.cache.put("LOC", "789", '{"results": []}', negative=True)
+
+        with mock.patch.object(LMH_response_cache.time, 'time', return_value=LMH_response_cache.time.time() + 50):
+            # Negative answers expire sooner than responses
+            self.assertEqual(self.cache.get("LOC", "123"), (True, "body"))
+            self.assertEqual(self.cache.get("LOC", "456"), (False, None))
+            self.assertEqual(self.cache.get("LOC", "789"), (False, None))
+
+        with mock.patch.object(LMH_response_cache.time, 'time', return_value=LMH_response_cache.time.time() + 200):
+            self.assertEqual(self.cache.get("LOC", "123"), (False, None))
+
+    def test_size_bounded_eviction(self):
+        body = "x" * 100000
+        for number in range(LMH_response_cache.SIZE_CHECK_INTERVAL):
+            self.cache.put("LOC", str(number), body)
+
+        # 100 responses of 100 kB do not fit in 1 MB, so only the newest are kept
+        total = self.cache.connection.execute("SELECT SUM(size) FROM responses").fetchone()[0]
+        self.assertLessEqual(total, 1024 * 1024)
+        self.assertEqual(self.cache.get("LOC", "0"), (False, None))
+        last = str(LMH_response_cache.SIZE_CHECK_INTERVAL - 1)
+        self.assertEqual(self.cache.get("LOC", last), (True, body))
+
+    def test_revalidation(self):
+        self.cache.put("LOC", "123", "body", etag='"abc"')
+        self.cache.put("LOC", "456", "other")
+
+        later = LMH_response_cache.time.time() + 200
+        with mock.patch.object(LMH_response_cache.time, 'time', return_value=later):
+            self.cache.evict()
+            # Expired, but kept to be revalidated since it has an ETag
+            self.assertEqual(self.cache.get("LOC", "123"), (False, None))
+            self.assertEqual(self.cache.get_stale("LOC", "123"), ("body", '"abc"', None))
+            self.assertIsNone(self.cache.get_stale("LOC", "456"))
+
+            self.cache.refresh("LOC", "123")
+            self.assertEqual(self.cache.get("LOC", "123"), (True, "body"))
+
+
+if __name__ == '__main__':
+    unittest.main()
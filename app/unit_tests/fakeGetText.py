@@ -0,0 +1,29 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from app.database import LMH_response_cache
+
+
+class FakeGetText:
+    """
+    Stands in for httpClient.get_text in the batched search tests.
+    Requests without a cache key are batches, answered by answer_batch
+    with their URL. A search for a single value is answered from the
+    response cache like get_text, and by answer_single with its cache
+    key if nothing is held for it.
+    """
+    def __init__(self, answer_batch, answer_single):
+        self.answer_batch = answer_batch
+        self.answer_single = answer_single
+        self.urls = []
+        self.single_searches = []
+
+    async def get_text(self, url, search_timeout, source=None, cache_key=None, found_nothing=None):
+        if cache_key is None:
+            self.urls.append(url)
+            return self.answer_batch(url)
+        found, body = LMH_response_cache.lookup(source, cache_key)
+        if found:
+            return body
+        self.single_searches.append(cache_key)
+        return self.answer_single(cache_key)
@@ -0,0 +1,54 @@
+import unittest
+import json
+import sys
+import os
+import urllib.parse
+from unittest import mock
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from app import config
+from app.apis import googleAPI
+from app.unit_tests.fakeGetText import FakeGetText
+
+
+def volume(isbn, oclc):
+    return {'volumeInfo': {'industryIdentifiers': [{'type': 'ISBN_10', 'identifier': isbn[3:12] + 'X'},
+                                                   {'type': 'ISBN_13', 'identifier': isbn},
+                                                   {'type': 'OTHER', 'identifier': 'OCLC:' + oclc}]}}
+
+
+def search_batch(url):
+    # Google holds a volume for every OCLC number below 50
+    query = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+    held = [term[5:] for term in query['q'][0].split(" OR ") if int(term[5:]) < 50]
+    start = int(query['startIndex'][0])
+    items = [volume(str(9780000000000 + int(oclc)), oclc) for oclc in held]
+    return json.dumps({'totalItems': len(items), 'items': items[start:start + int(query['maxResults'][0])]})
+
+
+class TestGoogleBatch(unittest.TestCase):
+    def setUp(self):
+        self.settings = config.Settings.from_dict({"rate_limits": {}, "response_cache_ttl": 0,
+                                                   "google_api_key": "KEY"})
+        self.fake = FakeGetText(search_batch, lambda cache_key: json.dumps({'totalItems': 0}))
+
+    def test_prefetch(self):
+        oclcs = [str(number) for number in range(40, 60)]
+        retrieval_settings = {'retrieve_isbn': True, 'retrieve_lccn': True}
+
+        with mock.patch.object(config, 'get_settings', return_value=self.settings), \
+                mock.patch.object(googleAPI.httpClient, 'get_text', side_effect=self.fake.get_text):
+            googleAPI.prefetch(oclcs, True, False)
+            entries = [googleAPI.parse_google_data({'oclc': oclc}, oclc, retrieval_settings, True, False)
+                       for oclc in oclcs]
+
+        self.assertEqual(len(self.fake.urls), 1)
+        self.assertEqual(urllib.parse.parse_qs(urllib.parse.urlparse(self.fake.urls[0]).query)['fields'],
+                         [googleAPI.FIELDS])
+        self.assertEqual(entries[5], {'oclc': '45', 'isbn': '9780000000045'})
+        # What the batch found nothing for is not trusted as not found, it is searched for on its own
+        self.assertEqual(entries[15], {'oclc': '55'})
+        self.assertEqual(self.fake.single_searches, ["oclc:" + oclc for oclc in oclcs[10:]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,321 @@
+import unittest
+import asyncio
+import concurrent.futures
+import random
+import threading
+import time
+import sys
+import os
+from unittest import mock
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from app import harvester, config, sourceScheduler
+from app.apis import httpClient, sourceHealth
+from app.database import LMH_journal
+from app.database.LMH_database import Database
+from app.database.LMH_journal import HarvestJournal
+
+
+def fake_search(entry, number, *args, **kwargs):
+    # Finish in a random order so the test would notice results coming back out of order
+    time.sleep(random.uniform(0, 0.01))
+    entry.update({'oclc': 'ocn' + number, 'lccn': 'QA76 ' + number, 'source': 'Fake'})
+    return entry
+
+
+class TestHarvester(unittest.TestCase):
+    def setUp(self):
+        self.test_db_name = 'test_harvester.db'
+        self.test_journal_name = 'test_harvester_journal.db'
+        self.db_manager = Database(self.test_db_name)
+        self.retrieval_settings = {'retrieve_isbn': True, 'retrieve_oclc': True, 'retrieve_lccn': True}
+        self.settings = config.Settings.from_dict({"z3950_sources": {}, "web_scraping_sources": {}})
+        # Code reading the settings itself gets these too, instead of loading or creating config.json
+        self.previous_settings = config.use_settings(self.settings)
+
+    def tearDown(self):
+        config.use_settings(self.previous_settings)
+        for file_name in (self.test_db_name, self.test_journal_name, self.test_journal_name + '-wal',
+                          self.test_journal_name + '-shm'):
+            if os.path.exists(file_name):
+                os.remove(file_name)
+
+    def run_harvest(self, input_data, **kwargs):
+        return list(harvester.harvest(input_data, [], self.retrieval_settings, harvester.new_dont_use_api(),
+                                      self.settings, self.db_manager, True, False, **kwargs))
+
+    def test_results_in_input_order(self):
+        input_data = [str(number) for number in range(50)]
+
+        with mock.patch.object(harvester, 'search_sources', side_effect=fake_search):
+            results = self.run_harvest(input_data, max_workers=4)
+
+        self.assertEqual([index for index, _, _ in results], list(range(50)))
+        self.assertEqual([number for _, number, _ in results], input_data)
+        self.assertEqual(results[7][2]['oclc'], 'ocn7')
+
+        # Every searched entry should also have been stored
+        self.assertEqual(self.db_manager.get_metadata('7', 0), ['7', 'ocn7', [('QA76 7', 'Fake')]])
+
+    def test_complete_database_entries_skip_sources(self):
+        self.db_manager.insert('1', 'ocn1', 'QA76 1', 'Stored', True)
+
+        with mock.patch.object(harvester, 'search_sources', side_effect=fake_search) as search:
+            results = self.run_harvest(['1', '2'], max_workers=2)
+
+        self.assertEqual(search.call_count, 1)
+        self.assertEqual(results[0][2]['source'], 'Stored')
+        self.assertEqual(results[1][2]['source'], 'Fake')
+
+    def test_stop_requested(self):
+        input_data = [str(number) for number in range(100)]
+        yielded = []
+
+        with mock.patch.object(harvester, 'search_sources', side_effect=fake_search):
+            for index, number, entry in harvester.harvest(input_data, [], self.retrieval_settings,
+                                                          harvester.new_dont_use_api(), self.settings,
+                                                          self.db_manager, True, False, max_workers=2,
+                                                          stop_requested=lambda: len(yielded) >= 10):
+                yielded.append(index)
+
+        # Whatever was finished is handed back as an unbroken prefix of the input
+        self.assertLess(len(yielded), 100)
+        self.assertEqual(yielded, list(range(len(yielded))))
+
+    def test_resume_from_journal(self):
+        journal = HarvestJournal(self.test_journal_name)
+        key = harvester.journal_key('input.tsv', ['A', 'B'], self.retrieval_settings, True)
+        journal.start(key)
+        journal.update(0, '0', LMH_journal.DONE, {'isbn': '0', 'oclc': '', 'lccn': '', 'source': ''}, ['A', 'B'])
+        journal.update(1, '1', LMH_journal.IN_FLIGHT, {'isbn': '1', 'oclc': 'ocn1'}, ['A'])
+        journal.close()
+
+        journal = HarvestJournal(self.test_journal_name)
+        self.assertEqual(journal.start(key), 1)
+        with mock.patch.object(harvester, 'search_sources', side_effect=fake_search) as search:
+            results = list(harvester.harvest(['0', '1', '2'], ['A', 'B'], self.retrieval_settings,
+                                             harvester.new_dont_use_api(), self.settings, self.db_manager, True,
+                                             False, max_workers=2, journal=journal))
+
+        # The finished value is not searched again, even though nothing was found for it
+        self.assertEqual([call.args[1] for call in search.call_args_list], ['1', '2'])
+        self.assertEqual(results[0][2]['oclc'], '')
+        # The interrupted value only searches the sources it had not tried yet
+        self.assertEqual(search.call_args_list[0].kwargs['tried_sources'], {'A'})
+        self.assertEqual(search.call_args_list[1].kwargs['tried_sources'], set())
+
+        # A harvest that ran to the end is forgotten, so the next one starts over
+        self.assertEqual(journal.start(key), 0)
+        journal.close()
+
+    def test_journal_records_stopped_harvest(self):
+        journal = HarvestJournal(self.test_journal_name)
+        key = harvester.journal_key('input.tsv', [], self.retrieval_settings, True)
+        journal.start(key)
+        input_data = [str(number) for number in range(100)]
+        yielded = []
+
+        with mock.patch.object(harvester, 'search_sources', side_effect=fake_search):
+            for index, number, entry in harvester.harvest(input_data, [], self.retrieval_settings,
+                                                          harvester.new_dont_use_api(), self.settings,
+                                                          self.db_manager, True, False, max_workers=2,
+                                                          stop_requested=lambda: len(yielded) >= 10,
+                                                          journal=journal):
+                yielded.append(index)
+        journal.close()
+
+        journal = HarvestJournal(self.test_journal_name)
+        self.assertEqual(journal.start(key), len(yielded))
+        state, entry, _ = journal.get(0, '0')
+        self.assertEqual((state, entry['oclc']), (LMH_journal.DONE, 'ocn0'))
+        self.assertEqual(journal.get(99, '99')[0], LMH_journal.PENDING)
+        journal.close()
+
+    def run_with_prefetch(self, input_data, ordered_sources, prefetchers, searches):
+        # Harvests with fake batched and single searches, named by source
+        with mock.patch.object(harvester, 'source_prefetch', side_effect=lambda source, *_: prefetchers.get(source)), \
+                mock.patch.object(harvester, 'source_search', side_effect=lambda source, *_: searches.get(source)):
+            return list(harvester.harvest(input_data, ordered_sources, self.retrieval_settings,
+                                          harvester.new_dont_use_api(), self.settings, self.db_manager, True, False,
+                                          max_workers=4))
+
+    def test_batched_prefetch(self):
+        self.db_manager.insert('3', 'ocn3', 'QA76 3', 'Stored', True)
+        input_data = [str(number) for number in range(120)]
+        batches = {'First': [], 'Second': []}
+        prefetched = {'First': set(), 'Second': set()}
+        finished = set()
+        # The numbers whose search had finished when each batch was started, by source and the batch's numbers
+        started = {}
+        lock = threading.Lock()
+        original_start, original_finish = harvester.PrefetchBatch.start, harvester.PrefetchBatch.finish
+
+        def start(batch, source):
+            with lock:
+                started.setdefault((source.split(" (")[0], frozenset(batch.numbers)), set(finished))
+            return original_start(batch, source)
+
+        def finish(batch, number):
+            original_finish(batch, number)
+            with lock:
+                finished.add(number)
+
+        def fake_prefetch(source):
+            def prefetch(numbers):
+                with lock:
+                    # Numbers whose search had finished are never batched again
+                    already = next(done for (name, batch), done in started.items()
+                                   if name == source and batch >= set(numbers))
+                    self.assertFalse(already & set(numbers))
+                    batches[source].append(numbers)
+                time.sleep(0.05)
+                prefetched[source].update(numbers)
+            return prefetch
+
+        def fake_source_search(source, fills):
+            def search(entry, number, *args):
+                # A number's batch for this source has always been searched before it searches the source
+                self.assertIn(number, prefetched[source])
+                return fake_search(entry, number) if fills(number) else entry
+            return search
+
+        with mock.patch.object(harvester.PrefetchBatch, 'start', start), \
+                mock.patch.object(harvester.PrefetchBatch, 'finish', finish):
+            results = self.run_with_prefetch(
+                input_data, ['First (Z39.50)', 'Second (Z39.50)'],
+                {'First (Z39.50)': fake_prefetch('First'), 'Second (Z39.50)': fake_prefetch('Second')},
+                {'First (Z39.50)': fake_source_search('First', lambda number: int(number) % 2 == 0),
+                 'Second (Z39.50)': fake_source_search('Second', lambda number: True)})
+
+        self.assertEqual([number for _, number, _ in results], input_data)
+        self.assertEqual([len(batch) for batch in batches['First']], [49, 50, 20])
+        self.assertNotIn('3', batches['First'][0])
+        self.assertEqual(len(batches['Second']), 3)
+        self.assertTrue(all(str(number) in prefetched['Second'] for number in range(1, 120, 2) if number != 3))
+
+    def test_prefetch_waits_for_the_source_above(self):
+        # The first source fills in every number, so the batched source below it is never searched
+        batches = []
+        results = self.run_with_prefetch(
+            [str(number) for number in range(60)], ['Top (API)', 'Batched (Z39.50)'],
+            {'Batched (Z39.50)': batches.append},
+            {'Top (API)': fake_search, 'Batched (Z39.50)': fake_search})
+
+        self.assertEqual(len(results), 60)
+        self.assertEqual(batches, [])
+
+    def test_unhealthy_source_is_skipped(self):
+        settings = config.Settings.from_dict({"z3950_sources": {}, "web_scraping_sources": {},
+                                              "circuit_breaker_min_calls": 2})
+        searched = []
+
+        def fake_source_search(source, dont_use_api, settings):
+            return lambda entry, number, *args: searched.append(source) or entry
+
+        sourceHealth.reset()
+        with mock.patch.object(config, 'get_settings', return_value=settings), \
+                mock.patch.object(harvester, 'source_search', side_effect=fake_source_search):
+            for _ in range(2):
+                sourceHealth.record("LOC", False, settings.search_timeout)
+            harvester.search_sources({'isbn': '1'}, '1', ['LOC (API)', 'Harvard (API)'], self.retrieval_settings,
+                                     harvester.new_dont_use_api(), settings, True, False)
+        sourceHealth.reset()
+
+        self.assertEqual(searched, ['Harvard (API)'])
+
+    def test_adaptive_source_order(self):
+        settings = config.Settings.from_dict({"z3950_sources": {}, "web_scraping_sources": {},
+                                              "adaptive_source_order": True, "pinned_sources": ["Pinned"]})
+        searched = []
+
+        def fake_source(source, delay, finds):
+            def search(entry, number, *args):
+                searched.append(source)
+                time.sleep(delay)
+                if finds(number):
+                    entry.update({'oclc': 'ocn' + number, 'lccn': 'QA76 ' + number, 'source': source})
+                return entry
+            return search
+
+        # Fast answers every other value straight away, Slow answers every value but takes longer
+        sources = {'Pinned': fake_source('Pinned', 0, lambda number: False),
+                   'Fast': fake_source('Fast', 0, lambda number: int(number) % 2 == 0),
+                   'Slow': fake_source('Slow', 0.01, lambda number: True)}
+        input_data = [str(number) for number in range(sourceScheduler.MIN_SEARCHES * 2)]
+
+        sourceScheduler.reset()
+        with mock.patch.object(harvester, 'source_search', side_effect=lambda source, *args: sources[source]):
+            list(harvester.harvest(input_data, ['Pinned', 'Fast', 'Slow'], self.retrieval_settings,
+                                   harvester.new_dont_use_api(), settings, self.db_manager, True, False,
+                                   max_workers=1))
+            self.assertEqual(searched[:5], ['Pinned', 'Fast', 'Pinned', 'Fast', 'Slow'])
+
+            # What was learned is read back from the database by the next harvest, which moves Fast ahead of Slow
+            # but leaves Pinned where it is
+            sourceScheduler.reset()
+            searched.clear()
+            list(harvester.harvest(['100'], ['Pinned', 'Slow', 'Fast'], self.retrieval_settings,
+                                   harvester.new_dont_use_api(), settings, self.db_manager, True, False))
+        sourceScheduler.reset()
+
+        self.assertEqual(searched, ['Pinned', 'Fast'])
+
+    def test_race_keeps_priority(self):
+        settings = config.Settings.from_dict({"z3950_sources": {}, "web_scraping_sources": {}, "race_sources": 2})
+        searched = []
+
+        def fake_source(source, delay, lccn, oclc):
+            def search(entry, number, *args):
+                searched.append(source)
+                time.sleep(delay)
+                if lccn and not entry.get('lccn'):
+                    entry.update({'lccn': lccn, 'source': source})
+                if oclc and not entry.get('oclc'):
+                    entry.update({'oclc': oclc})
+                return entry
+            return search
+
+        cancelled = threading.Event()
+
+        def slow_request(entry, number, *args):
+            searched.append('C')
+            try:
+                # Stands in for a request that would hang until it timed out
+                return httpClient.run(asyncio.sleep(30))
+            except concurrent.futures.CancelledError:
+                cancelled.set()
+                raise
+
+        sources = {'A': fake_source('A', 0.2, 'QA76 A', ''), 'B': fake_source('B', 0, 'QA76 B', 'ocnB'),
+                   'C': slow_request, 'D': fake_source('D', 0.1, 'QA76 D', 'ocnD')}
+        tried = []
+
+        with mock.patch.object(harvester, 'source_search', side_effect=lambda source, *args: sources[source]):
+            entry = harvester.search_sources({'isbn': '1'}, '1', ['A', 'B', 'C', 'D'], self.retrieval_settings,
+                                             harvester.new_dont_use_api(), settings, True, False,
+                                             source_done=lambda source, entry: tried.append(source))
+
+            # B answered first, but A's call number wins because A comes first
+            self.assertEqual(entry, {'isbn': '1', 'lccn': 'QA76 A', 'source': 'A', 'oclc': 'ocnB'})
+            self.assertEqual(tried, ['A', 'B'])
+            self.assertNotIn('C', searched)
+
+            start = time.monotonic()
+            entry = harvester.search_sources({'isbn': '2'}, '2', ['D', 'C'], self.retrieval_settings,
+                                             harvester.new_dont_use_api(), settings, True, False)
+
+        # D completes the entry, so the lower priority request to C is cancelled instead of waited for
+        self.assertEqual(entry['lccn'], 'QA76 D')
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertTrue(cancelled.wait(5))
+
+    def test_race_executor_replaced_while_in_use(self):
+        executor = harvester._get_race_executor(2)
+        # A harvest with more threads gets a bigger executor while a search still holds the old one
+        bigger = harvester._get_race_executor(harvester._race_threads + 1)
+
+        self.assertIsNot(bigger, executor)
+        self.assertEqual(executor.submit(lambda: "answer").result(5), "answer")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+import socket
+import sys
+import os
+import time
+from unittest import mock
+from aiohttp import web
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from app import config
+from app.apis import httpClient
+from app.database import LMH_response_cache
+
+
+class TestConditionalRequests(unittest.TestCase):
+    def setUp(self):
+        self.test_db_name = 'test_http_cache.db'
+        self.settings = config.Settings.from_dict({"rate_limits": {}, "response_cache_file": self.test_db_name,
+                                                   "response_cache_ttl": 100})
+        self.full_responses = 0
+        self.not_modified = 0
+
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        app = web.Application()
+        app.router.add_get('/record', self.record)
+        self.runner = web.AppRunner(app)
+        httpClient.run(self.runner.setup())
+        httpClient.run(web.TCPSite(self.runner, "127.0.0.1", self.port).start())
+
+    def tearDown(self):
+        httpClient.run(self.runner.cleanup())
+        for key in [key for key in LMH_response_cache._caches if key[0] == self.test_db_name]:
+            LMH_response_cache._caches.pop(key).close_connection()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.test_db_name + suffix):
+                os.remove(self.test_db_name + suffix)
+
+    async def record(self, request):
+        if request.headers.get('If-None-Match') == '"v1"':
+            self.not_modified += 1
+            return web.Response(status=304)
+        self.full_responses += 1
+        return web.Response(text='{"results": []}', headers={'ETag': '"v1"'})
+
+    def test_expired_response_is_revalidated(self):
+        url = f"http://127.0.0.1:{self.port}/record"
+        with mock.patch.object(config, 'get_settings', return_value=self.settings):
+            first = httpClient.run(httpClient.get_text(url, 5, "Test", "123"))
+            httpClient.run(httpClient.get_text(url, 5, "Test", "123"))
+            with mock.patch.object(LMH_response_cache.time, 'time', return_value=time.time() + 200):
+                # Past the ttl the body is only sent again if it changed
+                second = httpClient.run(httpClient.get_text(url, 5, "Test", "123"))
+                third = httpClient.run(httpClient.get_text(url, 5, "Test", "123"))
+
+        self.assertEqual(first, '{"results": []}')
+        self.assertEqual(second, first)
+        self.assertEqual(third, first)
+        self.assertEqual((self.full_responses, self.not_modified), (1, 1))
+
+    def test_empty_answer_uses_negative_ttl(self):
+        url = f"http://127.0.0.1:{self.port}/record"
+        settings = config.Settings.from_dict({"rate_limits": {}, "response_cache_file": self.test_db_name,
+                                              "response_cache_ttl": 100, "response_cache_negative_ttl": 10})
+        with mock.patch.object(config, 'get_settings', return_value=settings):
+            # A 200 with an empty result list found nothing, like a 404
+            httpClient.run(httpClient.get_text(url, 5, "Test", "123", lambda body: body == '{"results": []}'))
+            httpClient.run(httpClient.get_text(url, 5, "Test", "456"))
+            with mock.patch.object(LMH_response_cache.time, 'time', return_value=time.time() + 50):
+                self.assertEqual(LMH_response_cache.lookup("Test", "123"), (False, None))
+                self.assertEqual(LMH_response_cache.lookup("Test", "456"), (True, '{"results": []}'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from app import isbnNormalization
+
+
+class TestIsbnNormalization(unittest.TestCase):
+    def test_normalize_isbn(self):
+        self.assertEqual(isbnNormalization.normalize_isbn("0-19-284384-5 (pbk.)"), "0192843845")
+        self.assertEqual(isbnNormalization.normalize_isbn("080442957x"), "080442957X")
+        self.assertEqual(isbnNormalization.normalize_isbn("no isbn"), "")
+
+    def test_isbn_forms(self):
+        self.assertEqual(isbnNormalization.isbn_forms("0192843845"), {"0192843845", "9780192843845"})
+        self.assertEqual(isbnNormalization.isbn_forms("978-0-8044-2957-3"), {"9780804429573", "080442957X"})
+        # ISBNs starting with 979 have no ISBN-10 form
+        self.assertEqual(isbnNormalization.isbn_forms("9791032305690"), {"9791032305690"})
+
+    def test_isbn13(self):
+        self.assertEqual(isbnNormalization.isbn13("0-19-284384-5"), "9780192843845")
+        self.assertEqual(isbnNormalization.isbn13("9780192843845"), "9780192843845")
+
+    def test_is_valid_isbn(self):
+        self.assertTrue(isbnNormalization.is_valid_isbn("0-19-852663-6"))
+        self.assertTrue(isbnNormalization.is_valid_isbn("080442957x"))
+        self.assertTrue(isbnNormalization.is_valid_isbn("9780192843845"))
+        self.assertFalse(isbnNormalization.is_valid_isbn("9780192843846"))
+        # A 10-digit OCLC number that fails the ISBN-10 check
+        self.assertFalse(isbnNormalization.is_valid_isbn("1000000000"))
+        self.assertFalse(isbnNormalization.is_valid_isbn("12345"))
+
+    def test_normalize_oclc(self):
+        self.assertEqual(isbnNormalization.normalize_oclc("(OCoLC)ocm00012345"), "12345")
+
+
+if __name__ == '__main__':
+    unittest.main()
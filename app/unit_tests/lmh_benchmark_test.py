@@ -0,0 +1,52 @@
+import unittest
+import json
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from app import config
+from app.benchmark import mockCatalogue
+import lmh_benchmark
+
+
+class TestBenchmark(unittest.TestCase):
+    def setUp(self):
+        self.results_file = 'test_benchmark_results.json'
+
+    def tearDown(self):
+        if os.path.exists(self.results_file):
+            os.remove(self.results_file)
+
+    def test_tiny_samples(self):
+        samples = os.path.join(lmh_benchmark.REPO_ROOT, "app", "test_data", "tiny_sample_*")
+        # Look at the current snapshot without loading config.json
+        before = config.use_settings(None)
+        config.use_settings(before)
+
+        # Every stand-in holds every book, so the first source searched fills in each value
+        result = lmh_benchmark.main(["--samples", samples, "--coverage", "1", "--json", self.results_file])
+
+        self.assertEqual(result, 0)
+        with open(self.results_file) as file:
+            results = json.load(file)
+        self.assertEqual(sorted(result['sample'] for result in results),
+                         ["tiny_sample_isbns.txt", "tiny_sample_ocns.txt"])
+        for result in results:
+            self.assertEqual(result['filled'], result['values'])
+            self.assertGreater(result['ids_per_second'], 0)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+        # The settings in use before the benchmark are put back
+        self.assertIs(config.use_settings(before), before)
+
+    def test_records_agree_between_sources(self):
+        record = mockCatalogue.book("9780192843845", False)
+        self.assertEqual(mockCatalogue.book("9780192843845", False), record)
+        self.assertEqual(record['isbn'], "9780192843845")
+        self.assertRegex(record['lccn'], r'^[A-Z]{1,2}\d+\.\d+ B\d+ \d{4}$')
+        self.assertEqual(len(mockCatalogue.book("53866884", True)['isbn']), 13)
+
+    def test_unknown_source_latency(self):
+        self.assertEqual(lmh_benchmark.main(["--source-latency", "worldcat=1"]), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
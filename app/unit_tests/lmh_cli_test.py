@@ -0,0 +1,73 @@
+import unittest
+import io
+import sys
+import os
+from unittest import mock
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from app import harvester, config
+import lmh_cli
+
+
+def fake_search(entry, number, *args, **kwargs):
+    entry.update({'oclc': 'ocn' + number, 'lccn': 'QA76 ' + number, 'source': 'Fake'})
+    return entry
+
+
+class TestCommandLine(unittest.TestCase):
+    def setUp(self):
+        self.test_db_name = 'test_cli.db'
+        self.test_journal_name = 'test_cli_journal.db'
+        self.input_file = 'test_cli_input.tsv'
+        self.output_file = 'test_cli_output.tsv'
+        self.settings = config.Settings.from_dict({"z3950_sources": {"Yale": "z3950.library.yale.edu:7090/voyager"},
+                                                   "web_scraping_sources": {}, "response_cache_ttl": 0})
+
+    def tearDown(self):
+        for file_name in (self.test_db_name, self.test_journal_name, self.test_journal_name + '-wal',
+                          self.test_journal_name + '-shm', self.input_file, self.output_file):
+            if os.path.exists(file_name):
+                os.remove(file_name)
+
+    def test_read_input_values(self):
+        values = lmh_cli.read_input_values(io.StringIO("9780192843845\textra\n\n 0000000000 \n"))
+        self.assertEqual(list(values), ["9780192843845", "0000000000"])
+
+    def test_guess_input_type(self):
+        self.assertEqual(lmh_cli.guess_input_type("9780192843845"), "isbn")
+        self.assertEqual(lmh_cli.guess_input_type("0-19-852663-6"), "isbn")
+        self.assertEqual(lmh_cli.guess_input_type("080442957X"), "isbn")
+        # Ten digit OCLC numbers were taken for ISBNs by their length
+        self.assertEqual(lmh_cli.guess_input_type("1000000000"), "oclc")
+        self.assertEqual(lmh_cli.guess_input_type("12345"), "oclc")
+        self.assertIsNone(lmh_cli.guess_input_type("0198526636"))
+
+    def test_resolve_sources(self):
+        self.assertEqual(lmh_cli.resolve_sources("loc,Yale,harvard", "2,3,1", self.settings),
+                         ["Harvard (API)", "LOC (API)", "Yale (Z39.50)"])
+        self.assertEqual(lmh_cli.resolve_sources(None, None, self.settings),
+                         lmh_cli.DEFAULT_SOURCES + ["Yale (Z39.50)"])
+        with self.assertRaises(ValueError):
+            lmh_cli.resolve_sources("nowhere", None, self.settings)
+
+    def test_streaming_harvest(self):
+        with open(self.input_file, 'w') as file:
+            file.write("\n".join(str(number) for number in range(1000000000, 1000000020)))
+
+        with mock.patch.object(harvester, 'DATABASE_NAME', self.test_db_name), \
+                mock.patch.object(harvester, 'JOURNAL_NAME', self.test_journal_name), \
+                mock.patch.object(config, 'get_settings', return_value=self.settings), \
+                mock.patch.object(harvester, 'search_sources', side_effect=fake_search), \
+                mock.patch.object(lmh_cli, 'check_sources', side_effect=lambda dont_use_api, *args: dont_use_api):
+            result = lmh_cli.main(["-i", self.input_file, "-o", self.output_file, "--input-type", "isbn",
+                                   "--search-sources", "loc", "--workers", "4"])
+
+        self.assertEqual(result, 0)
+        with open(self.output_file, 'r', encoding='utf-8') as file:
+            rows = [line.rstrip("\n").split("\t") for line in file]
+        self.assertEqual(rows[0], lmh_cli.HEADER)
+        self.assertEqual(len(rows), 21)
+        self.assertEqual(rows[1], ["1000000000", "ocn1000000000", "QA76 1000000000", "Fake"])
+
+
+if __name__ == '__main__':
+    unittest.main()
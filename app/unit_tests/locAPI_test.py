@@ -0,0 +1,55 @@
+import unittest
+import json
+import sys
+import os
+import urllib.parse
+from unittest import mock
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from app import config
+from app.apis import locAPI
+from app.unit_tests.fakeGetText import FakeGetText
+
+
+def loc_result(isbn, oclc):
+    return {'isbn': [isbn + " (pbk.)"], 'number_oclc': [oclc], 'item': {'call_number': ["QA76.73 .P98 " + oclc]}}
+
+
+def search_batch(url):
+    # LOC holds a record for every even ISBN, two results to a page
+    query = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+    held = [isbn for isbn in query['q'][0].split(" OR ") if int(isbn) % 2 == 0]
+    page = int(query['sp'][0])
+    results = [loc_result(isbn, isbn[-6:]) for isbn in held[(page - 1) * 2:page * 2]]
+    return json.dumps({'results': results, 'pagination': {'next': "next" if page * 2 < len(held) else None}})
+
+
+class TestLocBatch(unittest.TestCase):
+    def setUp(self):
+        self.settings = config.Settings.from_dict({"rate_limits": {}, "response_cache_ttl": 0})
+        self.fake = FakeGetText(search_batch, lambda cache_key: json.dumps({'results': []}))
+
+    def test_prefetch(self):
+        isbns = [str(9780000000000 + number) for number in range(8)]
+        retrieval_settings = {'retrieve_oclc': True, 'retrieve_lccn': True}
+
+        with mock.patch.object(config, 'get_settings', return_value=self.settings), \
+                mock.patch.object(locAPI.httpClient, 'get_text', side_effect=self.fake.get_text):
+            locAPI.prefetch(isbns, False)
+            entries = [locAPI.parse_loc_data({'isbn': isbn}, isbn, retrieval_settings, False) for isbn in isbns]
+
+        # One search for the batch, read over its two pages
+        self.assertEqual(len(self.fake.urls), 2)
+        self.assertEqual(entries[6], {'isbn': isbns[6], 'oclc': '000006', 'lccn': 'QA76.73 .P98 000006',
+                                      'source': 'LOC'})
+        # The odd ISBNs had no results in the batch, so parse_loc_data searched for each of them
+        self.assertEqual(entries[1], {'isbn': isbns[1]})
+        self.assertEqual(self.fake.single_searches, isbns[1::2])
+
+    def test_result_numbers(self):
+        self.assertEqual(locAPI.result_numbers(loc_result("0192843845", "ocm00012345"), True), {"12345"})
+        self.assertEqual(locAPI.result_numbers(loc_result("0192843845", "12345"), False),
+                         {"9780192843845"})
+
+
+if __name__ == '__main__':
+    unittest.main()
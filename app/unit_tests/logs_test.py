@@ -0,0 +1,70 @@
+import unittest
+import logging
+import tempfile
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from app.logs import LogWriter
+
+
+class TestLogWriter(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_name = os.path.join(self.directory.name, "test_log.log")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read_lines(self, file_name=None):
+        with open(file_name or self.file_name, 'r', encoding='utf-8') as file:
+            return file.read().splitlines()
+
+    def test_writes_messages_at_or_above_level(self):
+        writer = LogWriter(self.file_name, level=logging.INFO)
+        writer.put(logging.DEBUG, "Not written")
+        writer.put(logging.INFO, "First")
+        writer.put(logging.WARNING, "Second")
+        writer.close()
+
+        lines = self.read_lines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].endswith(" - INFO - First"))
+        self.assertTrue(lines[1].endswith(" - WARNING - Second"))
+
+    def test_repeated_errors_are_coalesced(self):
+        writer = LogWriter(self.file_name)
+        for _ in range(5):
+            writer.put(logging.ERROR, "Error while searching LOC")
+            writer.put(logging.INFO, "Searching")
+        writer.flush()
+
+        lines = self.read_lines()
+        self.assertEqual(sum(line.endswith("Searching") for line in lines), 5)
+        errors = [line for line in lines if "Error while searching LOC" in line]
+        self.assertEqual(len(errors), 2)
+        self.assertIn("(repeated 4 more times", errors[1])
+
+        # Once the repeats have been written the error is written again the next time it happens
+        writer.put(logging.ERROR, "Error while searching LOC")
+        writer.close()
+        self.assertTrue(self.read_lines()[-1].endswith(" - ERROR - Error while searching LOC"))
+
+    def test_rotates_by_size(self):
+        writer = LogWriter(self.file_name, max_bytes=200, backup_count=2)
+        for number in range(20):
+            writer.put(logging.INFO, f"Message {number:02d} " + "x" * 40)
+            # One record per batch so every write is checked against the size
+            writer.flush()
+        writer.close()
+
+        self.assertTrue(os.path.exists(self.file_name + ".1"))
+        self.assertTrue(os.path.exists(self.file_name + ".2"))
+        self.assertFalse(os.path.exists(self.file_name + ".3"))
+        for file_name in (self.file_name, self.file_name + ".1", self.file_name + ".2"):
+            self.assertLessEqual(os.path.getsize(file_name), 200)
+        self.assertIn("Message 19", self.read_lines()[-1])
+        self.assertIn("Message 17", self.read_lines(self.file_name + ".1")[-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
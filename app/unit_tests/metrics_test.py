@@ -0,0 +1,93 @@
+import unittest
+import json
+import tempfile
+import sys
+import os
+from unittest import mock
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from app import config, harvester, metrics
+from app.apis import httpClient
+from app.database.LMH_database import Database
+from app.metrics import Metrics
+
+
+async def fake_request():
+    # Stands in for a request made on the shared loop, which records into the number the caller searches for
+    metrics.record("http", "Fake", 0.02)
+    return "answer"
+
+
+def fake_search(entry, number, *args, **kwargs):
+    httpClient.run(fake_request())
+    entry.update({'oclc': 'ocn' + number, 'lccn': 'QA76 ' + number, 'source': 'Fake'})
+    return entry
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        # Code reading the settings itself gets these, instead of loading or creating config.json
+        self.previous_settings = config.use_settings(config.Settings.from_dict({"response_cache_ttl": 0}))
+
+    def tearDown(self):
+        config.use_settings(self.previous_settings)
+
+    def test_summary_and_prometheus(self):
+        recorded = Metrics()
+        recorded.record("http", "LOC", 0.2)
+        recorded.record("http", "LOC", 0.004)
+        recorded.record("json_parse", "LOC", 0.001)
+        recorded.count("requests", "LOC", 2)
+
+        summary = recorded.summary()
+        lines = summary.splitlines()
+        # The stage that took longest in total comes first
+        self.assertTrue(lines[2].startswith("http"))
+        self.assertTrue(lines[3].startswith("json_parse"))
+        self.assertIn("requests", lines[4])
+
+        exposition = recorded.prometheus()
+        self.assertIn('lmh_stage_seconds_bucket{stage="http",source="LOC",le="0.005"} 1', exposition)
+        self.assertIn('lmh_stage_seconds_bucket{stage="http",source="LOC",le="0.25"} 2', exposition)
+        self.assertIn('lmh_stage_seconds_bucket{stage="http",source="LOC",le="+Inf"} 2', exposition)
+        self.assertIn('lmh_stage_seconds_count{stage="http",source="LOC"} 2', exposition)
+        self.assertIn('lmh_events_total{event="requests",source="LOC"} 2', exposition)
+
+    def test_harvest_writes_traces_and_prometheus_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            jsonl_file = os.path.join(directory, "metrics.jsonl")
+            prometheus_file = os.path.join(directory, "metrics.prom")
+            settings = config.Settings.from_dict({"z3950_sources": {}, "web_scraping_sources": {},
+                                                  "metrics_jsonl_file": jsonl_file,
+                                                  "metrics_prometheus_file": prometheus_file})
+            db_manager = Database(os.path.join(directory, "metrics_test.db"))
+            db_manager.insert('1', 'ocn1', 'QA76 1', 'Stored', True)
+            retrieval_settings = {'retrieve_isbn': True, 'retrieve_oclc': True, 'retrieve_lccn': True}
+
+            try:
+                with mock.patch.object(harvester, 'search_sources', side_effect=fake_search):
+                    results = list(harvester.harvest(['1', '2', '3'], [], retrieval_settings,
+                                                     harvester.new_dont_use_api(), settings, db_manager, True, False,
+                                                     max_workers=2))
+            finally:
+                db_manager.close()
+
+            self.assertEqual(len(results), 3)
+            with open(jsonl_file, 'r', encoding='utf-8') as file:
+                lines = [json.loads(line) for line in file]
+            traces = {line['number']: line['seconds'] for line in lines if 'number' in line}
+            # The database answered 1, the others carry the time of the request made on the loop
+            self.assertEqual(traces['1'], {})
+            self.assertAlmostEqual(traces['2']['http:Fake'], 0.02)
+            self.assertAlmostEqual(traces['3']['http:Fake'], 0.02)
+            stages = {(stage['stage'], stage['source']): stage for stage in lines[-1]['summary']['stages']}
+            self.assertEqual(stages[('http', 'Fake')]['count'], 2)
+            self.assertEqual(stages[('db_write', 'database')]['count'], 2)
+
+            with open(prometheus_file, 'r', encoding='utf-8') as file:
+                exposition = file.read()
+            self.assertIn('lmh_stage_seconds_count{stage="http",source="Fake"} 2', exposition)
+            self.assertIn('lmh_events_total{event="answered",source="database"} 1', exposition)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+import json
+import sys
+import os
+from unittest import mock
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from app import config
+from app.apis import openLibraryAPI
+from app.unit_tests.fakeGetText import FakeGetText
+
+BOOK = {"identifiers": {"oclc": ["40798536"]}, "classifications": {"lc_classifications": ["PR4034 .P7 1999"]}}
+
+
+def search_batch(url):
+    # Only the first ISBN of every batch is known to Open Library
+    first = url.split("bibkeys=")[1].split(",")[0]
+    return json.dumps({first: BOOK})
+
+
+def search_alone(cache_key):
+    # Every number is answered by its batch, including the {} for those Open Library does not know
+    raise AssertionError("Searched for " + cache_key + " on its own")
+
+
+class TestOpenLibraryBatch(unittest.TestCase):
+    def setUp(self):
+        self.settings = config.Settings.from_dict({"rate_limits": {}, "response_cache_ttl": 0})
+        self.fake = FakeGetText(search_batch, search_alone)
+
+    def test_prefetch(self):
+        isbns = [str(9780000000000 + number) for number in range(60)]
+        retrieval_settings = {'retrieve_oclc': True, 'retrieve_lccn': True}
+
+        with mock.patch.object(config, 'get_settings', return_value=self.settings), \
+                mock.patch.object(openLibraryAPI.httpClient, 'get_text', side_effect=self.fake.get_text):
+            openLibraryAPI.prefetch(isbns, False, True)
+            entries = [openLibraryAPI.parse_open_library_data({'isbn': isbn}, isbn, retrieval_settings, False, True)
+                       for isbn in isbns]
+
+        self.assertEqual(len(self.fake.urls), 2)
+        self.assertIn("bibkeys=ISBN:9780000000000,ISBN:9780000000001,", self.fake.urls[0])
+        self.assertEqual(entries[0], {'isbn': isbns[0], 'oclc': '40798536', 'lccn': 'PR4034 .P7 1999',
+                                      'source': 'OpenLibrary'})
+        self.assertEqual(entries[50]['oclc'], '40798536')
+        self.assertEqual(entries[1], {'isbn': isbns[1]})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+import threading
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from app import progressBus
+from app.progressBus import ProgressBus
+
+
+class TestProgressBus(unittest.TestCase):
+    def test_counts_rate_and_eta(self):
+        bus = ProgressBus()
+        bus.start(100)
+        bus.log("Assuming list contains ISBN values.")
+        self.assertEqual(bus.drain(now=0.0), [("start", 100), ("log", "Assuming list contains ISBN values.")])
+
+        for source in ["LOC", "LOC", "Harvard", ""]:
+            bus.advance(source)
+        self.assertEqual(bus.drain(now=2.0), [])
+
+        self.assertEqual(bus.done, 4)
+        self.assertEqual(bus.hits, {"LOC": 2, "Harvard": 1, progressBus.NOT_FOUND: 1})
+        self.assertEqual(bus.rate(), 2.0)
+        self.assertEqual(bus.eta(), 48.0)
+        self.assertEqual(bus.describe(), ("4 of 100 values, 2.0 per second, ETA 0:48",
+                                          "LOC: 2, Harvard: 1, Not found: 1"))
+
+    def test_rate_only_follows_the_last_seconds(self):
+        bus = ProgressBus()
+        bus.start(1000)
+        bus.drain(now=0.0)
+        for second in range(1, 31):
+            # Slow at first, then ten values a second
+            for _ in range(1 if second <= 15 else 10):
+                bus.advance("LOC")
+            bus.drain(now=float(second))
+
+        self.assertEqual(bus.rate(), 10.0)
+
+    def test_ask_waits_for_the_answer(self):
+        bus = ProgressBus()
+        answers = []
+        thread = threading.Thread(target=lambda: answers.append(bus.ask(title="Warning", option_1="Yes")))
+        thread.start()
+
+        event = None
+        while event is None:
+            actions = bus.drain()
+            event = actions[0] if actions else None
+        self.assertEqual(event[:2], ("ask", {"title": "Warning", "option_1": "Yes"}))
+        event[2].set_result("Yes")
+        thread.join(5)
+
+        self.assertEqual(answers, ["Yes"])
+
+    def test_publishing_from_many_threads(self):
+        bus = ProgressBus()
+        bus.start(8000)
+
+        def publish():
+            for _ in range(1000):
+                bus.advance("Open Library")
+
+        threads = [threading.Thread(target=publish) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        while any(thread.is_alive() for thread in threads):
+            bus.drain()
+        bus.drain()
+
+        self.assertEqual(bus.done, 8000)
+        self.assertEqual(bus.hits, {"Open Library": 8000})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+import asyncio
+import threading
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from app import config
+from app.apis import rateLimiter
+
+
+class TestRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.test_db_name = 'test_rate_limits.db'
+
+    def tearDown(self):
+        connections = getattr(rateLimiter._local, "connections", {})
+        connection = connections.pop(self.test_db_name, None)
+        if connection:
+            connection.close()
+        if os.path.exists(self.test_db_name):
+            os.remove(self.test_db_name)
+
+    def test_burst_then_rate(self):
+        bucket = rateLimiter.TokenBucket(rate=2, burst=3)
+        waits = [bucket.reserve() for _ in range(5)]
+
+        # The burst goes straight through, after that requests are spaced 1/rate apart
+        self.assertEqual(waits[:3], [0, 0, 0])
+        self.assertAlmostEqual(waits[3], 0.5, places=2)
+        self.assertAlmostEqual(waits[4], 1.0, places=2)
+
+    def test_pause(self):
+        bucket = rateLimiter.TokenBucket(rate=2, burst=3)
+        bucket.pause(10)
+        self.assertGreaterEqual(bucket.reserve(), 10)
+
+    def test_shared_bucket(self):
+        # Two buckets on the same file act like one, as two processes would
+        first = rateLimiter.SharedTokenBucket(self.test_db_name, "LOC", rate=1, burst=2)
+        second = rateLimiter.SharedTokenBucket(self.test_db_name, "LOC", rate=1, burst=2)
+
+        self.assertEqual(first.reserve(), 0)
+        self.assertEqual(second.reserve(), 0)
+        self.assertAlmostEqual(first.reserve(), 1, places=1)
+
+        second.pause(30)
+        self.assertGreaterEqual(first.reserve(), 30)
+
+    def test_shared_bucket_is_used_off_the_loop(self):
+        settings = config.Settings.from_dict({"rate_limits": {"LOC": {"rate": 1, "burst": 2}},
+                                              "rate_limit_file": self.test_db_name})
+        previous = config.use_settings(settings)
+        threads = []
+        original_update = rateLimiter.SharedTokenBucket.update
+
+        def update(bucket, change):
+            threads.append(threading.current_thread())
+            return original_update(bucket, change)
+
+        async def acquire_and_pause():
+            await rateLimiter.acquire_async("LOC")
+            self.assertTrue(await rateLimiter.pause_async("LOC", 1))
+            return threading.current_thread()
+
+        try:
+            rateLimiter.SharedTokenBucket.update = update
+            loop_thread = asyncio.run(acquire_and_pause())
+        finally:
+            rateLimiter.SharedTokenBucket.update = original_update
+            config.use_settings(previous)
+            rateLimiter._buckets.clear()
+
+        # Both SQLite transactions ran on executor threads, not on the loop
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(loop_thread, threads)
+
+    def test_retry_after_seconds(self):
+        self.assertEqual(rateLimiter.retry_after_seconds("7", 0), 7)
+        self.assertEqual(rateLimiter.retry_after_seconds(None, 2), rateLimiter.DEFAULT_BACKOFF * 4)
+        self.assertEqual(rateLimiter.retry_after_seconds("Wed, 21 Oct 2015 07:28:00 GMT", 0), 0)
+        self.assertEqual(rateLimiter.retry_after_seconds("100000", 0), rateLimiter.MAX_BACKOFF)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+import time
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from app.apis import sourceHealth
+from app.apis.sourceHealth import SourceHealth
+
+
+class TestSourceHealth(unittest.TestCase):
+    def test_breaker_opens_and_recovers(self):
+        health = SourceHealth("Test", failure_rate=0.5, min_calls=4, open_seconds=0.05)
+        for ok in (True, False, True):
+            health.record(ok, 0.1)
+        self.assertTrue(health.allow())
+
+        # Two failures in four calls reach the failure rate
+        health.record(False, 10)
+        self.assertEqual(health.stats()['state'], sourceHealth.OPEN)
+        self.assertFalse(health.allow())
+
+        time.sleep(0.06)
+        # Only one trial request is let through once the source has been left alone long enough
+        self.assertTrue(health.allow())
+        self.assertFalse(health.allow())
+        health.record(True, 0.1)
+        self.assertEqual(health.stats()['state'], sourceHealth.CLOSED)
+        self.assertTrue(health.allow())
+
+    def test_failed_trial_backs_off(self):
+        health = SourceHealth("Test", failure_rate=0.5, min_calls=1, open_seconds=0.05)
+        health.record(False, 10)
+        time.sleep(0.06)
+        self.assertTrue(health.allow())
+        health.record(False, 10)
+
+        # Left alone twice as long after the trial request failed
+        time.sleep(0.06)
+        self.assertFalse(health.allow())
+        time.sleep(0.05)
+        self.assertTrue(health.allow())
+
+    def test_stats(self):
+        health = SourceHealth("Test", min_calls=0)
+        for latency in range(1, 21):
+            health.record(latency != 20, latency / 10)
+
+        stats = health.stats()
+        self.assertEqual(stats['calls'], 20)
+        self.assertEqual(stats['error_rate'], 0.05)
+        self.assertEqual(stats['p50'], 1.1)
+        self.assertEqual(stats['p95'], 2.0)
+        # A min_calls of 0 never opens the breaker
+        self.assertEqual(stats['state'], sourceHealth.CLOSED)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from app import sourceScheduler
+from app.sourceScheduler import SourceScheduler
+
+
+def record_searches(scheduler, source, latency, hit_every, count=sourceScheduler.MIN_SEARCHES, field='lccn'):
+    for search in range(count):
+        filled = [field] if search % hit_every == 0 else []
+        scheduler.record(source, 'isbn', latency, ['oclc', 'lccn'], filled)
+
+
+class TestSourceScheduler(unittest.TestCase):
+    def test_orders_by_expected_time_to_fill(self):
+        scheduler = SourceScheduler()
+        # A answers slowly but always, B quickly but only every fourth time, C quickly and always
+        record_searches(scheduler, 'A', 1.0, 1)
+        record_searches(scheduler, 'B', 0.1, 4)
+        record_searches(scheduler, 'C', 0.2, 1)
+        sources = [(name, None) for name in ('A', 'B', 'C')]
+
+        ordered = scheduler.order(sources, 'isbn', ['lccn'])
+
+        self.assertEqual([source for source, _ in ordered], ['C', 'B', 'A'])
+        # Nothing has been learned about OCN input, so the order given is kept
+        self.assertEqual(scheduler.order(sources, 'ocn', ['lccn']), sources)
+
+    def test_pinned_and_new_sources_keep_their_place(self):
+        scheduler = SourceScheduler()
+        record_searches(scheduler, 'A', 1.0, 1)
+        record_searches(scheduler, 'B', 0.5, 1)
+        record_searches(scheduler, 'C', 0.1, 1)
+        record_searches(scheduler, 'D', 0.1, 1, count=sourceScheduler.MIN_SEARCHES - 1)
+        sources = [(name, None) for name in ('A', 'B', 'D', 'C')]
+
+        ordered = scheduler.order(sources, 'isbn', ['lccn'], pinned=('A',))
+
+        self.assertEqual([source for source, _ in ordered], ['A', 'C', 'D', 'B'])
+
+    def test_source_that_never_fills_a_field_goes_last(self):
+        scheduler = SourceScheduler()
+        record_searches(scheduler, 'A', 0.01, 1)
+        record_searches(scheduler, 'B', 1.0, 1, field='oclc')
+        sources = [(name, None) for name in ('A', 'B')]
+
+        # A only ever filled in call numbers and B only OCNs
+        self.assertEqual([source for source, _ in scheduler.order(sources, 'isbn', ['oclc'])], ['B', 'A'])
+        self.assertEqual([source for source, _ in scheduler.order(sources, 'isbn', ['lccn'])], ['A', 'B'])
+
+    def test_counts_are_halved(self):
+        scheduler = SourceScheduler()
+        record_searches(scheduler, 'A', 0.1, 2, count=sourceScheduler.MAX_SEARCHES + 1)
+
+        source, id_type, searches, tries, hits, latencies = scheduler.rows()[0]
+        self.assertEqual(searches, (sourceScheduler.MAX_SEARCHES + 1) // 2)
+        self.assertEqual(tries['lccn'], (sourceScheduler.MAX_SEARCHES + 1) // 2)
+        self.assertEqual(hits['lccn'], (sourceScheduler.MAX_SEARCHES // 2 + 1) // 2)
+        self.assertEqual(len(latencies), sourceScheduler.LATENCY_SAMPLES)
+
+    def test_rows_round_trip(self):
+        scheduler = SourceScheduler()
+        record_searches(scheduler, 'A', 0.3, 2)
+        copy = SourceScheduler()
+        copy.load(scheduler.rows())
+
+        self.assertEqual(copy.rows(), scheduler.rows())
+        self.assertEqual(copy.expected_cost('A', 'isbn', ['lccn']), (0.6, 0.3))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import unittest
+import shutil
+import sys
+import os
+import threading
+import time
+from unittest import mock
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from app import config, harvester
+from app.apis import webScraper, sourceHealth
+
+SEARCH_PAGE = '<a href="/catalog/B123">One</a> <a href="/catalog/B456">Two</a> <a href="/catalog/B123">One</a>'
+DOCUMENT_PAGES = {
+    "B123": '<span class="sub_code">a|</span> QA76.73 <span class="sub_code">b|</span> P98 2003 < (OCoLC)ocm00012345',
+    "B456": '<dt class="blacklight-oclc_number"> OCLC Number: </dt> 678'
+}
+
+
+def fake_get(url, **kwargs):
+    response = mock.Mock(status_code=200, headers={})
+    if "/catalog/" in url:
+        response.text = DOCUMENT_PAGES[url.split("/catalog/")[1].split("/")[0]]
+    else:
+        response.text = SEARCH_PAGE
+    return response
+
+
+class TestWebScraper(unittest.TestCase):
+    def setUp(self):
+        self.sources = {"Test": ["https://catalog.test/?q={number}", "https://catalog.test/catalog"]}
+        self.capture_directory = 'test_web_pages'
+        # Code reading the settings itself gets these, instead of loading or creating config.json
+        self.previous_settings = config.use_settings(self.settings())
+
+    def tearDown(self):
+        config.use_settings(self.previous_settings)
+        if os.path.exists(self.capture_directory):
+            shutil.rmtree(self.capture_directory)
+
+    def scrape(self, settings, get=fake_get):
+        with mock.patch.object(config, 'get_settings', return_value=settings), \
+                mock.patch.object(webScraper.requests, 'get', side_effect=get), \
+                mock.patch.object(webScraper, 'download_directory', self.capture_directory):
+            try:
+                return webScraper.parse_data({'isbn': '9780192843845'}, '9780192843845',
+                                             {'retrieve_oclc': True, 'retrieve_lccn': True}, "Test")
+            finally:
+                # Pages left downloading after the search returned finish before the fakes are taken away
+                webScraper.close()
+
+    def settings(self, **extra):
+        return config.Settings.from_dict({"web_scraping_sources": self.sources,
+                                          "rate_limits": {"Web scraping": {"rate": 1000, "burst": 1000}},
+                                          "response_cache_ttl": 0, **extra})
+
+    def test_extract(self):
+        rules = webScraper.ExtractionRules()
+        self.assertEqual(rules.extract(SEARCH_PAGE)['document_ids'], ["B123", "B456"])
+        self.assertEqual(rules.extract(DOCUMENT_PAGES["B123"]), {'document_ids': [], 'lccn': ["QA76.73 P98 2003"],
+                                                                  'oclc': ["12345"]})
+
+    def test_source_rules(self):
+        settings = self.settings(web_scraping_rules={"Test": {"oclc": [r'OCLC Number: </dt> (\d)']}})
+        with mock.patch.object(config, 'get_settings', return_value=settings):
+            rules = webScraper.get_rules("Test")
+            self.assertIs(webScraper.get_rules("Test"), rules)
+        self.assertEqual(rules.extract(DOCUMENT_PAGES["B456"])['oclc'], ["6"])
+
+    def test_parse_data_in_memory(self):
+        entry = self.scrape(self.settings())
+
+        self.assertEqual(entry, {'isbn': '9780192843845', 'lccn': 'QA76.73 P98 2003', 'source': 'Test',
+                                 'oclc': '12345'})
+        self.assertFalse(os.path.exists(self.capture_directory))
+
+    def test_parallel_document_pages(self):
+        document_ids = [f"B{number}" for number in range(12)]
+        search_page = " ".join(f'<a href="/catalog/{doc_id}">' for doc_id in document_ids)
+        downloading = []
+        most_at_once = []
+        requested = []
+        lock = threading.Lock()
+
+        def slow_get(url, **kwargs):
+            with lock:
+                requested.append(url)
+                downloading.append(url)
+                most_at_once.append(len(downloading))
+            time.sleep(0.05)
+            with lock:
+                downloading.remove(url)
+            doc_id = url.split("/catalog/")[1] if "/catalog/" in url else None
+            # Only the fourth document has the LCCN and the sixth the OCLC number
+            text = {None: search_page, "B3": DOCUMENT_PAGES["B123"].split("(OCoLC)")[0],
+                    "B5": DOCUMENT_PAGES["B456"]}.get(doc_id, "")
+            return mock.Mock(status_code=200, headers={}, text=text)
+
+        entry = self.scrape(self.settings(web_scraping_connections=3), slow_get)
+
+        self.assertEqual(entry, {'isbn': '9780192843845', 'lccn': 'QA76.73 P98 2003', 'source': 'Test',
+                                 'oclc': '678'})
+        # Pages were downloaded three at a time from the catalogue, and the rest were dropped once both were found
+        self.assertEqual(max(most_at_once), 3)
+        self.assertLess(len(requested), 1 + len(document_ids))
+
+    def test_capture(self):
+        download_document = webScraper._download_document
+
+        def first_page_first(url, done, library):
+            # The other document pages only start once the search is done with the first, which has everything
+            if not url.endswith("/B123"):
+                done.wait(5)
+            return download_document(url, done, library)
+
+        with mock.patch.object(webScraper, '_download_document', side_effect=first_page_first):
+            self.scrape(self.settings(web_scraping_capture=True))
+
+        # The search page and the first document page, the second was dropped without being downloaded
+        self.assertEqual(len(os.listdir(self.capture_directory)), 2)
+
+    def test_failures_open_the_checked_breaker(self):
+        # Document pages on another host than the search page count against the same catalogue
+        self.sources = {"Test": ["https://search.test/?q={number}", "https://catalog.test/catalog"]}
+        settings = self.settings(circuit_breaker_min_calls=2)
+
+        def failing_get(url, **kwargs):
+            if "/catalog/" in url:
+                return mock.Mock(status_code=503, headers={}, text="")
+            return fake_get(url)
+
+        sourceHealth.reset()
+        try:
+            self.scrape(settings, failing_get)
+            with mock.patch.object(config, 'get_settings', return_value=settings):
+                self.assertFalse(harvester.is_healthy("Test (Web scraping)", settings))
+        finally:
+            sourceHealth.reset()
+
+
+if __name__ == '__main__':
+    unittest.main()
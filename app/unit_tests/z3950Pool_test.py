@@ -0,0 +1,184 @@
+import unittest
+import shutil
+import socket
+import subprocess
+import sys
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from app import config
+from app.apis import z3950, z3950Pool
+from app.database import LMH_response_cache
+
+# Stand-in for the yaz-client that answers like one connected to a target holding a record for every ISBN without
+# "999" in it
+FAKE_YAZ_CLIENT = '''#!{python}
+import sys
+out = sys.stdout
+if "refuse" in sys.argv[1]:
+    out.write("Connecting...error\\nConnection refused\\nZ> ")
+    out.flush()
+    sys.exit()
+out.write("Connecting...OK.\\nSent initrequest.\\nConnection accepted by v3 target.\\nZ> ")
+out.flush()
+found = []
+for line in sys.stdin:
+    command = line.split()
+    if not command:
+        continue
+    if command[0] == "quit":
+        break
+    if command[0] == "find":
+        found = [word for word in command if word.isdigit() and "999" not in word]
+        out.write("Sent searchRequest.\\nReceived SearchResponse.\\nNumber of hits: %d, setno 1\\n" % len(found))
+    elif command[0] == "show":
+        count = int(command[1].split("+")[1]) if "+" in command[1] else 1
+        out.write("Sent presentRequest (1+%d).\\nRecords: %d\\n" % (count, count))
+        for isbn in found[:count]:
+            out.write("[Default]Record type: USmarc\\n020    $a " + isbn + " (pbk.)\\n")
+            out.write("050 00 $a QA76.73 $b .P98 " + isbn + "\\n079    $a (OCoLC)" + isbn[-6:] + "\\n")
+    out.write("Z> ")
+    out.flush()
+'''
+
+
+@unittest.skipIf(os.name == 'nt', "The stand-in yaz-client is a script run through its shebang line")
+class TestZ3950Pool(unittest.TestCase):
+    def setUp(self):
+        self.fake_client = os.path.abspath('test_fake_yaz_client.py')
+        with open(self.fake_client, 'w') as file:
+            file.write(FAKE_YAZ_CLIENT.replace('{python}', sys.executable))
+        os.chmod(self.fake_client, 0o755)
+        # Code reading the settings itself gets these, instead of loading or creating config.json
+        self.previous_settings = config.use_settings(config.Settings.from_dict({"rate_limits": {},
+                                                                               "response_cache_ttl": 0}))
+
+    def tearDown(self):
+        z3950Pool.close_all()
+        config.use_settings(self.previous_settings)
+        os.remove(self.fake_client)
+
+    def test_session_is_reused(self):
+        first = z3950Pool.search(self.fake_client, "localhost:9999/Default", "9780192843845", 5)
+        pid = z3950Pool.get_session(self.fake_client, "localhost:9999/Default", 5).process.pid
+        second = z3950Pool.search(self.fake_client, "localhost:9999/Default", "9780262033848", 5)
+
+        self.assertEqual(z3950.parse_text_marc(first), {'lccn': 'QA76.73 .P98 9780192843845', 'oclc': '843845'})
+        self.assertIn("9780262033848", second)
+        self.assertEqual(z3950Pool.get_session(self.fake_client, "localhost:9999/Default", 5).process.pid, pid)
+
+    def test_pipelined_searches(self):
+        isbns = [str(9780000000000 + number) for number in range(40)]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            outputs = list(executor.map(
+                lambda isbn: z3950Pool.search(self.fake_client, "localhost:9999/Default", isbn, 5), isbns))
+
+        # Every search gets the answer to its own commands even though they share one yaz-client
+        for isbn, output in zip(isbns, outputs):
+            self.assertEqual(z3950.parse_text_marc(output)['lccn'], 'QA76.73 .P98 ' + isbn)
+
+    def test_search_many_alongside_searches(self):
+        batches = [[str(9780000000000 + batch * 10 + number) for number in range(3)] for batch in range(20)]
+        isbns = [str(9780000000500 + number) for number in range(40)]
+
+        def batch_search(batch):
+            return z3950Pool.search_many(self.fake_client, "localhost:9999/Default", batch, 5)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            batch_outputs = [executor.submit(batch_search, batch) for batch in batches]
+            outputs = [executor.submit(z3950Pool.search, self.fake_client, "localhost:9999/Default", isbn, 5)
+                       for isbn in isbns]
+
+        # A single search's find never lands between a batch's find and the show fetching its records
+        for batch, output in zip(batches, batch_outputs):
+            records = z3950.split_records(output.result())
+            self.assertEqual([z3950.parse_text_marc(record)['lccn'] for record in records],
+                             ['QA76.73 .P98 ' + isbn for isbn in batch])
+        for isbn, output in zip(isbns, outputs):
+            self.assertEqual(z3950.parse_text_marc(output.result())['lccn'], 'QA76.73 .P98 ' + isbn)
+
+    def test_large_send_while_output_is_read(self):
+        # More commands than the pipe to the yaz-client holds, whose answers fill the pipe back before it has read
+        # them all. The reader must keep taking the output while the commands are still being written
+        session = z3950Pool.get_session(self.fake_client, "localhost:9999/Default", 5)
+        commands = ["find @attr 1=7 9780192843845"] * 20000
+        output = session.run(commands, 30)
+
+        self.assertEqual(output.count("Number of hits: 1"), len(commands))
+
+    def test_reconnects_after_session_dies(self):
+        session = z3950Pool.get_session(self.fake_client, "localhost:9999/Default", 5)
+        session.process.kill()
+        session.process.wait()
+
+        output = z3950Pool.search(self.fake_client, "localhost:9999/Default", "9780192843845", 5)
+        self.assertIn("Number of hits: 1", output)
+        self.assertIsNot(z3950Pool.get_session(self.fake_client, "localhost:9999/Default", 5), session)
+
+    def test_search_many(self):
+        isbns = ["9780192843845", "9780262033848", "9780999999999"]
+        output = z3950Pool.search_many(self.fake_client, "localhost:9999/Default", isbns, 5)
+
+        self.assertIn("Number of hits: 2", output)
+        records = z3950.split_records(output)
+        self.assertEqual(len(records), 2)
+        self.assertEqual(z3950.parse_text_marc(records[1])['lccn'], 'QA76.73 .P98 9780262033848')
+
+    def test_prefetch(self):
+        settings = config.Settings.from_dict({"z3950_sources": {"Fake": "localhost:9999/Default"},
+                                              "yaz_client_path": self.fake_client, "rate_limits": {},
+                                              "response_cache_ttl": 0})
+        isbns = [str(9780000000000 + number) for number in range(30)] + ["9780999999999"]
+        with mock.patch.object(config, 'get_settings', return_value=settings), \
+                mock.patch.object(z3950, 'run_yaz_client') as run_yaz_client:
+            z3950.prefetch(isbns, "Fake")
+            entries = [z3950.parse_data({'isbn': isbn}, isbn, {'retrieve_oclc': True, 'retrieve_lccn': True}, "Fake")
+                       for isbn in isbns]
+            prefetched_left = LMH_response_cache.is_known("Fake", isbns[0])
+
+        # Every answer came from the two batched searches, matched back to its ISBN through the 020 field
+        run_yaz_client.assert_not_called()
+        self.assertEqual(entries[12]['lccn'], 'QA76.73 .P98 9780000000012')
+        self.assertEqual(entries[29]['oclc'], '000029')
+        self.assertEqual(entries[30].get('lccn'), None)
+        self.assertFalse(prefetched_left)
+
+    def test_connection_refused(self):
+        with self.assertRaises(z3950Pool.Z3950Error):
+            z3950Pool.search(self.fake_client, "refuse:9999/Default", "9780192843845", 5)
+
+
+@unittest.skipUnless(shutil.which("yaz-client") and shutil.which("yaz-ztest"), "YAZ is not installed")
+class TestZ3950PoolWithYaz(unittest.TestCase):
+    def setUp(self):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        # yaz-ztest is YAZ's test server, it answers every search with generated records
+        self.server = subprocess.Popen(["yaz-ztest", f"tcp:127.0.0.1:{self.port}"], stdout=subprocess.DEVNULL,
+                                       stderr=subprocess.DEVNULL)
+        time.sleep(0.5)
+        self.previous_settings = config.use_settings(config.Settings.from_dict({"rate_limits": {},
+                                                                               "response_cache_ttl": 0}))
+
+    def tearDown(self):
+        z3950Pool.close_all()
+        config.use_settings(self.previous_settings)
+        self.server.kill()
+        self.server.wait()
+
+    def test_search_local_server(self):
+        target = f"tcp:127.0.0.1:{self.port}/Default"
+        first = z3950Pool.search(shutil.which("yaz-client"), target, "9780192843845", 10)
+        pid = z3950Pool.get_session(shutil.which("yaz-client"), target, 10).process.pid
+        second = z3950Pool.search(shutil.which("yaz-client"), target, "9780262033848", 10)
+
+        self.assertIn("Number of hits:", first)
+        self.assertIn("Number of hits:", second)
+        self.assertEqual(z3950Pool.get_session(shutil.which("yaz-client"), target, 10).process.pid, pid)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,5 @@
-from app.apis import harvardAPI, openLibraryAPI, locAPI, googleAPI, z3950, webScraper
-from app.database.LMH_database import Database
-from app import config, logs
+from app.apis import harvardAPI, openLibraryAPI, locAPI, googleAPI, sourceHealth
+from app import config, logs, harvester, progressBus
 from tkinter import filedialog
 from CTkListbox import *
 from CTkToolTip import *
@@ -12,6 +11,10 @@ import csv
 ui_map = {}
 stop_search_flag = False
 ui_has_been_disabled = False
+# The search thread never touches a widget, it publishes what happens here and the Tk loop shows it
+progress = progressBus.ProgressBus()
+# Milliseconds between two redraws of the logs textbox and the progress window
+FRAME_MS = 1000 // progressBus.FRAMES_PER_SECOND
 
 
 def read_input_file(file_path):
@@ -353,6 +356,38 @@ def set_timeout_value(timeout_value):
         return
 
 
+def change_max_workers():
+    max_workers_window = customtkinter.CTkInputDialog(
+        text="Type in how many values should be searched for at the same time.\nWarning! This will overwrite your "
+             "previous value!",
+        title="Change Parallel Searches")
+    max_workers = max_workers_window.get_input()
+    if max_workers is not None and max_workers != '':
+        set_max_workers(max_workers)
+
+
+def set_max_workers(max_workers):
+    try:
+        if int(max_workers) < 1:
+            CTkMessagebox(title="Error",
+                          message="Parallel searches must be at least 1.\nPlease provide a positive number when "
+                                  "trying to change parallel searches.",
+                          icon="cancel")
+            return
+
+        config_file = config.load_config()
+        config.set_max_workers(config_file, int(max_workers))
+        ui_map['max_workers_button'].configure(
+            text="Change Parallel Searches (" + str(config_file["max_workers"]) + ")")
+        CTkMessagebox(title="Info", message=f"{max_workers} values are now searched for at the same time.")
+    except ValueError:
+        CTkMessagebox(title="Error",
+                      message="Parallel searches must be a number.\nPlease provide a positive number when trying to "
+                              "change parallel searches.",
+                      icon="cancel")
+        return
+
+
 def change_yaz_client_path():
     config_file = config.load_config()
     yaz_client_path = filedialog.askopenfilename()
@@ -420,9 +455,44 @@ def save_order():
 
 
 def append_to_log(text):
-    ui_map['logs_textbox'].configure(state="normal")
-    ui_map['logs_textbox'].insert("end", text + '\n')
-    ui_map['logs_textbox'].configure(state="disabled")
+    # Safe to call from the search thread, the line is shown the next time show_progress runs
+    progress.log(text)
+
+
+def show_lines(lines):
+    if lines:
+        ui_map['logs_textbox'].configure(state="normal")
+        ui_map['logs_textbox'].insert("end", "\n".join(lines) + '\n')
+        ui_map['logs_textbox'].configure(state="disabled")
+
+
+def show_progress():
+    # Runs FRAME_MS apart on the Tk loop. Log lines are added in one go, everything else in the order it was published
+    lines = []
+    for event in progress.drain():
+        if event[0] == "log":
+            lines.append(event[1])
+            continue
+        show_lines(lines)
+        lines = []
+        if event[0] == "start":
+            open_progress_window()
+        elif event[0] == "finish":
+            close_progress_window()
+        elif event[0] == "notify":
+            CTkMessagebox(**event[1])
+        elif event[0] == "ask":
+            # The search thread waits for the answer. The next frame is only scheduled afterwards, so the dialog's
+            # own event loop does not drain the bus again
+            event[2].set_result(CTkMessagebox(**event[1]).get())
+    show_lines(lines)
+
+    if 'progress_bar' in ui_map:
+        status, hits = progress.describe()
+        ui_map['progress_bar'].set(progress.done / progress.total if progress.total else 0)
+        ui_map['progress_status_label'].configure(text=status)
+        ui_map['progress_hits_label'].configure(text=hits)
+    ui_map['root'].after(FRAME_MS, show_progress)
 
 
 def start_search():
@@ -453,7 +523,26 @@ def start_search():
     ui_map['logs_textbox'].delete(0.0, "end")
     ui_map['logs_textbox'].configure(state="disabled")
 
-    thread = threading.Thread(target=search)
+    # Windows are closed here, the search thread does not touch any widget
+    for window in ('z3950_config_window', 'web_scraping_config_window'):
+        if ui_map.get(window):
+            ui_map[window].destroy()
+
+    # Everything the search needs from the widgets is read now and handed to it
+    retrieval_settings = {
+        'retrieve_isbn': ui_map['retrieve_isbn_switch'].get() == 1,
+        'retrieve_oclc': ui_map['retrieve_oclc_switch'].get() == 1,
+        'retrieve_lccn': ui_map['retrieve_lccn_switch'].get() == 1
+    }
+
+    # Define the ordered sources based on source priorities
+    sources_list_box = ui_map['sources_list_box']
+    source_order = [sources_list_box.get(i) for i in range(sources_list_box.size())]
+    ordered_sources = [source_order[index] for index in sources_list_box.curselection()]
+
+    thread = threading.Thread(target=search, args=(ui_map['file_path'].cget('text'), ui_map['output_file_field'].get(),
+                                                   ui_map["input_type"], retrieval_settings, source_order,
+                                                   ordered_sources))
     thread.start()
     check_thread_status(thread)
 
@@ -474,6 +563,7 @@ def check_thread_status(thread):
             ui_map['retrieve_oclc_switch'].configure(state="disabled")
             ui_map['retrieve_lccn_switch'].configure(state="disabled")
             ui_map['timeout_button'].configure(state="disabled")
+            ui_map['max_workers_button'].configure(state="disabled")
             ui_map['google_key_button'].configure(state="disabled")
             ui_map['yaz_client_button'].configure(state="disabled")
             ui_map['z3950_button'].configure(state="disabled")
@@ -493,6 +583,7 @@ def check_thread_status(thread):
         ui_map['retrieve_oclc_switch'].configure(state="normal")
         ui_map['retrieve_lccn_switch'].configure(state="normal")
         ui_map['timeout_button'].configure(state="normal")
+        ui_map['max_workers_button'].configure(state="normal")
         ui_map['google_key_button'].configure(state="normal")
         ui_map['yaz_client_button'].configure(state="normal")
         ui_map['z3950_button'].configure(state="normal")
@@ -501,209 +592,101 @@ def check_thread_status(thread):
     return
 
 
-def search():
+def search(file_path, output_file, input_type, retrieval_settings, source_order, ordered_sources):
     config_file = config.load_config()
 
-    db_manager = Database('LMH_database.db')
-
-    retrieval_settings = {}
-    dont_use_api = {"dont_continue_search": False, "dont_use_harvard": False, "dont_use_openlibrary": False,
-                    "dont_use_loc": False, "dont_use_google": False, "dont_use_z3950": False}
+    dont_use_api = harvester.new_dont_use_api()
     is_isbn = False
     is_oclc = False
     global stop_search_flag
 
-    if ui_map['retrieve_isbn_switch'].get() == 1:
-        retrieval_settings['retrieve_isbn'] = True
-    else:
-        retrieval_settings['retrieve_isbn'] = False
-    if ui_map['retrieve_oclc_switch'].get() == 1:
-        retrieval_settings['retrieve_oclc'] = True
-    else:
-        retrieval_settings['retrieve_oclc'] = False
-    if ui_map['retrieve_lccn_switch'].get() == 1:
-        retrieval_settings['retrieve_lccn'] = True
-    else:
-        retrieval_settings['retrieve_lccn'] = False
-
-    try:
-        if ui_map['z3950_config_window']:
-            ui_map['z3950_config_window'].destroy()
-    except KeyError as e:
-        logs.log_info("No Z39.50 config window to close.")
-
-    try:
-        if ui_map['web_scraping_config_window']:
-            ui_map['web_scraping_config_window'].destroy()
-    except KeyError as e:
-        logs.log_info("No web scraping config window to close.")
-
-    input_data = read_input_file(ui_map['file_path'].cget('text'))
+    input_data = read_input_file(file_path)
 
     # Check which type of input data we have
-    if ui_map["input_type"] == "isbn":
+    if input_type == "isbn":
         is_isbn = True
         append_to_log("Assuming list contains ISBN values.")
         if (retrieval_settings['retrieve_isbn'] and not retrieval_settings['retrieve_oclc'] and not
         retrieval_settings['retrieve_lccn']):
-            message = CTkMessagebox(title="Warning",
-                                    message="You currently only have retrieval for ISBNs selected while also inputting "
-                                            "a list of ISBNs. Do you still want to proceed?",
-                                    icon="warning", option_1="Yes", option_2="No")
-            if message.get() == "No":
+            answer = progress.ask(title="Warning",
+                                  message="You currently only have retrieval for ISBNs selected while also inputting "
+                                          "a list of ISBNs. Do you still want to proceed?",
+                                  icon="warning", option_1="Yes", option_2="No")
+            if answer == "No":
                 return
-    elif ui_map["input_type"] == "oclc":
+    elif input_type == "oclc":
         is_oclc = True
         append_to_log("Assuming list contains OCLC values.")
         if (not retrieval_settings['retrieve_isbn'] and retrieval_settings['retrieve_oclc'] and not
         retrieval_settings['retrieve_lccn']):
-            message = CTkMessagebox(title="Warning",
-                                    message="You currently only have retrieval for OCLC values selected while also "
-                                            "inputting a list of OCLC values. Do you still want to proceed?",
-                                    icon="warning", option_1="Yes", option_2="No")
-            if message.get() == "No":
+            answer = progress.ask(title="Warning",
+                                  message="You currently only have retrieval for OCLC values selected while also "
+                                          "inputting a list of OCLC values. Do you still want to proceed?",
+                                  icon="warning", option_1="Yes", option_2="No")
+            if answer == "No":
                 return
 
-    progress_window = create_progress_window()
-    progress_window.grid_rowconfigure((0, 4), weight=1)
-    progress_window.grid_columnconfigure((0, 2), weight=1)
-
-    logs_label = customtkinter.CTkLabel(master=progress_window, text="Please wait while the search process is "
-                                                                     "running. \nThis might take several minutes.")
-    logs_label.grid(column=1, row=1, padx=25, pady=(0, 10), sticky="nsew")
-
-    progress_bar = customtkinter.CTkProgressBar(master=progress_window, orientation="horizontal")
-    progress_bar.grid(column=1, row=2, padx=20, pady=10, sticky="nsew")
-    progress_bar.set(0)
-
-    stop_button = customtkinter.CTkButton(progress_window, text="Stop Search", width=125, command=stop_search)
-    stop_button.grid(column=1, row=3, padx=20, pady=10)
-    ui_map['stop_button'] = stop_button
+    progress.start(len(input_data))
 
     # Initialize metadata list
     metadata = []
 
-    # Define the ordered sources based on source priorities
-    sources_list_box = ui_map['sources_list_box']
-    priorities = sources_list_box.curselection()
-    source_order = [sources_list_box.get(i) for i in range(sources_list_box.size())]
-    ordered_sources = [source_order[index] for index in priorities]
-
     config.save_source_configuration(config_file, source_order)
 
-    dont_use_api = check_status(dont_use_api, ordered_sources, input_data[0], is_isbn, is_oclc)
+    dont_use_api = check_status(dont_use_api, ordered_sources, is_isbn, is_oclc)
 
     if dont_use_api["dont_continue_search"]:
-        progress_window.destroy()
+        progress.finish()
         append_to_log("Search process has been cancelled.")
         return
 
-    for index, number in enumerate(input_data):
-
-        if stop_search_flag is True:
-            append_to_log("Process is being manually stopped... Please wait... Last Processed value was: " + number)
-            break
-
-        if is_isbn:
-            entry = {'isbn': number}
-            if db_manager.is_in_database(number, "ISBN"):
-                database_entry = db_manager.get_metadata(number, 0)
-
-                if retrieval_settings['retrieve_oclc']:
-                    entry.update({
-                        'oclc': database_entry[1]
-                    })
-                if retrieval_settings['retrieve_lccn']:
-                    entry.update({
-                        'lccn': database_entry[2][0][0],
-                        'source': database_entry[2][0][1]
-                    })
-
-        if is_oclc:
-            entry = {'oclc': number}
-            if db_manager.is_in_database(number, "OCN"):
-                database_entry = db_manager.get_metadata(number, 1)
-
-                if retrieval_settings['retrieve_isbn']:
-                    entry.update({
-                        'isbn': database_entry[0]
-                    })
-                if retrieval_settings['retrieve_lccn']:
-                    entry.update({
-                        'lccn': database_entry[2][0][0],
-                        'source': database_entry[2][0][1]
-                    })
-
-        # Skip this iteration of the loop if all the data has been retrieved from the database or if we
-        # said we didn't want it
-        if (((entry.get('isbn') and entry.get('isbn') != '') or not retrieval_settings['retrieve_isbn']) and
-                ((entry.get('oclc') and entry.get('oclc') != '') or not retrieval_settings['retrieve_oclc']) and
-                ((entry.get('lccn') and entry.get('lccn') != '') or not retrieval_settings['retrieve_lccn'])):
-            # Append the entry to metadata
-            metadata.append(entry)
-            # Update the progress bar
-            progress_bar.set((index + 1) / len(input_data))
-            continue
+    # Take one snapshot of the settings for the whole search so sources never have to read the config file
+    settings = config.get_settings(reload=True)
+    db_manager = harvester.open_database(settings)
 
-        # Check sources in the specified priority order
-        for source in ordered_sources:
+    # Carry on from where the last search of this file stopped, if it was interrupted
+    journal = harvester.open_journal()
+    already_done = journal.start(harvester.journal_key(file_path, ordered_sources, retrieval_settings, is_isbn))
+    if already_done:
+        append_to_log(f"Resuming the previous search of this file, {already_done} values were already done.")
 
-            # Check if Harvard is the next source
-            if source == 'Harvard (API)' and not dont_use_api["dont_use_harvard"]:
-                entry = harvardAPI.parse_harvard_data(entry, number, retrieval_settings)
-
-            # Check if OpenLibrary is the next source
-            elif source == 'Open Library (API)' and not dont_use_api["dont_use_openlibrary"]:
-                entry = openLibraryAPI.parse_open_library_data(entry, number, retrieval_settings, is_oclc, is_isbn)
-
-            # Check if LOC is the next source
-            elif source == 'LOC (API)' and not dont_use_api["dont_use_loc"]:
-                entry = locAPI.parse_loc_data(entry, number, retrieval_settings, is_oclc)
-
-            # Check if Google Books is the next source
-            elif source == 'Google Books (API)' and not dont_use_api["dont_use_google"]:
-                entry = googleAPI.parse_google_data(entry, number, retrieval_settings, is_oclc, is_isbn)
-
-            # Check if a Z39.50 is the next source
-            elif source.split("(")[0].strip() in config_file["z3950_sources"] and not dont_use_api["dont_use_z3950"]:
-                entry = z3950.parse_data(entry, number, retrieval_settings, source.split("(")[0].strip())
-
-            # Check if a Web Scraping is the next source
-            elif source.split("(")[0].strip() in config_file["web_scraping_sources"]:
-                entry = webScraper.parse_data(entry, number, retrieval_settings, source.split("(")[0].strip())
-
-            # Break out of the loop if data has been retrieved for the current source excluding stuff we said we
-            # didn't want
-            if (((entry.get('isbn') and entry.get('isbn') != '') or not retrieval_settings['retrieve_isbn']) and
-                    ((entry.get('oclc') and entry.get('oclc') != '') or not retrieval_settings['retrieve_oclc']) and
-                    ((entry.get('lccn') and entry.get('lccn') != '') or not retrieval_settings['retrieve_lccn'])):
-                break
+    last_number = None
+    try:
+        for index, number, entry in harvester.harvest(input_data, ordered_sources, retrieval_settings, dont_use_api,
+                                                      settings, db_manager, is_isbn, is_oclc,
+                                                      stop_requested=lambda: stop_search_flag, journal=journal):
+            last_number = number
 
-        db_manager.insert(entry.get('isbn', ''), entry.get('oclc', ''), entry.get('lccn', ''),
-                          entry.get('source', ''), is_isbn)
+            # Append the entry to metadata
+            metadata.append(entry)
 
-        # Append the entry to metadata
-        metadata.append(entry)
+            # The progress window is redrawn from the Tk loop, this only counts the value
+            progress.advance(entry.get('source', ''))
+    finally:
+        db_manager.close()
+        journal.close()
 
-        # Update the progress bar
-        progress_bar.set((index + 1) / len(input_data))
+    if stop_search_flag is True:
+        append_to_log("Process is being manually stopped... Please wait... Last Processed value was: " +
+                      str(last_number))
 
-    if ui_map['output_file_field'].get() is not None and ui_map['output_file_field'].get() != '':
+    if output_file is not None and output_file != '':
         # Write metadata to output file
-        write_to_output(metadata, ui_map['output_file_field'].get())
+        write_to_output(metadata, output_file)
 
     global ui_has_been_disabled
     ui_has_been_disabled = False
 
-    progress_window.destroy()
+    progress.finish()
+    progress.notify(title="Process Complete", message="Process is complete.", icon="check")
 
-    CTkMessagebox(title="Process Complete", message="Process is complete.", icon="check")
 
-
-def check_status(dont_use_api, ordered_sources, number, is_isbn, is_oclc):
+def check_status(dont_use_api, ordered_sources, is_isbn, is_oclc):
+    # Sources are not probed up front any more, each one's requests are tracked during the search and a source that
+    # keeps failing is skipped until it answers again
     append_to_log("Performing API status checks:")
 
-    config_file = config.load_config()
+    settings = config.get_settings()
 
     # Check sources in the specified priority order
     for source in ordered_sources:
@@ -714,81 +697,65 @@ def check_status(dont_use_api, ordered_sources, number, is_isbn, is_oclc):
         # Check if Harvard is the next source
         if source == 'Harvard (API)':
             if not is_isbn:
-                message = CTkMessagebox(title="Warning",
-                                        message="Harvard API requires ISBN values as input. Currently you have input "
-                                                "oclc values. Would you like to proceed without using the Harvard API?",
-                                        icon="warning", option_1="Yes", option_2="No")
-                if message.get() == "No":
+                answer = progress.ask(title="Warning",
+                                      message="Harvard API requires ISBN values as input. Currently you have input "
+                                              "oclc values. Would you like to proceed without using the Harvard API?",
+                                      icon="warning", option_1="Yes", option_2="No")
+                if answer == "No":
                     dont_use_api["dont_continue_search"] = True
                     continue
-                elif message.get() == "Yes":
+                elif answer == "Yes":
                     dont_use_api["dont_use_harvard"] = True
                     continue
-            if harvardAPI.retrieve_data_from_harvard(number, True) == 200:
-                append_to_log("Harvard: Online")
-            else:
-                append_to_log("Harvard: Offline")
-                dont_use_api["dont_use_harvard"] = True
+            append_to_log(f"Harvard: {sourceHealth.describe(harvardAPI.SOURCE_NAME)}")
 
         # Check if OpenLibrary is the next source
         elif source == 'Open Library (API)':
-            if openLibraryAPI.retrieve_data_from_open_library(number, True, is_oclc, is_isbn) == 200:
-                append_to_log("Open Library: Online")
-            else:
-                append_to_log("Open Library: Offline")
-                dont_use_api["dont_use_openlibrary"] = True
+            append_to_log(f"Open Library: {sourceHealth.describe(openLibraryAPI.SOURCE_NAME)}")
 
         # Check if LOC is the next source
         elif source == 'LOC (API)':
-            if locAPI.retrieve_data_from_loc(number, True) == 200:
-                append_to_log("Library of Congress: Online")
-            else:
-                append_to_log("Library of Congress: Offline")
-                dont_use_api["dont_use_loc"] = True
+            append_to_log(f"Library of Congress: {sourceHealth.describe(locAPI.SOURCE_NAME)}")
 
         # Check if Google Books is the next source
         elif source == 'Google Books (API)':
-            if config_file["google_api_key"] == "YOUR_GOOGLE_API_KEY":
-                message = CTkMessagebox(title="Warning",
-                                        message="Google Books API requires the user to have a valid Google API key "
-                                                "saved using the settings menu. Would you like to proceed without "
-                                                "using the Google Books API?",
-                                        icon="warning", option_1="Yes", option_2="No")
-                if message.get() == "No":
+            if settings.google_api_key == "YOUR_GOOGLE_API_KEY":
+                answer = progress.ask(title="Warning",
+                                      message="Google Books API requires the user to have a valid Google API key "
+                                              "saved using the settings menu. Would you like to proceed without "
+                                              "using the Google Books API?",
+                                      icon="warning", option_1="Yes", option_2="No")
+                if answer == "No":
                     dont_use_api["dont_continue_search"] = True
                     continue
-                elif message.get() == "Yes":
+                elif answer == "Yes":
                     dont_use_api["dont_use_google"] = True
                     continue
-            if googleAPI.retrieve_data_from_google(number, True, is_oclc, is_isbn) == 200:
-                append_to_log("Google Books: Online")
-            else:
-                append_to_log("Google Books: Offline")
-                dont_use_api["dont_use_google"] = True
+            append_to_log(f"Google Books: {sourceHealth.describe(googleAPI.SOURCE_NAME)}")
 
-        elif source.split("(")[0].strip() in config_file["z3950_sources"] and not dont_use_api["dont_use_z3950"]:
+        elif source.split("(")[0].strip() in settings.z3950_sources and not dont_use_api["dont_use_z3950"]:
             if not is_isbn:
-                message = CTkMessagebox(title="Warning",
-                                        message="Z39.50 requires ISBN values as input. Currently you have input "
-                                                "oclc values. Would you like to proceed without using any Z39.50 "
-                                                "sources?",
-                                        icon="warning", option_1="Yes", option_2="No")
-                if message.get() == "No":
+                answer = progress.ask(title="Warning",
+                                      message="Z39.50 requires ISBN values as input. Currently you have input "
+                                              "oclc values. Would you like to proceed without using any Z39.50 "
+                                              "sources?",
+                                      icon="warning", option_1="Yes", option_2="No")
+                if answer == "No":
                     dont_use_api["dont_continue_search"] = True
                     continue
-                elif message.get() == "Yes":
+                elif answer == "Yes":
                     dont_use_api["dont_use_z3950"] = True
                     continue
-            if config_file["yaz_client_path"] == "":
-                message = CTkMessagebox(title="Warning",
-                                        message="Currently no path has been given for the Yaz Client which is required "
-                                                "to use any Z39.50 sources. Would you like to proceed without using "
-                                                "any Z39.50 sources?",
-                                        icon="warning", option_1="Yes", option_2="No")
-                if message.get() == "No":
+            if settings.yaz_client_path == "":
+                answer = progress.ask(title="Warning",
+                                      message="Currently no path has been given for the Yaz Client which is required "
+                                              "to use any Z39.50 sources. Would you like to proceed without using "
+                                              "any Z39.50 sources?",
+                                      icon="warning", option_1="Yes", option_2="No")
+                if answer == "No":
                     dont_use_api["dont_continue_search"] = True
                     continue
-                elif message.get() == "Yes":
+                elif answer == "Yes":
                     dont_use_api["dont_use_z3950"] = True
                     continue
 
@@ -801,12 +768,48 @@ def stop_search():
     ui_map['stop_button'].configure(state="disabled")
 
 
+def open_progress_window():
+    progress_window = create_progress_window()
+    progress_window.grid_rowconfigure((0, 6), weight=1)
+    progress_window.grid_columnconfigure((0, 2), weight=1)
+
+    logs_label = customtkinter.CTkLabel(master=progress_window, text="Please wait while the search process is "
+                                                                     "running. \nThis might take several minutes.")
+    logs_label.grid(column=1, row=1, padx=25, pady=(0, 10), sticky="nsew")
+
+    progress_bar = customtkinter.CTkProgressBar(master=progress_window, orientation="horizontal")
+    progress_bar.grid(column=1, row=2, padx=20, pady=10, sticky="nsew")
+    progress_bar.set(0)
+
+    status_label = customtkinter.CTkLabel(master=progress_window, text="")
+    status_label.grid(column=1, row=3, padx=20, pady=0)
+    hits_label = customtkinter.CTkLabel(master=progress_window, text="", wraplength=380)
+    hits_label.grid(column=1, row=4, padx=20, pady=0)
+
+    stop_button = customtkinter.CTkButton(progress_window, text="Stop Search", width=125, command=stop_search)
+    stop_button.grid(column=1, row=5, padx=20, pady=10)
+
+    ui_map['progress_window'] = progress_window
+    ui_map['progress_bar'] = progress_bar
+    ui_map['progress_status_label'] = status_label
+    ui_map['progress_hits_label'] = hits_label
+    ui_map['stop_button'] = stop_button
+
+
+def close_progress_window():
+    progress_window = ui_map.pop('progress_window', None)
+    for widget in ('progress_bar', 'progress_status_label', 'progress_hits_label'):
+        ui_map.pop(widget, None)
+    if progress_window is not None:
+        progress_window.destroy()
+
+
 def create_progress_window():
     progress_window = customtkinter.CTkToplevel()
     progress_window.title("Library Metadata Harvester - Progress")
     # Set window size
     window_width = 420
-    window_height = 145
+    window_height = 200
     # Get screen width and height
     screen_width = progress_window.winfo_screenwidth()
     screen_height = progress_window.winfo_screenheight()
@@ -830,6 +833,7 @@ def disable_closing():
 
 def main():
     config_file = config.load_config()
+    logs.configure(config.get_settings(reload=True))
 
     root = create_window_and_move_to_center()
     ui_map['root'] = root
@@ -974,14 +978,22 @@ def main():
                                                        "on a per value basis per each\n"
                                                        "selected source.")
 
+    max_workers_button = customtkinter.CTkButton(settings_frame, text="Change Parallel Searches", width=50,
+                                                 command=change_max_workers)
+    max_workers_button.grid(row=4, column=0, padx=10, pady=5)
+    ui_map['max_workers_button'] = max_workers_button
+
+    CTkToolTip(max_workers_button, border_width=1, message="Number of values searched\n"
+                                                           "for at the same time.")
+
     google_key_button = customtkinter.CTkButton(settings_frame, text="Change Google API Key", width=50,
                                                 command=change_google_key)
-    google_key_button.grid(row=4, column=0, padx=10, pady=5)
+    google_key_button.grid(row=5, column=0, padx=10, pady=5)
     ui_map['google_key_button'] = google_key_button
 
     yaz_client_button = customtkinter.CTkButton(settings_frame, text="Change YAZ Client Path", width=50,
                                                 command=change_yaz_client_path)
-    yaz_client_button.grid(row=5, column=0, padx=10, pady=5)
+    yaz_client_button.grid(row=6, column=0, padx=10, pady=5)
     ui_map['yaz_client_button'] = yaz_client_button
 
     yaz_client_path = config_file["yaz_client_path"]
@@ -992,13 +1004,13 @@ def main():
 
     z3950_button = customtkinter.CTkButton(settings_frame, text="Change Z39.50 Settings", width=50,
                                            command=open_z3950_config)
-    z3950_button.grid(row=6, column=0, padx=10, pady=5)
+    z3950_button.grid(row=7, column=0, padx=10, pady=5)
     ui_map['z3950_button'] = z3950_button
 
     web_scraping_button = customtkinter.CTkButton(settings_frame, text="Change Web Scraping Settings",
                                                   width=50,
                                                   command=open_web_scraping_config)
-    web_scraping_button.grid(row=7, column=0, padx=10, pady=5)
+    web_scraping_button.grid(row=8, column=0, padx=10, pady=5)
     ui_map['web_scraping_button'] = web_scraping_button
 
     # Set default values
@@ -1007,6 +1019,7 @@ def main():
     change_appearance_mode(config_file["appearance_mode"])
 
     timeout_button.configure(text="Change Timeout Value (" + str(config_file["search_timeout"]) + " secs)")
+    max_workers_button.configure(text="Change Parallel Searches (" + str(config_file["max_workers"]) + ")")
 
     ui_map['isbn_radio_button'].select()
     ui_map['input_type'] = "isbn"
@@ -1026,6 +1039,7 @@ def main():
     else:
         retrieve_lccn_switch.select()
 
+    root.after(FRAME_MS, show_progress)
     root.mainloop()
 
 
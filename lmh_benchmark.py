@@ -0,0 +1,235 @@
+from app.apis import sourceHealth, webScraper, z3950Pool
+from app.benchmark import mockCatalogue
+from app.database.LMH_database import Database
+from app import config, harvester
+from lmh_cli import read_input_values, print_message
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where peak memory is not reported
+    resource = None
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SAMPLES = os.path.join(REPO_ROOT, "app", "test_data", "*_sample_*")
+# Limit every stand-in is searched under, high enough that the rate limits never slow the benchmark down
+UNLIMITED = {"rate": 1000000, "burst": 1000000}
+
+# Runs the stand-in yaz-client with the benchmark's options, the target it is started with is ignored
+YAZ_CLIENT_SCRIPT = '''#!{python}
+import sys
+sys.path.insert(0, {repo_root!r})
+from app.benchmark import mockCatalogue
+mockCatalogue.main(["--yaz-client"] + {options!r})
+'''
+
+
+def catalogue_options(args):
+    # The options the stand-ins are started with, the same for the server and the yaz-client
+    options = ["--latency", str(args.latency), "--error-rate", str(args.error_rate), "--coverage",
+               str(args.coverage), "--seed", str(args.seed)]
+    for value in args.source_latency or []:
+        options += ["--source-latency", value]
+    return options
+
+
+def start_server(options):
+    """
+    Starts the stand-in server in its own process, so it does not add
+    to the harvest's time or memory, and returns the process and the
+    base URL it serves on.
+    """
+    server = subprocess.Popen([sys.executable, "-m", "app.benchmark.mockCatalogue"] + options, cwd=REPO_ROOT,
+                              stdout=subprocess.PIPE, text=True)
+    line = server.stdout.readline()
+    if not line.startswith("Serving on port"):
+        server.kill()
+        server.wait()
+        raise RuntimeError("The stand-in server did not start")
+    return server, f"http://127.0.0.1:{line.split()[-1]}"
+
+
+def write_yaz_client(directory, options):
+    # The stand-in yaz-client is a script run through its shebang line, which Windows cannot do
+    if os.name == 'nt':
+        return None
+    path = os.path.join(directory, "yaz_client.py")
+    with open(path, 'w') as file:
+        file.write(YAZ_CLIENT_SCRIPT.format(python=sys.executable, repo_root=REPO_ROOT, options=options))
+    os.chmod(path, 0o755)
+    return path
+
+
+def benchmark_settings(base_url, yaz_client_path, workers, race_sources):
+    """
+    Returns the Settings a benchmark harvest runs with: every API sent
+    to the stand-in server, one stand-in Z39.50 target and Blacklight
+    catalogue, no rate limits and no response cache.
+    """
+    z3950_sources = {"Mock": "localhost:210/Default"} if yaz_client_path else {}
+    return config.Settings.from_dict({
+        "google_api_key": "benchmark",
+        "max_workers": workers,
+        "race_sources": race_sources,
+        "yaz_client_path": yaz_client_path or "",
+        "z3950_sources": z3950_sources,
+        "web_scraping_sources": {"Mock Blacklight": [f"{base_url}/blacklight/catalog?q={{number}}",
+                                                     f"{base_url}/blacklight/catalog"]},
+        "ordered_sources": (["Harvard (API)", "Open Library (API)", "LOC (API)", "Google Books (API)"] +
+                            [name + " (Z39.50)" for name in z3950_sources] + ["Mock Blacklight (Web)"]),
+        "api_base_urls": {
+            "http://webservices.lib.harvard.edu": f"{base_url}/harvard",
+            "https://openlibrary.org": f"{base_url}/openlibrary",
+            "http://openlibrary.org": f"{base_url}/openlibrary",
+            "https://www.loc.gov": f"{base_url}/loc",
+            "https://www.googleapis.com": f"{base_url}/google"
+        },
+        "rate_limits": {name: UNLIMITED for name in
+                        ("Harvard", "Open Library", "LOC", "Google Books", "Web scraping", "Z39.50")},
+        "rate_limit_file": "",
+        "response_cache_ttl": 0
+    })
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def peak_memory_mb():
+    # Peak resident size of the process so far. ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_sample(path, settings, database_name):
+    """
+    Harvests every value in a sample file from the stand-ins and
+    returns a dictionary with how it went. A value's latency is the
+    time from the harvester reading it to handing back its result.
+    """
+    with open(path, 'r', newline='') as file:
+        values = list(read_input_values(file))
+    is_isbn = "isbn" in os.path.basename(path)
+    retrieval_settings = {'retrieve_isbn': not is_isbn, 'retrieve_oclc': is_isbn, 'retrieve_lccn': True}
+    dont_use_api = harvester.new_dont_use_api()
+    if not is_isbn:
+        # Harvard and Z39.50 are only searched by ISBN, the same as a search from the GUI
+        dont_use_api.update({"dont_use_harvard": True, "dont_use_z3950": True})
+
+    read_at = {}
+
+    def timed_values():
+        for index, value in enumerate(values):
+            read_at[index] = time.perf_counter()
+            yield value
+
+    db_manager = Database(database_name, persistent=True, batch_size=settings.db_batch_size,
+                          batch_interval=settings.db_batch_interval)
+    latencies = []
+    filled = 0
+    started = time.perf_counter()
+    try:
+        for index, number, entry in harvester.harvest(timed_values(), settings.ordered_sources, retrieval_settings,
+                                                      dont_use_api, settings, db_manager, is_isbn, not is_isbn):
+            latencies.append(time.perf_counter() - read_at.pop(index))
+            filled += harvester.is_complete(entry, retrieval_settings)
+    finally:
+        db_manager.close()
+    seconds = time.perf_counter() - started
+
+    return {
+        'sample': os.path.basename(path),
+        'values': len(values),
+        'filled': filled,
+        'seconds': seconds,
+        'ids_per_second': len(values) / seconds if seconds else None,
+        'p50_ms': percentile(latencies, 0.5) * 1000 if latencies else None,
+        'p99_ms': percentile(latencies, 0.99) * 1000 if latencies else None,
+        'peak_memory_mb': peak_memory_mb()
+    }
+
+
+def run_benchmark(samples, args):
+    """
+    Starts the stand-ins and harvests every sample file from them in
+    turn, smallest first so the peak memory reported for a sample is
+    the most any sample so far needed. Returns one result per sample,
+    see run_sample.
+    """
+    options = catalogue_options(args)
+    server, base_url = start_server(options)
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            settings = benchmark_settings(base_url, write_yaz_client(directory, options), args.workers,
+                                          args.race_sources)
+            previous_settings = config.use_settings(settings)
+            # Breakers are made with the settings they are first used under
+            sourceHealth.reset()
+            try:
+                return [run_sample(path, settings, os.path.join(directory, f"benchmark_{index}.db"))
+                        for index, path in enumerate(sorted(samples, key=os.path.getsize))]
+            finally:
+                webScraper.close()
+                z3950Pool.close_all()
+                config.use_settings(previous_settings)
+                sourceHealth.reset()
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def format_results(results):
+    lines = [f"{'sample':<28}{'values':>8}{'filled':>8}{'ids/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'peak MB':>10}"]
+    for result in results:
+        peak = f"{result['peak_memory_mb']:.1f}" if result['peak_memory_mb'] is not None else "-"
+        lines.append(f"{result['sample']:<28}{result['values']:>8}{result['filled']:>8}"
+                     f"{result['ids_per_second']:>10.1f}{result['p50_ms']:>10.1f}{result['p99_ms']:>10.1f}{peak:>10}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark full harvests against local stand-ins for every source, "
+                                                 "without network access")
+    parser.add_argument("--samples", action="append",
+                        help="Sample file or glob to harvest, can be given more than once. Defaults to "
+                             "app/test_data/*_sample_*.")
+    parser.add_argument("--workers", type=int, default=config.DEFAULT_CONFIG["max_workers"],
+                        help="Number of values searched for at the same time.")
+    parser.add_argument("--race-sources", type=int, default=1,
+                        help="Number of sources searched at the same time for each value.")
+    parser.add_argument("--json", help="Also write the results to this file as JSON.")
+    mockCatalogue.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    try:
+        mockCatalogue.parse_source_latency(args.source_latency)
+    except ValueError as e:
+        print_message(f"Error: {e}")
+        return 1
+    samples = sorted({path for pattern in (args.samples or [DEFAULT_SAMPLES]) for path in glob.glob(pattern)})
+    if not samples:
+        print_message("Error: No sample files found.")
+        return 1
+
+    results = run_benchmark(samples, args)
+    print(format_results(results))
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
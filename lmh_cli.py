@@ -0,0 +1,343 @@
+from app.apis import harvardAPI, openLibraryAPI, locAPI, googleAPI, sourceHealth
+from app import config, logs, harvester, metrics, isbnNormalization
+import argparse
+import csv
+import dataclasses
+import itertools
+import os
+import signal
+import sys
+
+HEADER = ['ISBN', 'OCLC', 'LCCN', 'LCCN-Source']
+DEFAULT_SOURCES = ["Harvard (API)", "Open Library (API)", "LOC (API)", "Google Books (API)"]
+# Short names accepted by --search-sources for the API sources
+SOURCE_ALIASES = {
+    "harvard": "Harvard (API)",
+    "openlibrary": "Open Library (API)",
+    "loc": "LOC (API)",
+    "google": "Google Books (API)"
+}
+# Values harvested between progress messages
+PROGRESS_INTERVAL = 1000
+
+stop_search_flag = False
+
+
+def read_input_values(file):
+    """
+    Generator yielding the value in the first column of every line of
+    a tab-delimited file, one line at a time so input of any size can
+    be streamed. Blank lines are skipped.
+    """
+    for row in csv.reader(file, delimiter='\t'):
+        if row and row[0].strip():
+            yield row[0].strip()
+
+
+def guess_input_type(value):
+    """
+    Returns "isbn" if value is an ISBN with a valid check character and
+    "oclc" otherwise. Returns None for ten plain digits that pass the
+    ISBN-10 check, since an OCLC number can look exactly like that.
+    """
+    if not isbnNormalization.is_valid_isbn(value):
+        return "oclc"
+    if len(value) == 10 and value.isdigit():
+        return None
+    return "isbn"
+
+
+def write_row(writer, entry):
+    writer.writerow([
+        entry.get('isbn', ''),
+        entry.get('oclc', ''),
+        entry.get('lccn', ''),
+        entry.get('source', '')
+    ])
+
+
+def print_message(message):
+    # Messages go to stderr so the results can be piped from stdout
+    print(message, file=sys.stderr)
+
+
+def resolve_sources(search_sources, source_priorities, settings):
+    """
+    Returns the sources to search in priority order. search_sources is
+    a comma-separated list of source names, either as shown in the GUI
+    ("LOC (API)", "Yale (Z39.50)") or as the old short names (harvard,
+    loc, openlibrary, google), or a bare Z39.50 or web scraping source
+    name. source_priorities optionally reorders them. Without
+    search_sources the order saved from the GUI is used.
+    """
+    if not search_sources:
+        if settings.ordered_sources:
+            return list(settings.ordered_sources)
+        return (DEFAULT_SOURCES + [name + " (Z39.50)" for name in settings.z3950_sources] +
+                [name + " (Web)" for name in settings.web_scraping_sources])
+
+    ordered_sources = []
+    for source in search_sources.split(','):
+        source = source.strip()
+        if source.lower() in SOURCE_ALIASES:
+            source = SOURCE_ALIASES[source.lower()]
+        elif source in settings.z3950_sources:
+            source = source + " (Z39.50)"
+        elif source in settings.web_scraping_sources:
+            source = source + " (Web)"
+        elif source not in DEFAULT_SOURCES and source.split("(")[0].strip() not in settings.z3950_sources and \
+                source.split("(")[0].strip() not in settings.web_scraping_sources:
+            raise ValueError(f"Unknown source: {source}")
+        ordered_sources.append(source)
+
+    if source_priorities:
+        priority_order = [int(priority) for priority in source_priorities.split(',')]
+        if len(priority_order) != len(ordered_sources):
+            raise ValueError("Please give one priority for every source.")
+        ordered_sources = [source for _, source in sorted(zip(priority_order, ordered_sources),
+                                                          key=lambda pair: pair[0])]
+    return ordered_sources
+
+
+def check_sources(dont_use_api, ordered_sources, settings, is_isbn, is_oclc):
+    """
+    Headless counterpart of the GUI's check_status. Sources that cannot
+    be used with this input or configuration are switched off with a
+    message instead of a prompt. Whether the others are online is
+    tracked during the search, see sourceHealth.
+    """
+    print_message("Performing API status checks:")
+
+    for source in ordered_sources:
+        if source == 'Harvard (API)':
+            if not is_isbn:
+                print_message("Harvard: Skipped, it requires ISBN values as input")
+                dont_use_api["dont_use_harvard"] = True
+            else:
+                print_message(f"Harvard: {sourceHealth.describe(harvardAPI.SOURCE_NAME)}")
+
+        elif source == 'Open Library (API)':
+            print_message(f"Open Library: {sourceHealth.describe(openLibraryAPI.SOURCE_NAME)}")
+
+        elif source == 'LOC (API)':
+            print_message(f"Library of Congress: {sourceHealth.describe(locAPI.SOURCE_NAME)}")
+
+        elif source == 'Google Books (API)':
+            if settings.google_api_key == "YOUR_GOOGLE_API_KEY":
+                print_message("Google Books: Skipped, no API key has been set with --set-google-key")
+                dont_use_api["dont_use_google"] = True
+            else:
+                print_message(f"Google Books: {sourceHealth.describe(googleAPI.SOURCE_NAME)}")
+
+        elif source.split("(")[0].strip() in settings.z3950_sources and not dont_use_api["dont_use_z3950"]:
+            if not is_isbn:
+                print_message("Z39.50: Skipped, it requires ISBN values as input")
+                dont_use_api["dont_use_z3950"] = True
+            elif settings.yaz_client_path == "":
+                print_message("Z39.50: Skipped, no path has been given for the Yaz Client")
+                dont_use_api["dont_use_z3950"] = True
+
+    return dont_use_api
+
+
+def request_stop(signum, frame):
+    # The first Ctrl+C lets the values already being searched finish, a second one stops straight away
+    global stop_search_flag
+    if stop_search_flag:
+        raise KeyboardInterrupt
+    stop_search_flag = True
+    print_message("Stopping after the values already being searched... Press Ctrl+C again to stop now.")
+
+
+def run_harvest(args, settings):
+    if args.retrieve_isbns or args.retrieve_ocns or args.retrieve_lccs:
+        retrieval_settings = {
+            'retrieve_isbn': args.retrieve_isbns,
+            'retrieve_oclc': args.retrieve_ocns,
+            'retrieve_lccn': args.retrieve_lccs
+        }
+    else:
+        # Without any retrieval flags the choices saved from the GUI are used
+        retrieval_settings = {
+            'retrieve_isbn': settings.retrieve_isbn,
+            'retrieve_oclc': settings.retrieve_oclc,
+            'retrieve_lccn': settings.retrieve_lccn
+        }
+
+    try:
+        ordered_sources = resolve_sources(args.search_sources, args.source_priorities, settings)
+    except ValueError as e:
+        print_message(f"Error: {e}")
+        return 1
+
+    input_file = sys.stdin if args.input == '-' else open(args.input, 'r', newline='')
+    output_file = sys.stdout if args.output == '-' else open(args.output, 'w', newline='', encoding='utf-8')
+    try:
+        values = read_input_values(input_file)
+        first_value = next(values, None)
+        if first_value is None:
+            print_message("Error: The input contains no values.")
+            return 1
+        # Put the first value back in front of the rest without reading any further
+        values = itertools.chain([first_value], values)
+
+        input_type = args.input_type or guess_input_type(first_value)
+        if input_type is None:
+            print_message(f"Error: {first_value} could be an ISBN or an OCLC number, use --input-type to say which.")
+            return 1
+        is_isbn = input_type == "isbn"
+        is_oclc = input_type == "oclc"
+        print_message(f"Assuming input contains {'ISBN' if is_isbn else 'OCLC'} values.")
+
+        dont_use_api = check_sources(harvester.new_dont_use_api(), ordered_sources, settings, is_isbn, is_oclc)
+
+        writer = csv.writer(output_file, delimiter='\t')
+        writer.writerow(HEADER)
+
+        db_manager = harvester.open_database(settings)
+        journal = harvester.open_journal()
+        key = harvester.journal_key(os.path.abspath(args.input) if args.input != '-' else '-', ordered_sources,
+                                    retrieval_settings, is_isbn)
+        already_done = journal.start(key)
+        if already_done and args.restart:
+            journal.finish()
+            already_done = journal.start(key)
+        if already_done:
+            print_message(f"Resuming the previous search of this input, {already_done} values were already done.")
+
+        harvested = 0
+        last_number = None
+        try:
+            for index, number, entry in harvester.harvest(values, ordered_sources, retrieval_settings, dont_use_api,
+                                                          settings, db_manager, is_isbn, is_oclc,
+                                                          max_workers=args.workers,
+                                                          stop_requested=lambda: stop_search_flag, journal=journal):
+                write_row(writer, entry)
+                # Rows are written out as soon as they are ready so a reader of the output can follow along
+                output_file.flush()
+                harvested = index + 1
+                last_number = number
+                if harvested % PROGRESS_INTERVAL == 0:
+                    print_message(f"{harvested} values harvested")
+        finally:
+            db_manager.close()
+            journal.close()
+
+        if stop_search_flag:
+            print_message(f"Process was manually stopped. Last processed value was: {last_number}")
+            logs.log_info(f"Command line search stopped after {harvested} values, last was {last_number}")
+        print_message(f"{harvested} values harvested.")
+        if args.metrics_summary:
+            print_message(metrics.get_metrics().summary())
+        return 0
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Library Metadata Harvester",
+                                     epilog="Results are written as tab-delimited rows while the search runs. Use "
+                                            "'-' to read from stdin or write to stdout.")
+
+    # Define command-line arguments
+    parser.add_argument("-i", "--input", default="-",
+                        help="Specify the input file containing ISBNs or OCNs, one per line. Defaults to stdin.")
+    parser.add_argument("-o", "--output", default="-",
+                        help="Specify the output file for tab-delimited results. Defaults to stdout.")
+    parser.add_argument("--input-type", choices=["isbn", "oclc"],
+                        help="Type of the input values. Guessed from the first value if not given.")
+    parser.add_argument("--retrieve-ocns", action="store_true", help="Retrieve associated OCNs (for ISBN input).")
+    parser.add_argument("--retrieve-isbns", action="store_true", help="Retrieve associated ISBNs (for OCN input).")
+    parser.add_argument("--retrieve-lccs", action="store_true", help="Retrieve Library of Congress Call Numbers.")
+    parser.add_argument("--search-sources",
+                        help="Specify internet sources to search (comma-separated). Examples include: harvard,"
+                             "loc,openlibrary,google or any Z39.50 or web scraping source name. Defaults to the "
+                             "order saved in the GUI.")
+    parser.add_argument("--source-priorities", help="Specify priority levels for internet sources (comma-separated).")
+    parser.add_argument("--restart", action="store_true",
+                        help="Start over instead of resuming an interrupted search of the same input.")
+    parser.add_argument("--workers", type=int, help="Number of values searched for at the same time.")
+    parser.add_argument("--race-sources", type=int,
+                        help="Number of sources searched at the same time for each value, keeping their priority "
+                             "order. Defaults to the race_sources setting.")
+    parser.add_argument("--adaptive-order", action="store_true",
+                        help="Search the sources that have filled in values fastest first, learning as the search "
+                             "runs. Defaults to the adaptive_source_order setting.")
+    parser.add_argument("--pin-sources",
+                        help="Sources that keep their place in the priority order when --adaptive-order moves the "
+                             "others (comma-separated, named as for --search-sources).")
+    parser.add_argument("--metrics-summary", action="store_true",
+                        help="Print how long every stage of the search took per source once it has finished.")
+    parser.add_argument("--metrics-prometheus", metavar="FILE",
+                        help="Write the stage times and counters to FILE in the Prometheus text format. Defaults to "
+                             "the metrics_prometheus_file setting.")
+    parser.add_argument("--metrics-jsonl", metavar="FILE",
+                        help="Append the stage times of every value searched for to FILE as JSON lines. Defaults to "
+                             "the metrics_jsonl_file setting.")
+    parser.add_argument("--set-timeout", help="Configure LMH timeout for requesting data from APIs. Default is 10 "
+                                              "seconds.")
+    parser.add_argument("--set-google-key", help="Configure which key the LMH should use for Google Books API, "
+                                                 "without one, searching via google books will be disallowed.")
+
+    # Parse command-line arguments
+    args = parser.parse_args(argv)
+
+    if args.set_google_key:
+        config_file = config.load_config()
+        config.set_google_key(config_file, args.set_google_key)
+        print_message(f"Google Books API key is now set to {args.set_google_key}")
+        return 0
+
+    if args.set_timeout:
+        try:
+            if int(args.set_timeout) < 0:
+                print_message("Error: Timeout value cannot be a negative number. Please provide a valid positive "
+                              "integer when trying to change timeout value.")
+                return 1
+
+            config_file = config.load_config()
+            config.set_search_timeout(config_file, int(args.set_timeout))
+            print_message(f"API timeout is now set to {args.set_timeout}")
+            return 0
+        except ValueError:
+            print_message("Error: Timeout value must be an integer. Please provide a valid positive integer when "
+                          "trying to change timeout value.")
+            return 1
+
+    # Take one snapshot of the settings for the whole search so sources never have to read the config file
+    settings = config.get_settings(reload=True)
+    logs.configure(settings)
+    if args.workers:
+        settings = dataclasses.replace(settings, max_workers=args.workers)
+    if args.race_sources:
+        settings = dataclasses.replace(settings, race_sources=args.race_sources)
+    if args.adaptive_order:
+        settings = dataclasses.replace(settings, adaptive_source_order=True)
+    if args.pin_sources:
+        try:
+            settings = dataclasses.replace(settings, pinned_sources=tuple(resolve_sources(args.pin_sources, None,
+                                                                                          settings)))
+        except ValueError as e:
+            print_message(f"Error: {e}")
+            return 1
+
+    if args.metrics_prometheus:
+        settings = dataclasses.replace(settings, metrics_prometheus_file=args.metrics_prometheus)
+    if args.metrics_jsonl:
+        settings = dataclasses.replace(settings, metrics_jsonl_file=args.metrics_jsonl)
+
+    signal.signal(signal.SIGINT, request_stop)
+    try:
+        return run_harvest(args, settings)
+    except FileNotFoundError as e:
+        print_message(f"Error: {e}")
+        return 1
+    finally:
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+
+
+if __name__ == "__main__":
+    sys.exit(main())